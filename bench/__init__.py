@@ -0,0 +1 @@
+# Benchmark and evaluation scripts (run with: python -m bench.<name>)
@@ -0,0 +1,84 @@
+"""
+Recall-vs-latency benchmark for the index kinds build_index.py can produce.
+
+    python -m bench.ann --sizes 1000,10000,50000 --dim 3072
+    python -m bench.ann --from-index data/index.faiss --sizes 2000,20000
+
+For every corpus size the exact flat index gives the ground truth; each
+HNSW efSearch / IVF nprobe setting is then scored by recall@k against it,
+together with p50/p99 single-query latency.
+"""
+import argparse
+import time
+
+import faiss
+
+from bench.common import (
+    grow_corpus, parse_ints, percentile, print_table, recall_at_k,
+    sample_queries, synthetic_corpus, timed_search, vectors_from_index,
+)
+from config import HNSW_M, HNSW_EF_CONSTRUCTION
+from index_store import apply_search_params, auto_nlist, build_ann_index
+
+
+def run(args):
+    base = vectors_from_index(args.from_index) if args.from_index else None
+    dim = base.shape[1] if base is not None else args.dim
+
+    rows = []
+    for n in parse_ints(args.sizes):
+        X = grow_corpus(base, n) if base is not None else synthetic_corpus(n, dim)
+        Q = sample_queries(X, args.queries)
+        print(f"\n📐 n={n} dim={dim} queries={len(Q)}")
+
+        flat, _ = build_ann_index(X, "flat")
+        truth, lat = timed_search(flat, Q, args.k)
+        rows.append([n, "flat", "-", "-", "1.000", f"{percentile(lat, 50):.2f}", f"{percentile(lat, 99):.2f}"])
+
+        t0 = time.perf_counter()
+        hnsw, params = build_ann_index(X, "hnsw", {"M": args.hnsw_m, "efConstruction": args.ef_construction, "efSearch": 16})
+        build_s = time.perf_counter() - t0
+        for ef in parse_ints(args.ef_search):
+            apply_search_params(hnsw, "hnsw", {"efSearch": ef})
+            found, lat = timed_search(hnsw, Q, args.k)
+            rows.append([n, "hnsw", f"M={params['M']} efSearch={ef}", f"{build_s:.1f}",
+                         f"{recall_at_k(found, truth, args.k):.3f}",
+                         f"{percentile(lat, 50):.2f}", f"{percentile(lat, 99):.2f}"])
+
+        t0 = time.perf_counter()
+        nlist = args.nlist or auto_nlist(n)
+        ivf, params = build_ann_index(X, "ivf", {"nlist": nlist, "nprobe": 1})
+        build_s = time.perf_counter() - t0
+        for nprobe in parse_ints(args.nprobe):
+            if nprobe > params["nlist"]:
+                continue
+            apply_search_params(ivf, "ivf", {"nprobe": nprobe})
+            found, lat = timed_search(ivf, Q, args.k)
+            rows.append([n, "ivf", f"nlist={params['nlist']} nprobe={nprobe}", f"{build_s:.1f}",
+                         f"{recall_at_k(found, truth, args.k):.3f}",
+                         f"{percentile(lat, 50):.2f}", f"{percentile(lat, 99):.2f}"])
+
+    print()
+    print_table(["n", "kind", "params", "build_s", f"recall@{args.k}", "p50_ms", "p99_ms"], rows)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="HNSW / IVF recall and latency against the flat index")
+    ap.add_argument("--from-index", help="flat index.faiss whose vectors seed the corpus (default: synthetic)")
+    ap.add_argument("--sizes", default="1000,10000,50000")
+    ap.add_argument("--dim", type=int, default=3072, help="synthetic vector size")
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("--k", type=int, default=10)
+    ap.add_argument("--hnsw-m", type=int, default=HNSW_M)
+    ap.add_argument("--ef-construction", type=int, default=HNSW_EF_CONSTRUCTION)
+    ap.add_argument("--ef-search", default="16,32,64,128,256")
+    ap.add_argument("--nlist", type=int, default=0, help="0 = same rule as build_index.py")
+    ap.add_argument("--nprobe", default="1,4,8,16,32,64")
+    ap.add_argument("--threads", type=int, default=1, help="FAISS OpenMP threads (1 = per-worker serving)")
+    args = ap.parse_args()
+    faiss.omp_set_num_threads(args.threads)
+    run(args)
+
+
+if __name__ == "__main__":
+    main()
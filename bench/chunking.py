@@ -0,0 +1,142 @@
+"""
+Chunk size / overlap sweep on the labeled Kinyarwanda evaluation queries.
+
+    python -m bench.chunking --sizes 250,500,1000 --overlaps 0,100
+
+For every (CHUNK_SIZE, OVERLAP) pair it runs a real `build_index.py` in a
+subprocess with its own INDEX_DIR, build manifest and work directory
+under --out, so the chatbot's index is never touched. All builds share
+the embedding cache (EMBED_CACHE_PATH), so a chunk text embedded by an
+earlier setting or sweep is not paid for twice. Each built index is then
+loaded the way the API loads it and every labeled question goes through
+src.chats.retrieve (TOP_K, SCORE_THRESHOLD, keyword fallback and all).
+
+Reported per setting: chunk count and mean chunk tokens, label recall
+(a chunk from an expected source page came back) and MRR, the mean
+tokens of the context that would be sent to ask_llm_with_context, index
+size on disk and build wall-clock. Each question is embedded once and
+reused for every setting. Pick a setting, then set CHUNK_SIZE / OVERLAP
+and rebuild.
+"""
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from dotenv import load_dotenv
+
+from bench.common import EVAL_QUERIES_PATH, first_relevant_rank, load_eval_queries, parse_ints, print_table
+from config import SYN_PATH, TOP_K
+from index_version import resolve_index
+from openai_replay import make_client
+from src.chats import _load_version, format_context, load_synonyms, retrieve
+from utils import count_tokens
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class _QueryEmbeddingMemo:
+    """Client whose embeddings.create answers a repeated request from memory."""
+
+    def __init__(self, client):
+        self._client = client
+        self._seen = {}
+        self.embeddings = self
+
+    def create(self, input, **kwargs):
+        key = (tuple(input), tuple(sorted(kwargs.items())))
+        if key not in self._seen:
+            self._seen[key] = self._client.embeddings.create(input=input, **kwargs)
+        return self._seen[key]
+
+
+def build(out_dir: str, chunk_size: int, overlap: int) -> float:
+    """Build an index for one setting into out_dir; returns wall-clock seconds."""
+    env = dict(
+        os.environ,
+        CHUNK_SIZE=str(chunk_size),
+        OVERLAP=str(overlap),
+        INDEX_DIR=os.path.join(out_dir, "index"),
+        BUILD_MANIFEST_PATH=os.path.join(out_dir, "build_manifest.json"),
+        BUILD_WORK_DIR=os.path.join(out_dir, "build_tmp"),
+    )
+    t0 = time.perf_counter()
+    proc = subprocess.run([sys.executable, os.path.join(ROOT, "build_index.py"), "--full"],
+                          cwd=ROOT, env=env, capture_output=True, text=True)
+    elapsed = time.perf_counter() - t0
+    if proc.returncode != 0:
+        sys.stderr.write(proc.stdout[-2000:] + proc.stderr[-4000:])
+        raise SystemExit(f"build_index.py failed for CHUNK_SIZE={chunk_size} OVERLAP={overlap}")
+    return elapsed
+
+
+def evaluate(client, index_dir: str, queries, syn):
+    """(label recall, MRR, mean context tokens, served index) of one built index."""
+    served = _load_version(resolve_index(index_dir))
+    ranks, contexts = [], []
+    for q in queries:
+        chunks, _ = retrieve(client, served.index, served.rows, q["question"], syn,
+                             served.embed_model, served.embed_dims)
+        ranks.append(first_relevant_rank(chunks, q["expected"]))
+        contexts.append(format_context(chunks) if chunks else "")
+    n = len(queries)
+    recall = sum(1 for r in ranks if r) / n
+    mrr = sum(1.0 / r for r in ranks if r) / n
+    ctx_tokens = sum(count_tokens(contexts)) / n
+    return recall, mrr, ctx_tokens, served
+
+
+def dir_nbytes(path: str) -> int:
+    return sum(os.path.getsize(os.path.join(d, f)) for d, _, files in os.walk(path) for f in files)
+
+
+def run(args):
+    queries = load_eval_queries(args.queries)
+    syn = load_synonyms(SYN_PATH)
+    load_dotenv()
+    client = _QueryEmbeddingMemo(make_client())
+
+    out = args.out or tempfile.mkdtemp(prefix="chunk-sweep-")
+    settings = [(s, o) for s in parse_ints(args.sizes) for o in parse_ints(args.overlaps) if o < s]
+    print(f"✂ {len(settings)} settings, {len(queries)} queries, TOP_K={TOP_K}, builds in {out}")
+
+    rows = []
+    try:
+        for size, overlap in settings:
+            setting_dir = os.path.join(out, f"size{size}-overlap{overlap}")
+            build_s = build(setting_dir, size, overlap)
+            recall, mrr, ctx_tokens, served = evaluate(client, os.path.join(setting_dir, "index"), queries, syn)
+            chunk_tokens = [int(t) for t in getattr(served.rows, "tokens", [])]
+            rows.append([
+                size, overlap, len(served.rows),
+                f"{sum(chunk_tokens) / max(1, len(chunk_tokens)):.0f}",
+                f"{recall:.3f}", f"{mrr:.3f}", f"{ctx_tokens:.0f}",
+                f"{recall / ctx_tokens * 1000:.3f}" if ctx_tokens else "-",
+                f"{dir_nbytes(os.path.join(setting_dir, 'index')) / 1e6:.1f}",
+                f"{build_s:.1f}",
+            ])
+            print(f"  size {size} overlap {overlap}: recall {recall:.3f}, {ctx_tokens:.0f} context tokens")
+    finally:
+        if not args.out:
+            shutil.rmtree(out, ignore_errors=True)
+
+    print()
+    print_table(["chunk_size", "overlap", "chunks", "chunk_tokens", f"label_recall@{TOP_K}", "MRR",
+                 "ctx_tokens", "recall_per_1k_ctx", "index_MB", "build_s"], rows)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Retrieval quality, context tokens, index size and build time per chunk setting")
+    ap.add_argument("--sizes", default="250,500,1000", help="CHUNK_SIZE values (tokens)")
+    ap.add_argument("--overlaps", default="0,50,100", help="OVERLAP values (tokens); pairs with overlap >= size are skipped")
+    ap.add_argument("--queries", default=EVAL_QUERIES_PATH, help="labeled query file")
+    ap.add_argument("--out", default="", help="keep the built indexes here (default: temp dir, removed afterwards)")
+    args = ap.parse_args()
+    run(args)
+
+
+if __name__ == "__main__":
+    main()
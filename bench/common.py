@@ -0,0 +1,129 @@
+import json
+import time
+from pathlib import Path
+from typing import Dict, Iterable, List, Sequence
+
+import faiss
+import numpy as np
+
+
+def percentile(values: Sequence[float], p: float) -> float:
+    if not len(values):
+        return 0.0
+    return float(np.percentile(np.asarray(values, dtype="float64"), p))
+
+
+def recall_at_k(found: np.ndarray, truth: np.ndarray, k: int) -> float:
+    """Mean fraction of the true top-k ids that the approximate search returned."""
+    hits = 0
+    for f, t in zip(found, truth):
+        hits += len(set(f[:k].tolist()) & set(t[:k].tolist()))
+    return hits / float(k * len(truth)) if len(truth) else 0.0
+
+
+def normalized(X: np.ndarray) -> np.ndarray:
+    X = np.ascontiguousarray(X, dtype="float32")
+    faiss.normalize_L2(X)
+    return X
+
+
+def synthetic_corpus(n: int, dim: int, clusters: int = 64, seed: int = 0) -> np.ndarray:
+    """
+    Clustered unit vectors: a crude stand-in for embedding space, which is
+    far from uniform (chunks of the same guide sit close together).
+    """
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim)).astype("float32")
+    labels = rng.integers(0, clusters, size=n)
+    X = centers[labels] + 0.6 * rng.standard_normal((n, dim)).astype("float32")
+    return normalized(X)
+
+
+def grow_corpus(base: np.ndarray, n: int, seed: int = 0) -> np.ndarray:
+    """Take `n` rows from real vectors, jittering copies when more are needed."""
+    if n <= len(base):
+        return np.ascontiguousarray(base[:n])
+    rng = np.random.default_rng(seed)
+    extra = base[rng.integers(0, len(base), size=n - len(base))]
+    extra = extra + 0.05 * rng.standard_normal(extra.shape).astype("float32")
+    return normalized(np.vstack([base, extra]))
+
+
+def sample_queries(X: np.ndarray, nq: int, noise: float = 0.1, seed: int = 1) -> np.ndarray:
+    """Queries near (not on) corpus vectors, like paraphrases of indexed text."""
+    rng = np.random.default_rng(seed)
+    Q = X[rng.integers(0, len(X), size=nq)]
+    Q = Q + noise * rng.standard_normal(Q.shape).astype("float32") / np.sqrt(X.shape[1])
+    return normalized(Q)
+
+
+def timed_search(index, Q: np.ndarray, k: int):
+    """One query at a time, as the API does. Returns (ids, per-query latencies in ms)."""
+    ids = np.empty((len(Q), k), dtype="int64")
+    lat: List[float] = []
+    for i in range(len(Q)):
+        t0 = time.perf_counter()
+        _, I = index.search(Q[i : i + 1], k)
+        lat.append((time.perf_counter() - t0) * 1000.0)
+        ids[i] = I[0]
+    return ids, lat
+
+
+def vectors_from_index(path: str) -> np.ndarray:
+    """Read the stored vectors back out of an index built by build_index.py."""
+    index = faiss.read_index(path)
+    try:
+        faiss.extract_index_ivf(index).make_direct_map()
+    except RuntimeError:
+        pass  # not an IVF index
+    return normalized(index.reconstruct_n(0, index.ntotal))
+
+
+def parse_ints(text: str) -> List[int]:
+    return [int(x) for x in text.split(",") if x.strip()]
+
+
+def print_table(headers: Iterable[str], rows: Iterable[Sequence]) -> None:
+    headers = list(headers)
+    rows = [[str(c) for c in r] for r in rows]
+    widths = [max(len(h), *(len(r[i]) for r in rows)) if rows else len(h) for i, h in enumerate(headers)]
+    print("  ".join(h.ljust(w) for h, w in zip(headers, widths)))
+    print("  ".join("-" * w for w in widths))
+    for r in rows:
+        print("  ".join(c.ljust(w) for c, w in zip(r, widths)))
+
+
+# ---------------------------
+# LABELED EVALUATION QUERIES
+# ---------------------------
+EVAL_QUERIES_PATH = str(Path(__file__).resolve().parent / "data" / "eval_queries_v1.jsonl")
+
+
+def load_eval_queries(path: str = EVAL_QUERIES_PATH) -> List[Dict]:
+    """Rows of {"id", "question", "expected": [{"source", "pages"}, ...]}."""
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def is_relevant(row: Dict, expected: List[Dict]) -> bool:
+    """A retrieved chunk counts if it comes from one of the labeled source pages."""
+    for exp in expected:
+        if row.get("source") == exp["source"] and row.get("page") in exp["pages"]:
+            return True
+    return False
+
+
+def first_relevant_rank(rows: Sequence[Dict], expected: List[Dict]) -> int:
+    """1-based rank of the first relevant chunk, 0 if none was retrieved."""
+    for rank, row in enumerate(rows, 1):
+        if is_relevant(row, expected):
+            return rank
+    return 0
+
+
+
+# ---------------------------
+# RECORDED QUERY EMBEDDINGS
+# ---------------------------
+# openai_replay recordings of the evaluation questions' embeddings (bench.retrieval --record)
+RECORDED_EMBEDDINGS_PATH = str(Path(__file__).resolve().parent / "data" / "eval_embeddings.sqlite")
@@ -0,0 +1,80 @@
+"""
+Memory and recall of the compressed index variants (SQ8 / PQ / OPQ).
+
+    python -m bench.compress --size 20000 --dim 3072
+    python -m bench.compress --from-index data/index.faiss --kind ivf --rerank 0,50
+
+For each compression the script reports the bytes each worker holds for
+the index (the rerank vectors are memory-mapped and shared through the
+page cache, so they are listed separately), recall@k against the exact
+flat index with and without exact re-ranking, and p50/p99 latency.
+"""
+import argparse
+
+import faiss
+
+from bench.common import (
+    grow_corpus, parse_ints, percentile, print_table, recall_at_k,
+    sample_queries, synthetic_corpus, timed_search, vectors_from_index,
+)
+from index_store import RerankIndex, build_ann_index, default_params, index_nbytes
+
+
+def run(args):
+    base = vectors_from_index(args.from_index) if args.from_index else None
+    dim = base.shape[1] if base is not None else args.dim
+    X = grow_corpus(base, args.size) if base is not None else synthetic_corpus(args.size, dim)
+    Q = sample_queries(X, args.queries)
+    n = len(X)
+    print(f"📐 n={n} dim={dim} queries={len(Q)} kind={args.kind}")
+
+    flat, _ = build_ann_index(X, "flat")
+    truth, _ = timed_search(flat, Q, args.k)
+
+    rows = []
+    for quant in args.quants.split(","):
+        if args.kind == "hnsw" and quant in ("pq", "opq"):
+            continue
+        params = default_params(args.kind, n, dim, quant)
+        if "pq_m" in params and args.pq_m:
+            params["pq_m"] = args.pq_m
+        print(f"🧱 {args.kind}/{quant} {params}")
+        index, params = build_ann_index(X, args.kind, params)
+        mb = index_nbytes(index) / 1e6
+
+        for rk in parse_ints(args.rerank):
+            if quant == "none" and rk:
+                continue
+            searcher = RerankIndex(index, X, rk) if rk else index
+            found, lat = timed_search(searcher, Q, args.k)
+            rows.append([
+                quant, rk or "-", f"{mb:.1f}", f"{mb * 1e6 / n:.0f}",
+                f"{X.nbytes / 1e6:.1f}" if rk else "-",
+                f"{recall_at_k(found, truth, args.k):.3f}",
+                f"{percentile(lat, 50):.2f}", f"{percentile(lat, 99):.2f}",
+            ])
+
+    print()
+    print_table(["quant", "rerank_k", "index_MB/worker", "bytes/vec", "shared_MB",
+                 f"recall@{args.k}", "p50_ms", "p99_ms"], rows)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Compressed FAISS index memory and recall")
+    ap.add_argument("--from-index", help="flat index.faiss whose vectors seed the corpus (default: synthetic)")
+    ap.add_argument("--size", type=int, default=20000)
+    ap.add_argument("--dim", type=int, default=3072, help="synthetic vector size")
+    ap.add_argument("--kind", default="flat", choices=["flat", "hnsw", "ivf"])
+    ap.add_argument("--quants", default="none,sq8,pq,opq")
+    ap.add_argument("--pq-m", type=int, default=0, help="override PQ_M")
+    ap.add_argument("--rerank", default="0,20,50", help="rerank_k values to try (0 = off)")
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("--k", type=int, default=10)
+    ap.add_argument("--threads", type=int, default=1)
+    args = ap.parse_args()
+    faiss.omp_set_num_threads(args.threads)
+    run(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Embedding decode cost: JSON float lists vs base64 into a preallocated matrix.
+
+    python -m bench.decode --rows 20000 --dim 3072
+
+Simulates the payloads locally (no API calls). "lists" is the old build
+path (extend a list of Python float lists, then np.array(...).astype);
+"base64" is embeddings.decode_embedding written row by row into an
+np.empty matrix. Reports per-query decode time and peak traced memory.
+"""
+import argparse
+import base64
+import time
+import tracemalloc
+
+import numpy as np
+
+from bench.common import percentile, print_table
+from embeddings import decode_embedding
+
+
+def build_lists(payloads):
+    embeddings = []
+    for p in payloads:
+        embeddings.append(list(p))
+    return np.array(embeddings).astype("float32")
+
+
+def build_base64(payloads, dim):
+    X = np.empty((len(payloads), dim), dtype="float32")
+    for i, p in enumerate(payloads):
+        X[i] = decode_embedding(p)
+    return X
+
+
+def peak_mb(fn, *args):
+    tracemalloc.start()
+    fn(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak / 1e6
+
+
+def run(args):
+    rng = np.random.default_rng(0)
+    vecs = rng.standard_normal((args.rows, args.dim)).astype("float32")
+    as_lists = [v.tolist() for v in vecs]
+    as_b64 = [base64.b64encode(v.tobytes()).decode() for v in vecs]
+    del vecs
+
+    q_list, q_b64 = [], []
+    for i in range(min(args.queries, args.rows)):
+        t0 = time.perf_counter()
+        np.array(as_lists[i], dtype="float32")
+        q_list.append((time.perf_counter() - t0) * 1e6)
+        t0 = time.perf_counter()
+        decode_embedding(as_b64[i]).copy()
+        q_b64.append((time.perf_counter() - t0) * 1e6)
+
+    rows = [
+        ["lists", f"{percentile(q_list, 50):.1f}", f"{percentile(q_list, 99):.1f}",
+         f"{peak_mb(build_lists, as_lists):.0f}"],
+        ["base64", f"{percentile(q_b64, 50):.1f}", f"{percentile(q_b64, 99):.1f}",
+         f"{peak_mb(build_base64, as_b64, args.dim):.0f}"],
+    ]
+    print(f"rows={args.rows} dim={args.dim} (matrix = {args.rows * args.dim * 4 / 1e6:.0f} MB)\n")
+    print_table(["format", "query_p50_us", "query_p99_us", "build_peak_MB"], rows)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Embedding decode time and peak memory")
+    ap.add_argument("--rows", type=int, default=5000)
+    ap.add_argument("--dim", type=int, default=3072)
+    ap.add_argument("--queries", type=int, default=500)
+    args = ap.parse_args()
+    run(args)
+
+
+if __name__ == "__main__":
+    main()
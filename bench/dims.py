@@ -0,0 +1,101 @@
+"""
+Embedding-size sweep on the labeled Kinyarwanda evaluation queries.
+
+    python -m bench.dims --dims 256,512,1024,3072
+
+text-embedding-3 models are trained so that the first d components of a
+vector, re-normalized, are what the API returns for `dimensions=d`. The
+sweep therefore embeds the corpus once at full size (the index built by
+build_index.py with EMBED_DIMS=0) and truncates locally, so trying a size
+costs no extra API calls. For each size it reports label recall@k / MRR
+(did a chunk from the expected source page come back?), overlap with the
+full-size top-k, search latency and index memory. Pick a size, then set
+EMBED_DIMS and rebuild.
+"""
+import argparse
+import os
+
+import faiss
+import numpy as np
+from dotenv import load_dotenv
+
+from bench.common import (
+    EVAL_QUERIES_PATH, first_relevant_rank, load_eval_queries, normalized, parse_ints,
+    percentile, print_table, recall_at_k, timed_search, vectors_from_index,
+)
+from config import SYN_PATH
+from embeddings import embed_into, output_dims
+from index_store import build_ann_index, embedding_settings, index_nbytes, read_manifest
+from index_version import resolve_index
+from openai_replay import make_client
+from src.chats import _clean_kiny_query, expand_query_with_synonyms, load_meta, load_synonyms
+
+
+def full_size_vectors(files, manifest):
+    if manifest.get("embed_dims"):
+        raise SystemExit(f"Index was built with EMBED_DIMS={manifest['embed_dims']}; "
+                         "rebuild with EMBED_DIMS=0 to sweep smaller sizes.")
+    if manifest.get("vectors") and os.path.exists(files.vectors_path):
+        return normalized(np.load(files.vectors_path))
+    return vectors_from_index(files.faiss_path)
+
+
+def embed_questions(client, model, questions):
+    syn = load_synonyms(SYN_PATH)
+    texts = [expand_query_with_synonyms(_clean_kiny_query(q), syn) for q in questions]
+    Q = np.empty((len(texts), output_dims(client, model, 0)), dtype="float32")
+    embed_into(client, texts, Q, model, 0)
+    return normalized(Q)
+
+
+def run(args):
+    files = resolve_index()
+    manifest = read_manifest(files.manifest_path)
+    model, _ = embedding_settings(manifest)
+    X = full_size_vectors(files, manifest)
+    meta_rows = load_meta(files.chunks_path)
+    queries = load_eval_queries(args.queries)
+
+    load_dotenv()
+    Q = embed_questions(make_client(), model, [q["question"] for q in queries])
+    print(f"📐 {len(X)} chunks, {len(queries)} queries, full size {X.shape[1]}")
+
+    full_index, _ = build_ann_index(X, "flat")
+    full_top, _ = timed_search(full_index, Q, args.k)
+
+    rows = []
+    for d in parse_ints(args.dims):
+        if d > X.shape[1]:
+            continue
+        Xd = normalized(X[:, :d])
+        Qd = normalized(Q[:, :d])
+        index, _ = build_ann_index(Xd, "flat")
+        found, lat = timed_search(index, Qd, args.k)
+
+        ranks = [first_relevant_rank([meta_rows[i] for i in ids if i >= 0], q["expected"])
+                 for ids, q in zip(found, queries)]
+        hit = sum(1 for r in ranks if r) / len(ranks)
+        mrr = sum(1.0 / r for r in ranks if r) / len(ranks)
+        rows.append([
+            d, f"{hit:.3f}", f"{mrr:.3f}", f"{recall_at_k(found, full_top, args.k):.3f}",
+            f"{percentile(lat, 50):.3f}", f"{percentile(lat, 99):.3f}",
+            f"{index_nbytes(index) / 1e6:.1f}",
+        ])
+
+    print()
+    print_table(["dims", f"label_recall@{args.k}", "MRR", f"overlap@{args.k}_vs_full",
+                 "p50_ms", "p99_ms", "index_MB"], rows)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Recall and latency at reduced embedding sizes")
+    ap.add_argument("--dims", default="256,512,1024,3072")
+    ap.add_argument("--queries", default=EVAL_QUERIES_PATH, help="labeled query file")
+    ap.add_argument("--k", type=int, default=10)
+    args = ap.parse_args()
+    faiss.omp_set_num_threads(1)
+    run(args)
+
+
+if __name__ == "__main__":
+    main()
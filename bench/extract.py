@@ -0,0 +1,54 @@
+"""
+PDF text extraction wall-clock: sequential vs a process pool.
+
+    python -m bench.extract --workers 1,2,4,8
+
+Reads every PDF from config.corpus_pdfs() that exists (or --pdf ...) with
+utils.read_pdfs at each worker count, checks the pages come back identical
+to the sequential read, and reports the speedup. Worker count 1 is the
+old one-file-at-a-time path.
+"""
+import argparse
+import os
+import time
+
+from bench.common import parse_ints, print_table
+from config import PDF_PAGES_PER_TASK, corpus_pdfs
+from utils import read_pdfs
+
+
+def run(args):
+    paths = args.pdf or [str(p) for p in corpus_pdfs() if p.exists()]
+    if not paths:
+        raise SystemExit("No PDFs found; pass --pdf")
+
+    baseline, base_time, rows = None, None, []
+    for workers in parse_ints(args.workers):
+        times = []
+        for _ in range(args.repeat):
+            t0 = time.perf_counter()
+            out = read_pdfs(paths, workers=workers, pages_per_task=args.pages_per_task)
+            times.append(time.perf_counter() - t0)
+        best = min(times)
+        if baseline is None:
+            baseline, base_time = out, best
+        same = "yes" if out == baseline else "NO"
+        pages = sum(len(v) for v in out.values())
+        rows.append([workers, pages, f"{best:.2f}", f"{base_time / best:.2f}x", same])
+
+    print(f"{len(paths)} PDFs, {os.cpu_count()} CPUs, {args.pages_per_task} pages per task\n")
+    print_table(["workers", "pages", "wall_s", "speedup", "same_output"], rows)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Sequential vs parallel PDF extraction")
+    ap.add_argument("--workers", default="1,2,4,8", help="first value is the baseline")
+    ap.add_argument("--pages-per-task", type=int, default=PDF_PAGES_PER_TASK)
+    ap.add_argument("--repeat", type=int, default=1)
+    ap.add_argument("--pdf", nargs="*", help="PDF files (default: config.corpus_pdfs())")
+    args = ap.parse_args()
+    run(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,293 @@
+"""
+Load test of the FastAPI service (main.py), one chat pipeline at a time.
+
+    python -m bench.load --concurrency 1,8,32 --duration 20
+    python -m bench.load --pipelines src.chats --rate 2,5,10 --duration 30
+    python -m bench.load --url http://127.0.0.1:1000 --concurrency 16   # a server you started
+
+For each pipeline (CHAT_PIPELINE) a uvicorn server is started with
+OPENAI_MODE=replay (openai_replay), so no request leaves the machine:
+recorded answers come back after the simulated --chat-latency /
+--embed-latency, a --rate-429 share of OpenAI calls fails with a 429, and
+questions that were never recorded get synthesized answers. The labeled
+evaluation questions are sent round-robin as POST /chat.
+
+Two load shapes: --concurrency N keeps N requests in flight (closed loop,
+finds the throughput ceiling); --rate R starts R requests per second with
+exponential gaps whatever the latency (open loop, shows the queueing once
+R is past the ceiling). Per pipeline and level it reports throughput,
+p50/p95/p99 latency of successful requests, the error rate and, from
+GET /admin/usage, OpenAI calls and tokens per request, the share of chat
+calls answered by a synthesized reply, and the route mix (smalltalk, pdf,
+general, ...), which shows whether the pipelines compared did the same
+work (one uvicorn worker, so the counters cover every request).
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import secrets
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+from bench.common import EVAL_QUERIES_PATH, load_eval_queries, parse_ints, percentile, print_table
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PIPELINES = "src.chats,src.chat_flexible,src.chat_strict_without_paraphrasing,src.chat"
+
+
+# ---------------------------
+# HTTP
+# ---------------------------
+async def post_chat(host: str, port: int, question: str, timeout: float) -> Tuple[int, float]:
+    """(HTTP status, latency ms) of one POST /chat; status 0 for timeouts and connection errors."""
+    body = json.dumps({"query": question}).encode("utf-8")
+    head = (f"POST /chat HTTP/1.1\r\nHost: {host}:{port}\r\nContent-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n").encode("ascii")
+
+    async def exchange() -> int:
+        reader, writer = await asyncio.open_connection(host, port)
+        try:
+            writer.write(head + body)
+            await writer.drain()
+            status_line = await reader.readline()
+            await reader.read()   # rest of the response, until the server closes
+            return int(status_line.split(b" ", 2)[1])
+        finally:
+            writer.close()
+
+    t0 = time.perf_counter()
+    try:
+        status = await asyncio.wait_for(exchange(), timeout)
+    except (OSError, asyncio.TimeoutError, ValueError, IndexError):
+        status = 0
+    return status, (time.perf_counter() - t0) * 1000.0
+
+
+def get_json(url: str, token: str = "", timeout: float = 5.0) -> Optional[Dict]:
+    request = urllib.request.Request(url, headers={"X-Admin-Token": token} if token else {})
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return json.loads(response.read().decode("utf-8"))
+    except (OSError, ValueError, urllib.error.URLError):
+        return None
+
+
+# ---------------------------
+# LOAD SHAPES
+# ---------------------------
+async def closed_loop(host, port, questions, concurrency, duration, timeout):
+    """`concurrency` clients, each sending its next request as soon as the last one returns."""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + duration
+    counter = itertools.count()
+    results: List[Tuple[int, float]] = []
+
+    async def client():
+        while loop.time() < deadline:
+            results.append(await post_chat(host, port, questions[next(counter) % len(questions)], timeout))
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return results, time.perf_counter() - t0
+
+
+async def open_loop(host, port, questions, rate, duration, timeout, max_inflight):
+    """Poisson arrivals at `rate` per second for `duration` s; arrivals past max_inflight are dropped."""
+    loop = asyncio.get_running_loop()
+    rng = random.Random(0)
+    start = loop.time()
+    arrival, inflight, dropped = start, 0, 0
+    tasks = []
+
+    async def one(question):
+        nonlocal inflight
+        inflight += 1
+        try:
+            return await post_chat(host, port, question, timeout)
+        finally:
+            inflight -= 1
+
+    t0 = time.perf_counter()
+    for i in itertools.count():
+        arrival += rng.expovariate(rate)
+        if arrival >= start + duration:
+            break
+        await asyncio.sleep(max(0.0, arrival - loop.time()))
+        if inflight >= max_inflight:
+            dropped += 1
+            continue
+        tasks.append(asyncio.ensure_future(one(questions[i % len(questions)])))
+    results = list(await asyncio.gather(*tasks))
+    results.extend([(-1, 0.0)] * dropped)
+    return results, time.perf_counter() - t0
+
+
+# ---------------------------
+# SERVER
+# ---------------------------
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(pipeline: str, args, token: str, log_dir: str):
+    """uvicorn main:app for one pipeline on replayed OpenAI; returns (process, base url, log path)."""
+    port = free_port()
+    env = dict(
+        os.environ,
+        CHAT_PIPELINE=pipeline,
+        OPENAI_MODE="replay",
+        OPENAI_REPLAY_MISS="synthesize",
+        OPENAI_FAKE_CHAT_LATENCY=args.chat_latency,
+        OPENAI_FAKE_EMBED_LATENCY=args.embed_latency,
+        OPENAI_FAKE_429_RATE=str(args.rate_429),
+        ADMIN_TOKEN=token,
+        INDEX_WATCH_INTERVAL="0",
+        BUDGET_PATH="",   # keep load test spending out of the real per-client ledger
+    )
+    log_path = os.path.join(log_dir, pipeline.replace(".", "_") + ".log")
+    log = open(log_path, "w")
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--log-level", "warning"],
+        cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT,
+    )
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + args.startup_timeout
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            break
+        if get_json(url + "/health", timeout=1.0):
+            return proc, url, log_path
+        time.sleep(0.2)
+    proc.kill()
+    raise SystemExit(f"server for {pipeline} did not start; see {log_path}")
+
+
+# ---------------------------
+# REPORT
+# ---------------------------
+def summarize(label: str, results, elapsed: float, before: Optional[Dict], after: Optional[Dict]) -> List:
+    ok = [ms for status, ms in results if status == 200]
+    sent = len(results)
+    row = [
+        label, sent, len(ok), f"{(sent - len(ok)) / sent * 100 if sent else 0:.1f}",
+        f"{len(ok) / elapsed if elapsed else 0:.2f}",
+        f"{percentile(ok, 50):.0f}", f"{percentile(ok, 95):.0f}", f"{percentile(ok, 99):.0f}",
+    ]
+    if before and after and sent:
+        calls = {k: after["calls"][k] - before["calls"][k] for k in after["calls"]}
+        tokens = (after["prompt_tokens"] - before["prompt_tokens"]
+                  + after["completion_tokens"] - before["completion_tokens"])
+        openai_errors = sum(after["errors"].values()) - sum(before["errors"].values())
+        misses = after["replay_misses"]["chat"] - before["replay_misses"]["chat"]
+        row += [f"{calls['chat'] / sent:.1f}", f"{calls['embeddings'] / sent:.1f}",
+                f"{tokens / sent:.0f}", openai_errors,
+                f"{misses / calls['chat'] * 100 if calls['chat'] else 0:.0f}",
+                route_mix(before["routes"], after["routes"])]
+    else:
+        row += ["-", "-", "-", "-", "-", "-"]
+    return row
+
+
+def route_mix(before: Dict[str, float], after: Dict[str, float]) -> str:
+    """"pdf 80%, general 15%, smalltalk 5%": how the level's answers were produced."""
+    counts = {r: after[r] - before.get(r, 0) for r in after}
+    total = sum(counts.values())
+    if not total:
+        return "-"
+    return ", ".join(f"{r} {n / total * 100:.0f}%"
+                     for r, n in sorted(counts.items(), key=lambda kv: -kv[1]) if n)
+
+
+def drive(url: str, token: str, questions: List[str], args) -> List[List]:
+    parsed = urlparse(url)
+    host, port = parsed.hostname, parsed.port or 80
+    levels = [("concurrency", n) for n in parse_ints(args.concurrency)] if args.concurrency else []
+    levels += [("rate", n) for n in parse_ints(args.rate)] if args.rate else []
+
+    # warm-up (index, PDFs and synonyms load on the first request) is not measured
+    asyncio.run(post_chat(host, port, questions[0], args.timeout * 10))
+
+    rows = []
+    for shape, n in levels:
+        before = get_json(url + "/admin/usage", token)
+        if shape == "concurrency":
+            results, elapsed = asyncio.run(closed_loop(host, port, questions, n, args.duration, args.timeout))
+            label = f"c={n}"
+        else:
+            results, elapsed = asyncio.run(open_loop(host, port, questions, n, args.duration, args.timeout,
+                                                     args.max_inflight))
+            label = f"{n}/s"
+        rows.append(summarize(label, results, elapsed, before, get_json(url + "/admin/usage", token)))
+        print(f"  {label}: {rows[-1][4]} req/s, p50 {rows[-1][5]} ms, errors {rows[-1][3]}%, routes {rows[-1][-1]}")
+    return rows
+
+
+def run(args):
+    if not args.concurrency and not args.rate:
+        raise SystemExit("give --concurrency and/or --rate")
+    questions = [q["question"] for q in load_eval_queries(args.queries)]
+    headers = ["pipeline", "load", "sent", "ok", "err_%", "req_per_s", "p50_ms", "p95_ms", "p99_ms",
+               "chat_calls/req", "embed_calls/req", "tokens/req", "openai_errors", "synth_chat_%", "routes"]
+    table = []
+
+    if args.url:
+        token = args.admin_token or os.getenv("ADMIN_TOKEN", "")
+        pipeline = (get_json(args.url + "/admin/usage", token) or {}).get("pipeline", "?")
+        print(f"🚦 {args.url} ({pipeline})")
+        for row in drive(args.url, token, questions, args):
+            table.append([pipeline] + row)
+    else:
+        log_dir = tempfile.mkdtemp(prefix="load-")
+        for pipeline in [p.strip() for p in args.pipelines.split(",") if p.strip()]:
+            token = secrets.token_hex(16)
+            proc, url, log_path = start_server(pipeline, args, token, log_dir)
+            print(f"🚦 {pipeline} on {url} (log {log_path})")
+            try:
+                for row in drive(url, token, questions, args):
+                    table.append([pipeline] + row)
+            finally:
+                proc.terminate()
+                proc.wait(10)
+
+    print()
+    print_table(headers, table)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump([dict(zip(headers, row)) for row in table], f, ensure_ascii=False, indent=2)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Throughput, latency, errors and OpenAI usage per chat pipeline")
+    ap.add_argument("--pipelines", default=PIPELINES, help="CHAT_PIPELINE modules to test, one server each")
+    ap.add_argument("--url", default="", help="drive this running server instead of starting one per pipeline")
+    ap.add_argument("--admin-token", default="", help="ADMIN_TOKEN of --url, for the usage columns")
+    ap.add_argument("--concurrency", default="", help="closed-loop levels: requests kept in flight")
+    ap.add_argument("--rate", default="", help="open-loop levels: requests started per second")
+    ap.add_argument("--duration", type=float, default=20.0, help="seconds per level")
+    ap.add_argument("--timeout", type=float, default=60.0, help="seconds before a request counts as failed")
+    ap.add_argument("--max-inflight", type=int, default=1000, help="open loop: drop arrivals beyond this")
+    ap.add_argument("--chat-latency", default="lognormal:800,0.4", help="simulated chat completion latency")
+    ap.add_argument("--embed-latency", default="lognormal:60,0.3", help="simulated embedding latency")
+    ap.add_argument("--rate-429", type=float, default=0.0, help="share of OpenAI calls answered with a 429")
+    ap.add_argument("--startup-timeout", type=float, default=120.0)
+    ap.add_argument("--queries", default=EVAL_QUERIES_PATH, help="questions to send")
+    ap.add_argument("--json", default="", help="write the table to this file")
+    args = ap.parse_args()
+    run(args)
+
+
+if __name__ == "__main__":
+    main()
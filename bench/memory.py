@@ -0,0 +1,89 @@
+"""
+Per-worker memory with and without memory-mapped index/metadata (Linux).
+
+    python -m bench.memory --workers 4
+
+Starts N worker processes that each load the index and chunk metadata the
+way src/chats.py does, run a few searches and read every chunk row, then
+reports RSS, PSS (shared pages split between the processes that map them)
+and private memory per worker, once with INDEX_MMAP=0 and once with 1.
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+import numpy as np
+
+from bench.common import print_table
+
+
+def worker():
+    from index_store import load_index
+    from index_version import resolve_index
+    from src.chats import load_meta
+
+    files = resolve_index()
+    index = load_index(files.faiss_path, files.manifest_path)
+    meta_rows = load_meta(files.chunks_path)
+
+    rng = np.random.default_rng(os.getpid())
+    Q = rng.standard_normal((8, index.d)).astype("float32")
+    index.search(Q, 10)
+    sum(len(row.get("text", "")) for row in meta_rows)
+
+    print("ready", flush=True)
+    sys.stdin.readline()
+
+
+def smaps_kb(pid: int):
+    out = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) >= 2 and parts[0].endswith(":") and parts[1].isdigit():
+                out[parts[0][:-1]] = int(parts[1])
+    return out
+
+
+def measure(workers: int, mmap_on: int):
+    env = dict(os.environ, INDEX_MMAP=str(mmap_on))
+    procs = [
+        subprocess.Popen([sys.executable, "-m", "bench.memory", "--worker"],
+                         stdin=subprocess.PIPE, stdout=subprocess.PIPE, env=env, text=True)
+        for _ in range(workers)
+    ]
+    try:
+        for p in procs:
+            if p.stdout.readline().strip() != "ready":
+                raise RuntimeError("worker failed to load the index")
+        stats = [smaps_kb(p.pid) for p in procs]
+    finally:
+        for p in procs:
+            p.stdin.close()
+            p.wait()
+
+    rss = [s.get("Rss", 0) / 1024 for s in stats]
+    pss = [s.get("Pss", 0) / 1024 for s in stats]
+    private = [(s.get("Private_Clean", 0) + s.get("Private_Dirty", 0)) / 1024 for s in stats]
+    return [
+        "on" if mmap_on else "off", workers,
+        f"{np.mean(rss):.1f}", f"{np.mean(pss):.1f}", f"{np.mean(private):.1f}", f"{sum(pss):.1f}",
+    ]
+
+
+def main():
+    ap = argparse.ArgumentParser(description="RSS/PSS per worker with and without INDEX_MMAP")
+    ap.add_argument("--workers", type=int, default=4)
+    ap.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = ap.parse_args()
+    if args.worker:
+        worker()
+        return
+
+    rows = [measure(args.workers, 0), measure(args.workers, 1)]
+    print_table(["mmap", "workers", "rss_MB/worker", "pss_MB/worker", "private_MB/worker", "pss_MB_total"], rows)
+
+
+if __name__ == "__main__":
+    main()
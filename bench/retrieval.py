@@ -0,0 +1,148 @@
+"""
+Retrieval quality and per-stage latency of src.chats.retrieve, offline.
+
+    python -m bench.retrieval --record              # once, with an API key: store the query embeddings
+    python -m bench.retrieval --k 1,3,5,10 --json after.json --baseline before.json
+
+Every labeled question in bench/data/eval_queries_v1.jsonl (bump the
+file's version when questions or labels change, so results stay
+comparable) goes through retrieve on the published index, with the
+chatbot's TOP_K, SCORE_THRESHOLD, synonyms and keyword fallback. Query
+embeddings are replayed from openai_replay recordings (--embeddings,
+filled by --record), so runs need no network and are deterministic: any
+change in the numbers comes from the code or the index, not from the API.
+
+Quality (a chunk is relevant if it comes from a labeled source page):
+recall@k (a relevant chunk in the top k), MRR and nDCG@k, whose ideal
+ranking puts every relevant chunk of the index first. Latency: p50 / p95 /
+p99 per retrieve stage over --repeat passes; "embed" is the cache lookup
+here, not an API round trip. --json saves the results, --baseline prints
+them next to an earlier run's.
+"""
+import argparse
+import json
+import math
+import os
+
+from dotenv import load_dotenv
+
+import metrics
+from bench.common import (
+    EVAL_QUERIES_PATH, RECORDED_EMBEDDINGS_PATH, is_relevant,
+    load_eval_queries, parse_ints, percentile, print_table,
+)
+from config import INDEX_DIR, SCORE_THRESHOLD, SYN_PATH, TOP_K
+from index_version import resolve_index
+from openai_replay import Recordings, RecordingClient, ReplayClient, ReplayMiss, make_client
+from src.chats import _load_version, load_synonyms, retrieve
+
+STAGES = ("clean", "expand", "embed", "search", "filter", "keyword", "total")
+
+
+def dcg(relevance) -> float:
+    return sum(rel / math.log2(rank + 1) for rank, rel in enumerate(relevance, 1))
+
+
+def quality(found, relevant_counts, ks):
+    """recall@k, nDCG@k for each k, and MRR, averaged over queries."""
+    n = len(found)
+    out = {"MRR": sum(1.0 / (rel.index(1) + 1) for rel in found if 1 in rel) / n}
+    for k in ks:
+        out[f"recall@{k}"] = sum(1 for rel in found if 1 in rel[:k]) / n
+        ndcg = 0.0
+        for rel, total in zip(found, relevant_counts):
+            ideal = dcg([1] * min(k, total))
+            ndcg += dcg(rel[:k]) / ideal if ideal else 0.0
+        out[f"nDCG@{k}"] = ndcg / n
+    return out
+
+
+def run(args):
+    queries = load_eval_queries(args.queries)
+    syn = load_synonyms(SYN_PATH)
+    recordings = Recordings(args.embeddings)
+    if args.record:
+        load_dotenv()
+        client = RecordingClient(make_client(mode="live"), recordings)
+    else:
+        client = ReplayClient(recordings)
+
+    files = resolve_index(args.index_dir)
+    served = _load_version(files)
+    pages = [(row["source"], row["page"]) for row in served.rows]
+    relevant_counts = [sum(1 for s, p in pages if is_relevant({"source": s, "page": p}, q["expected"]))
+                       for q in queries]
+    print(f"🎯 {len(queries)} queries ({os.path.basename(args.queries)}), index {files.version}: "
+          f"{len(served.rows)} chunks, {served.embed_model}, TOP_K={TOP_K}, SCORE_THRESHOLD={SCORE_THRESHOLD}")
+
+    found, latency = [], {stage: [] for stage in STAGES}
+    for rep in range(max(1, args.repeat)):
+        for q in queries:
+            try:
+                with metrics.tracing() as trace:   # the stages /chat reports, by the same names
+                    chunks, _ = retrieve(client, served.index, served.rows, q["question"], syn,
+                                         served.embed_model, served.embed_dims)
+            except ReplayMiss as e:
+                raise SystemExit(f"{q['id']}: {e} (bench: run once with --record)")
+            timings = dict(trace.stages, total=sum(trace.stages.values()))
+            for stage, ms in timings.items():
+                latency[stage].append(ms)
+            if rep == 0:
+                found.append([1 if is_relevant(row, q["expected"]) else 0 for row in chunks])
+
+    ks = [k for k in parse_ints(args.k) if k <= TOP_K] or [TOP_K]
+    results = {
+        "queries": os.path.basename(args.queries),
+        "index_version": files.version,
+        "top_k": TOP_K,
+        "score_threshold": SCORE_THRESHOLD,
+        "quality": quality(found, relevant_counts, ks),
+        "latency_ms": {stage: {p: percentile(v, int(p[1:])) for p in ("p50", "p95", "p99")}
+                       for stage, v in latency.items() if v},
+        "missed": [q["id"] for q, rel in zip(queries, found) if 1 not in rel],
+    }
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    def cell(section, key, value, fmt):
+        before = (baseline or {}).get(section, {}).get(key)
+        if isinstance(before, dict) or before is None:
+            return fmt.format(value)
+        return f"{fmt.format(before)} -> {fmt.format(value)}"
+
+    print()
+    print_table(["metric", "value"],
+                [[name, cell("quality", name, v, "{:.3f}")] for name, v in results["quality"].items()])
+    print()
+    rows = []
+    for stage, ps in results["latency_ms"].items():
+        old = (baseline or {}).get("latency_ms", {}).get(stage, {})
+        rows.append([stage] + [f"{old[p]:.3f} -> {v:.3f}" if p in old else f"{v:.3f}" for p, v in ps.items()])
+    print_table(["stage", "p50_ms", "p95_ms", "p99_ms"], rows)
+    if results["missed"]:
+        print(f"\nNo relevant chunk for: {', '.join(results['missed'])}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"\n🗄 Query embeddings: {recordings.vectors.report()}")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Offline recall / MRR / nDCG and per-stage latency of retrieve")
+    ap.add_argument("--k", default="1,3,5,10", help="cutoffs (at most TOP_K)")
+    ap.add_argument("--queries", default=EVAL_QUERIES_PATH, help="labeled query file")
+    ap.add_argument("--embeddings", default=RECORDED_EMBEDDINGS_PATH, help="recorded query embeddings")
+    ap.add_argument("--record", action="store_true", help="embed questions missing from --embeddings through the API")
+    ap.add_argument("--index-dir", default=INDEX_DIR)
+    ap.add_argument("--repeat", type=int, default=5, help="passes over the queries for the latency percentiles")
+    ap.add_argument("--json", default="", help="write the results to this file")
+    ap.add_argument("--baseline", default="", help="results file of an earlier run to compare against")
+    args = ap.parse_args()
+    run(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,271 @@
+"""
+OpenAI token and cost accounting per /chat request, per client and per
+day, with the budgets enforced on it.
+
+    with budget.request(client) as spend:   # main.py; BudgetExceeded when refused
+    if budget.cheap():                # pipelines: skip optional OpenAI calls
+        ...
+    budget.remaining()                # tokens this request may still use, None = no cap
+
+openai_replay.CountingClient charges every call's `usage` to the request
+being answered. Before each call it checks the request's cap and limits
+the completion (max_tokens) to what the cap leaves. When the
+request ends, its totals are added to its client's row of the day in
+BUDGET_PATH (SQLite, shared by the workers) in one write.
+
+A client is the X-Client-Key header, or the caller's address. Once it has
+used BUDGET_CHEAP_AT of BUDGET_CLIENT_DAILY_TOKENS today, its requests
+run in the cheap mode: capped at BUDGET_CHEAP_REQUEST_TOKENS, and
+pipelines skip calls they can do without. At the full budget it is
+refused until midnight UTC (429). A question that reaches its own cap gets
+the pipeline's best-effort answer (deadline.best_effort). Every limit at
+0 means no limit.
+
+Costs are estimates at OPENAI_PRICES (USD per million tokens).
+"""
+import contextvars
+import datetime
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+import metrics
+from config import (
+    BUDGET_CHEAP_AT, BUDGET_CHEAP_REQUEST_TOKENS, BUDGET_CLIENT_DAILY_TOKENS, BUDGET_PATH,
+    BUDGET_REQUEST_TOKENS, OPENAI_PRICES,
+)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS usage (
+    day               TEXT    NOT NULL,
+    client            TEXT    NOT NULL,
+    requests          INTEGER NOT NULL DEFAULT 0,
+    calls             INTEGER NOT NULL DEFAULT 0,
+    prompt_tokens     INTEGER NOT NULL DEFAULT 0,
+    completion_tokens INTEGER NOT NULL DEFAULT 0,
+    cost_usd          REAL    NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, client)
+) WITHOUT ROWID
+"""
+
+
+class BudgetExceeded(Exception):
+    """A token budget ran out: `limit` is "request" (this request's cap) or "client" (its daily budget)."""
+
+    def __init__(self, limit: str, message: str):
+        super().__init__(message)
+        self.limit = limit
+
+
+def parse_prices(spec: str) -> Dict[str, tuple]:
+    """"model=PROMPT/COMPLETION,model=PROMPT" (USD per 1M tokens) -> {model: (prompt, completion)}."""
+    prices = {}
+    for item in filter(None, (s.strip() for s in spec.split(","))):
+        model, _, rates = item.partition("=")
+        prompt, _, completion = rates.partition("/")
+        try:
+            prices[model.strip()] = (float(prompt), float(completion or 0))
+        except ValueError:
+            raise ValueError(f"OPENAI_PRICES: cannot read {item!r}; expected model=PROMPT/COMPLETION")
+    return prices
+
+
+PRICES = parse_prices(OPENAI_PRICES)
+
+
+def cost_usd(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    """Estimated cost of one call; 0 for models without a price."""
+    prompt, completion = PRICES.get(model, (0.0, 0.0))
+    return (prompt_tokens * prompt + completion_tokens * completion) / 1e6
+
+
+def today() -> str:
+    return datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%d")
+
+
+def seconds_to_midnight() -> int:
+    now = datetime.datetime.now(datetime.timezone.utc)
+    midnight = (now + datetime.timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+    return int((midnight - now).total_seconds()) + 1
+
+
+# ---------------------------
+# PER CLIENT AND DAY
+# ---------------------------
+class Ledger:
+    """Tokens and cost per (UTC day, client) in one SQLite file; a connection per thread."""
+
+    def __init__(self, path: str = BUDGET_PATH):
+        self.path = path or ":memory:"   # "": this worker only, lost on restart
+        self._local = threading.local()
+        self._memory: Optional[sqlite3.Connection] = None   # ":memory:" is one database per connection
+        self._lock = threading.Lock()
+
+    def _conn(self) -> sqlite3.Connection:
+        if self.path == ":memory:":
+            if self._memory is None:
+                self._memory = sqlite3.connect(":memory:", check_same_thread=False)
+                self._memory.execute(_SCHEMA)
+            return self._memory
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(_SCHEMA)
+        return conn
+
+    def add(self, client: str, requests: int = 0, calls: int = 0, prompt_tokens: int = 0,
+            completion_tokens: int = 0, cost: float = 0.0, day: Optional[str] = None) -> None:
+        with self._lock:
+            conn = self._conn()
+            with conn:
+                conn.execute(
+                    "INSERT INTO usage (day, client, requests, calls, prompt_tokens, completion_tokens, cost_usd) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT (day, client) DO UPDATE SET "
+                    "requests = requests + excluded.requests, calls = calls + excluded.calls, "
+                    "prompt_tokens = prompt_tokens + excluded.prompt_tokens, "
+                    "completion_tokens = completion_tokens + excluded.completion_tokens, "
+                    "cost_usd = cost_usd + excluded.cost_usd",
+                    (day or today(), client, requests, calls, prompt_tokens, completion_tokens, cost),
+                )
+
+    def spent(self, client: str, day: Optional[str] = None) -> int:
+        """Tokens (prompt + completion) the client used on `day` (today by default)."""
+        with self._lock:
+            row = self._conn().execute(
+                "SELECT prompt_tokens + completion_tokens FROM usage WHERE day = ? AND client = ?",
+                (day or today(), client),
+            ).fetchone()
+        return int(row[0]) if row else 0
+
+    def report(self, day: Optional[str] = None, limit: int = 50) -> List[Dict]:
+        """The day's heaviest clients, by tokens."""
+        with self._lock:
+            rows = self._conn().execute(
+                "SELECT client, requests, calls, prompt_tokens, completion_tokens, cost_usd FROM usage "
+                "WHERE day = ? ORDER BY prompt_tokens + completion_tokens DESC LIMIT ?",
+                (day or today(), limit),
+            ).fetchall()
+        return [{"client": c, "requests": r, "calls": n, "prompt_tokens": p, "completion_tokens": o,
+                 "cost_usd": round(cost, 6)} for c, r, n, p, o, cost in rows]
+
+
+LEDGER = Ledger()
+
+
+# ---------------------------
+# PER REQUEST
+# ---------------------------
+class RequestBudget:
+    """OpenAI spending of one /chat request, charged from any thread, and its cap."""
+
+    def __init__(self, client: str, mode: str, cap: int, ledger: Ledger = LEDGER):
+        self.client = client
+        self.mode = mode        # "full" or "cheap"
+        self.cap = cap          # tokens; 0 = no cap
+        self.ledger = ledger
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cost = 0.0
+        self.exceeded: Optional[str] = None   # the limit that stopped a call, if any
+        self._recorded = False                # totals written to the ledger
+        self._lock = threading.Lock()
+
+    @property
+    def tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+    def remaining(self) -> Optional[int]:
+        return max(0, self.cap - self.tokens) if self.cap else None
+
+    def check(self, prompt_tokens: int = 0) -> Optional[int]:
+        """
+        Before an OpenAI call: the completion tokens it may use within the
+        cap (None without one). Raises BudgetExceeded once the request used
+        its cap, or when the call's (estimated) prompt alone would pass it.
+        """
+        if not self.cap:
+            return None
+        left = self.cap - self.tokens - prompt_tokens
+        if left <= 0:
+            with self._lock:
+                self.exceeded = "request"
+            metrics.BUDGET_EXCEEDED.inc(limit="request")
+            raise BudgetExceeded("request", f"this question used its {self.cap} token budget")
+        return left
+
+    def charge(self, endpoint: str, model: str, usage) -> None:
+        prompt = int(getattr(usage, "prompt_tokens", 0) or 0)
+        completion = int(getattr(usage, "completion_tokens", 0) or 0)
+        cost = cost_usd(model, prompt, completion)
+        with self._lock:
+            self.calls += 1
+            self.prompt_tokens += prompt
+            self.completion_tokens += completion
+            self.cost += cost
+            late = self._recorded
+        metrics.OPENAI_COST.inc(cost, endpoint=endpoint)
+        if late:   # a call still running when the request ended (src.chat batches past the deadline)
+            self.ledger.add(self.client, calls=1, prompt_tokens=prompt, completion_tokens=completion, cost=cost)
+
+    def record(self) -> None:
+        """Add the request and its spending to the client's row of the day (once, when it ends)."""
+        with self._lock:
+            calls, prompt, completion, cost = self.calls, self.prompt_tokens, self.completion_tokens, self.cost
+            self._recorded = True
+        self.ledger.add(self.client, requests=1, calls=calls, prompt_tokens=prompt,
+                        completion_tokens=completion, cost=cost)
+
+    def to_dict(self) -> Dict:
+        with self._lock:
+            return {"client": self.client, "mode": self.mode, "cap_tokens": self.cap or None,
+                    "tokens": self.tokens, "calls": self.calls, "cost_usd": round(self.cost, 6),
+                    "exceeded": self.exceeded}
+
+
+_CURRENT: contextvars.ContextVar[Optional[RequestBudget]] = contextvars.ContextVar("budget", default=None)
+
+
+@contextmanager
+def request(client: str, ledger: Ledger = LEDGER):
+    """
+    Budget of a /chat request from `client`, current for the block: the
+    cheap mode past BUDGET_CHEAP_AT of the daily budget, BudgetExceeded("client")
+    once it is used up. The ledger is written once, when the block ends.
+    """
+    daily = BUDGET_CLIENT_DAILY_TOKENS
+    spent = ledger.spent(client) if daily else 0
+    if daily and spent >= daily:
+        metrics.BUDGET_REQUESTS.inc(mode="refused")
+        metrics.BUDGET_EXCEEDED.inc(limit="client")
+        raise BudgetExceeded("client", f"daily budget of {daily} tokens used up")
+    mode = "cheap" if daily and spent >= BUDGET_CHEAP_AT * daily else "full"
+    cap = BUDGET_CHEAP_REQUEST_TOKENS if mode == "cheap" else BUDGET_REQUEST_TOKENS
+    if daily:
+        cap = min(cap, daily - spent) if cap else daily - spent
+    spend = RequestBudget(client, mode, cap, ledger)
+    metrics.BUDGET_REQUESTS.inc(mode=mode)
+    token = _CURRENT.set(spend)
+    try:
+        yield spend
+    finally:
+        _CURRENT.reset(token)
+        spend.record()
+
+
+def current() -> Optional[RequestBudget]:
+    return _CURRENT.get()
+
+
+def cheap() -> bool:
+    """Whether the request being answered runs in the cheap mode."""
+    spend = _CURRENT.get()
+    return spend is not None and spend.mode == "cheap"
+
+
+def remaining() -> Optional[int]:
+    """Tokens the current request may still use; None without a cap (or outside a request)."""
+    spend = _CURRENT.get()
+    return spend.remaining() if spend is not None else None
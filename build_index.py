@@ -1,11 +1,33 @@
-import json
+import argparse
+import os
 import re
+import shutil
 import faiss
 import numpy as np
 from tqdm import tqdm
-from openai import OpenAI
-from config import FAISS_PATH, META_PATH, EMBED_MODEL, DATA
-from utils import read_pdf_text
+from config import (
+    BUILD_MANIFEST_PATH, corpus_pdfs,
+    EMBED_MODEL, EMBED_DIMS, INDEX_KIND, INDEX_QUANT, EMBED_CACHE_PATH,
+    EMBED_BATCH, EMBED_CONCURRENCY, EMBED_RPM, EMBED_TPM,
+    BUILD_WORK_DIR, BUILD_SHARD_ROWS, CHUNK_SIZE, OVERLAP,
+)
+from utils import ENCODING, chunk_texts, count_tokens, iter_pdf_pages, read_pdfs
+from build_manifest import (
+    all_ids, file_sha256, ids_by_hash, read_build_manifest, text_hash, write_build_manifest,
+)
+from chunk_index import ChunkIndex, chunk_id
+from chunk_store import open_chunks, write_chunks
+from embed_cache import EmbeddingCache, text_key
+from embeddings import RateLimiter, embed_batches, output_dims
+from index_store import build_ann_index, index_nbytes, make_manifest, write_manifest
+from index_version import discard, publish, stage_version, writer_lock
+from openai_replay import make_client
+
+# bump "version" when clean_text / is_heading / utils.chunk_texts change behaviour,
+# so the next build re-chunks everything instead of trusting old page hashes
+CHUNKER = {"name": "sentence_tokens", "encoding": ENCODING, "chunk_size": CHUNK_SIZE, "overlap": OVERLAP, "version": 2}
+
+CHUNK_PAGES = 64   # pages tokenized per batch
 
 
 # ---------------------------
@@ -32,173 +54,611 @@ def is_heading(line):
 
 
 # ---------------------------
-# SPLIT INTO PARAGRAPHS
+# SAFE EMBEDDING FUNCTION
 # ---------------------------
-def split_paragraphs(text):
-    return [p.strip() for p in text.split("\n") if p.strip()]
+def clean_for_embedding(t):
+    if not isinstance(t, str):
+        t = str(t)
+
+    # remove problematic characters
+    t = t.encode("utf-8", "ignore").decode("utf-8").strip()
+
+    if not t:
+        raise ValueError("empty chunk passed to embed_texts")
+
+    # safety limit (avoid API rejection)
+    if len(t) > 8000:
+        t = t[:8000]
+    return t
+
+
+def embed_texts(client, texts, out, cache=None, positions=None, report=None, tokens=None):
+    """
+    Embed texts[i] into out[positions[i]] (default: out[i]) of the
+    preallocated matrix. Texts already in `cache` (an EmbeddingCache) are
+    copied from it; the rest are sent once per distinct text, in batches of
+    EMBED_BATCH with EMBED_CONCURRENCY requests in flight under the
+    EMBED_RPM / EMBED_TPM budget. Each finished batch is written to the
+    cache right away, so an interrupted build resumes where it stopped.
+    `report("embedding", done, total)` is called as batches finish.
+    `tokens[i]` (the chunker's count for texts[i], 0 if unknown) feeds
+    the EMBED_TPM budget instead of an estimate.
+    Returns (distinct texts sent to the API, texts copied from the cache).
+    """
+    clean = [clean_for_embedding(t) for t in texts]
+    positions = list(range(len(clean))) if positions is None else list(positions)
+    tokens = [0] * len(clean) if tokens is None else list(tokens)
+
+    keys = [text_key(t) for t in clean]
+    cached = cache.get_many(EMBED_MODEL, EMBED_DIMS, keys) if cache is not None else {}
+    targets = {}   # key -> rows of `out`, so repeated texts are sent once
+    first = {}
+    counts = {}
+    for k, t, pos, n in zip(keys, clean, positions, tokens):
+        if k in cached:
+            out[pos] = cached[k]
+        else:
+            targets.setdefault(k, []).append(pos)
+            first.setdefault(k, t)
+            counts.setdefault(k, n)
+    hits = len(clean) - sum(len(rows) for rows in targets.values())
+    if not targets:
+        return 0, hits
+
+    missing = list(targets)
+    batches = [missing[i:i+EMBED_BATCH] for i in range(0, len(missing), EMBED_BATCH)]
+    # a batch with any unknown count falls back to the limiter's estimate
+    batch_tokens = [sum(counts[k] for k in b) if all(counts[k] for k in b) else 0 for b in batches]
+    progress = tqdm(total=len(missing))
+
+    def on_batch(b, vectors):
+        for k, v in zip(batches[b], vectors):
+            out[targets[k]] = v
+        if cache is not None:
+            cache.put_many(EMBED_MODEL, EMBED_DIMS, dict(zip(batches[b], vectors)))
+        progress.update(len(vectors))
+        if report:
+            report("embedding", progress.n, len(missing))
+
+    try:
+        embed_batches(client, [[first[k] for k in b] for b in batches], out.shape[1], on_batch,
+                      EMBED_MODEL, EMBED_DIMS, EMBED_CONCURRENCY, RateLimiter(EMBED_RPM, EMBED_TPM), batch_tokens)
+    finally:
+        progress.close()
+    return len(missing), hits
 
 
 # ---------------------------
-# SMART CHUNKING
+# EMBED ROWS
 # ---------------------------
-def smart_chunk(text, max_chars=2000, overlap=300):
-    text = clean_text(text)
-    paragraphs = split_paragraphs(text)
+def embed_rows(client, rows, out, cache=None, reuse=None, report=None):
+    """
+    Fill out[j] with the normalized vector of rows[j]. `reuse(text_hash)`
+    may return a vector from the previous build; the rest are embedded
+    (through the cache). Returns (texts embedded by the API, rows whose
+    vector came from the cache).
+    """
+    to_embed = []
+    for j, row in enumerate(rows):
+        v = reuse(row["hash"]) if reuse else None
+        if v is not None:
+            out[j] = v
+        else:
+            to_embed.append(j)
 
-    chunks = []
-    current = ""
+    print(f"\n🔎 Creating embeddings for {len(to_embed)} chunks "
+          f"({EMBED_MODEL}, {EMBED_DIMS or 'full'} dims, {EMBED_CONCURRENCY} in flight)...")
+    embedded, cached = embed_texts(client, [rows[j]["text"] for j in to_embed], out, cache, to_embed, report,
+                                   [rows[j].get("tokens") or 0 for j in to_embed])
 
-    for para in paragraphs:
-        if len(current) + len(para) <= max_chars:
-            current += " " + para
-        else:
-            chunks.append(current.strip())
-            current = para
+    # normalize vectors (for cosine similarity)
+    faiss.normalize_L2(out)
+    return embedded, cached
 
-    if current:
-        chunks.append(current.strip())
 
-    # add overlap for context continuity
-    final_chunks = []
-    for i, ch in enumerate(chunks):
-        if i == 0:
-            final_chunks.append(ch)
-        else:
-            overlap_text = chunks[i-1][-overlap:]
-            final_chunks.append(overlap_text + " " + ch)
+def open_cache():
+    return EmbeddingCache(EMBED_CACHE_PATH) if EMBED_CACHE_PATH else None
 
-    # remove empty chunks
-    return [c for c in final_chunks if c.strip()]
+
+def close_cache(cache):
+    if cache is not None:
+        print(f"🗄 Embedding cache: {cache.report()}")
+        cache.close()
 
 
 # ---------------------------
-# SAFE EMBEDDING FUNCTION
+# UPSERT / DELETE API
 # ---------------------------
-def embed_texts(client, texts):
-    clean_batch = []
+def with_ids(rows):
+    """Give rows without an "id" the stable id of their (source, page, position on page)."""
+    seen = {}
+    out = []
+    for row in rows:
+        key = (row["source"], int(row.get("page") or 0))
+        position = seen.get(key, 0)
+        seen[key] = position + 1
+        row = dict(row)
+        row.setdefault("id", chunk_id(key[0], key[1], position))
+        row.setdefault("section", "General")
+        row["hash"] = text_hash(row["text"])
+        out.append(row)
+    for row, n in zip(out, count_tokens([row["text"] for row in out])):
+        row["tokens"] = n
+    return out
+
+
+def upsert_chunks(rows, client=None):
+    """
+    Embed and insert (or replace, by id) chunk rows in the built index
+    without a rebuild. Rows are {"source", "page", "text"} dicts with an
+    optional "section" and "id". Returns counts from ChunkIndex.apply.
+
+    Chunks added this way are not in the build manifest, so the next
+    build_index.py run does a full build from the PDFs (cheap with the
+    embedding cache) and drops them unless their PDF is in the list.
+    """
+    with writer_lock():
+        ci = ChunkIndex.open()
+        rows = with_ids(rows)
+        X = np.empty((len(rows), ci.vectors.shape[1]), dtype="float32")
+        cache = open_cache()
+        try:
+            embed_rows(client or make_client(), rows, X, cache)
+        finally:
+            close_cache(cache)
+        result = ci.apply(rows, X)
+        ci.save()
+    return result
+
+
+def delete_chunks(ids):
+    """Remove chunks (by id) from the built index without a rebuild."""
+    with writer_lock():
+        ci = ChunkIndex.open()
+        result = ci.delete(ids)
+        ci.save()
+    return result
+
+
+def compact_index():
+    """Retrain / rebuild the built index from its live vectors."""
+    with writer_lock():
+        ci = ChunkIndex.open()
+        ci.compact()
+        ci.save()
+    return {"count": len(ci.rows), "params": ci.params, "version": ci.files.version}
 
-    for t in texts:
-        if not isinstance(t, str):
-            continue
 
-        t = t.strip()
-
-        if not t:
-            continue
+# ---------------------------
+# PREVIOUS BUILD
+# ---------------------------
+def build_settings():
+    """Anything that changes the vectors or chunk boundaries forces a full build."""
+    return {
+        "embed_model": EMBED_MODEL,
+        "embed_dims": EMBED_DIMS,
+        "index_kind": INDEX_KIND,
+        "index_quant": INDEX_QUANT,
+        "chunker": CHUNKER,
+    }
+
+
+def load_previous(state, settings):
+    """
+    The last build as a ChunkIndex if it can be updated in place, else None.
+    The build manifest must describe exactly the chunks on disk; anything
+    else (older format, interrupted write, API upserts) means a full build.
+    """
+    if not state or state.get("settings") != settings:
+        return None
+    try:
+        ci = ChunkIndex.open()
+    except (OSError, ValueError):
+        return None
+    if sorted(all_ids(state)) != ci.ids.tolist():
+        return None
+    return ci
 
-        # remove problematic characters
-        t = t.encode("utf-8", "ignore").decode("utf-8")
 
-        # safety limit (avoid API rejection)
-        if len(t) > 8000:
-            t = t[:8000]
+# ---------------------------
+# COLLECT CHUNKS
+# ---------------------------
+def chunk_pages(pages):
+    """
+    Chunk rows of several (source, page_no, section, txt) pages, each with
+    its stable "id", text "hash" and "tokens" count. All pages are
+    tokenized in one batch.
+    """
+    windows = chunk_texts([clean_text(txt) for *_, txt in pages],
+                          CHUNKER["chunk_size"], CHUNKER["overlap"], CHUNKER["encoding"])
+    return [
+        [
+            {
+                "id": chunk_id(source, page_no, position),
+                "source": source,
+                "page": page_no,
+                "section": section,
+                "text": ch,
+                "hash": text_hash(ch),
+                "tokens": tokens,
+            }
+            for position, (ch, tokens) in enumerate(chunks)
+        ]
+        for (source, page_no, section, _), chunks in zip(pages, windows)
+    ]
 
-        clean_batch.append(t)
 
-    if not clean_batch:
-        return []
+def chunk_page(source, page_no, section, txt):
+    """Chunk rows of one page (see chunk_pages)."""
+    return chunk_pages([(source, page_no, section, txt)])[0]
 
-    response = client.embeddings.create(
-        model=EMBED_MODEL,
-        input=clean_batch
-    )
 
-    return [e.embedding for e in response.data]
+def iter_page_chunks(paths):
+    """
+    (source, page_no, page_hash, rows) for every non-empty page of `paths`,
+    streamed from the extraction pool and chunked CHUNK_PAGES pages at a
+    time. The section heading carries over from page to page within a
+    file, as in collect_chunks.
+    """
+    source, section = None, "General"
+    batch = []
 
+    def chunked():
+        rows = chunk_pages([(name, page_no, section, txt) for name, page_no, _, section, txt in batch])
+        for (name, page_no, page_hash, _, _), page_rows in zip(batch, rows):
+            yield name, page_no, page_hash, page_rows
+        batch.clear()
 
-# ---------------------------
-# MAIN PROCESS
-# ---------------------------
-def main():
-
-    pdf_files = [
-        DATA / "imirire.pdf",
-        DATA / "tubiteho.pdf",
-        DATA / "BROCHURE_IMBONEZAMIKURIRE_Y_ABANA_BATO (1).pdf",
-        DATA/ "6.1 First aid PG DRAFT 5 (V14.10.22) Kinyarwanda.pdf",
-        DATA/ "all.pdf",
-        DATA/ "3.1 Play PG DRAFT 5 (V14.10.22) Kinyarwanda.pdf",
-        DATA/ "3.2 Play BR DRAFT 4 (V26.04.22) Kinyarwanda.pdf",
-        DATA/ "4.1 Prenatal newborn postnatal care PG DRAFT 5 (V14.10.22) Kinyarwanda.pdf",
-        DATA/ "4.2 Prenatal newborn postnatal care BR DRAFT 5 (V14.10.22) Kinyarwanda.pdf"
-        
-    ]
-
-    all_chunks = []
-    meta = []
-
+    for path, page_no, txt in iter_pdf_pages(paths):
+        if path != source:
+            source, section = path, "General"
+        if not txt.strip():
+            continue
+        page_hash = text_hash(section, txt)
+        for line in txt.split("\n"):
+            if is_heading(line):
+                section = line.strip()
+        batch.append((os.path.basename(path), page_no, page_hash, section, txt))
+        if len(batch) >= CHUNK_PAGES:
+            yield from chunked()
+    yield from chunked()
+
+
+def collect_chunks(pdf_files, old_files, ci):
+    """
+    Chunk rows for the whole corpus, each with its "id" and text "hash".
+    Unchanged files and pages are copied from the previous build; only
+    changed ones are extracted and re-chunked. Returns (rows, files_state, stats).
+    """
+    rows, files_state = [], {}
+    stats = {"files_reused": 0, "files_read": 0, "pages_reused": 0, "pages_chunked": 0}
+
+    def old_rows(entries):
+        found = ci.find([cid for _, cid in entries])
+        return [dict(ci.rows[int(r)], hash=h) for (h, _), r in zip(entries, found)]
+
+    present = []
     for pdf_path in pdf_files:
         if not pdf_path.exists():
             print(f"⚠ {pdf_path} not found, skipping...")
             continue
+        present.append((pdf_path, file_sha256(str(pdf_path))))
+
+    # extract every changed PDF up front, spread over a process pool
+    to_read = [str(p) for p, sha in present
+               if not (old_files.get(p.name) and old_files[p.name]["sha256"] == sha)]
+    if to_read:
+        print(f"\n📖 Reading {len(to_read)} PDF(s): " + ", ".join(os.path.basename(p) for p in to_read))
+    extracted = read_pdfs(to_read)
+
+    for pdf_path, sha in present:
+        old = old_files.get(pdf_path.name)
+        if old and old["sha256"] == sha:
+            for page in old["pages"].values():
+                rows.extend(old_rows(page["chunks"]))
+            files_state[pdf_path.name] = old
+            stats["files_reused"] += 1
+            continue
 
-        print(f"\n📖 Reading: {pdf_path.name}")
-        pages = read_pdf_text(str(pdf_path))
+        pages = extracted[str(pdf_path)]
+        stats["files_read"] += 1
+        old_pages = old["pages"] if old else {}
+        pages_state = {}
 
         current_section = "General"
+        changed = []   # (page_no, page_hash, section, txt), chunked in one batch below
 
         for page_no, txt in pages:
             if not txt.strip():
                 continue
 
+            page_hash = text_hash(current_section, txt)
+
             # detect headings
             for line in txt.split("\n"):
                 if is_heading(line):
                     current_section = line.strip()
 
-            # create smart chunks
-            chunks = smart_chunk(txt)
+            old_page = old_pages.get(str(page_no))
+            if old_page and old_page["hash"] == page_hash:
+                pages_state[str(page_no)] = old_page
+                stats["pages_reused"] += 1
+            else:
+                pages_state[str(page_no)] = None   # keeps the page order
+                changed.append((page_no, page_hash, current_section, txt))
 
-            for ch in chunks:
-                if not ch.strip():
-                    continue
+        chunked = chunk_pages([(pdf_path.name, page_no, section, txt) for page_no, _, section, txt in changed])
+        new_rows = {}
+        for (page_no, page_hash, _, _), page_rows in zip(changed, chunked):
+            stats["pages_chunked"] += 1
+            pages_state[str(page_no)] = {"hash": page_hash, "chunks": [[r["hash"], r["id"]] for r in page_rows]}
+            new_rows[str(page_no)] = page_rows
+        for page_no, page in pages_state.items():
+            rows.extend(new_rows[page_no] if page_no in new_rows else old_rows(page["chunks"]))
 
-                all_chunks.append(ch)
-                meta.append({
-                    "source": pdf_path.name,
-                    "page": page_no,
-                    "section": current_section,
-                    "text": ch
-                })
+        files_state[pdf_path.name] = {"sha256": sha, "pages": pages_state}
 
-    if not all_chunks:
-        raise RuntimeError("❌ No text found in PDFs")
-
-    print(f"\n🔎 Creating embeddings for {len(all_chunks)} chunks...")
-
-    client = OpenAI()
-    embeddings = []
-    BATCH = 64
+    return rows, files_state, stats
 
-    for i in tqdm(range(0, len(all_chunks), BATCH)):
-        batch = all_chunks[i:i+BATCH]
-        vecs = embed_texts(client, batch)
-        if vecs:
-            embeddings.extend(vecs)
 
-    if not embeddings:
-        raise RuntimeError("❌ No embeddings generated")
-
-    X = np.array(embeddings).astype("float32")
+# ---------------------------
+# STREAMING FULL BUILD
+# ---------------------------
+def _shard_file(work, name, ext):
+    return os.path.join(work, name + ext)
+
+
+def build_shards(client, cache, present, settings, dim, work=BUILD_WORK_DIR, report=None):
+    """
+    Full build, stage 1: pages -> chunks -> embedding batches -> shards.
+
+    Pages stream out of the extraction pool and are chunked as they come;
+    every BUILD_SHARD_ROWS chunks (and at the end of each PDF) the buffer
+    is embedded and written to `work` as shard-NNNNN.npy (normalized
+    vectors) + shard-NNNNN.chunks (chunk store), so memory holds one shard
+    at most. work/progress.json lists the PDFs whose shards are complete;
+    a rerun after a crash skips those and restarts at the first unfinished
+    PDF (whose batches mostly come back from the embedding cache).
+    `report(stage, done, total)` follows PDFs and embedding batches.
+    Returns (progress, stats).
+    """
+    os.makedirs(work, exist_ok=True)
+    progress_path = os.path.join(work, "progress.json")
+    progress = read_build_manifest(progress_path)
+    if progress.get("settings") != settings or progress.get("dim") != dim:
+        progress = {}
+
+    shas = {p.name: sha for p, sha in present}
+    done = {name: f for name, f in progress.get("files", {}).items() if shas.get(name) == f["sha256"]}
+    keep = {s for f in done.values() for s in f["shards"]}
+    for fn in os.listdir(work):
+        if fn.startswith("shard-") and fn.split(".")[0] not in keep:
+            os.remove(os.path.join(work, fn))
+    progress = {"settings": settings, "dim": dim, "files": done, "next_shard": progress.get("next_shard", 0)}
+
+    todo = [(p, sha) for p, sha in present if p.name not in done]
+    stats = {"files_reused": len(done), "files_read": len(todo), "embedded": 0, "cached": 0,
+             "pages_reused": sum(len(f["pages"]) for f in done.values()), "pages_chunked": 0}
+    if done:
+        print(f"\n⏯ Resuming full build: {len(done)} PDF(s) already in {work}, {len(todo)} to go")
+
+    entries = {p.name: {"sha256": sha, "pages": {}, "shards": []} for p, sha in todo}
+    buffer = []
+
+    def flush(source):
+        if not buffer:
+            return
+        name = f"shard-{progress['next_shard']:05d}"
+        progress["next_shard"] += 1
+        X = np.empty((len(buffer), dim), dtype="float32")
+        embedded, cached = embed_rows(client, buffer, X, cache, report=report)
+        stats["embedded"] += embedded
+        stats["cached"] += cached
+        tmp = _shard_file(work, name, ".tmp.npy")
+        np.save(tmp, X)
+        os.replace(tmp, _shard_file(work, name, ".npy"))
+        write_chunks(_shard_file(work, name, ".chunks"), buffer)
+        entries[source]["shards"].append(name)
+        buffer.clear()
+
+    def finish(source):
+        flush(source)
+        progress["files"][source] = entries.pop(source)
+        write_build_manifest(progress_path, progress)
+        if report:
+            report("reading", len(progress["files"]) - len(done), len(todo))
+
+    pending = iter([p.name for p, _ in todo])
+    current = None
+    for source, page_no, page_hash, rows in iter_page_chunks([str(p) for p, _ in todo]):
+        while current != source:
+            if current is not None:
+                finish(current)
+            current = next(pending)
+        entries[source]["pages"][str(page_no)] = {"hash": page_hash, "chunks": [[r["hash"], r["id"]] for r in rows]}
+        stats["pages_chunked"] += 1
+        buffer.extend(rows)
+        if len(buffer) >= BUILD_SHARD_ROWS:
+            flush(source)
+    if current is not None:
+        finish(current)
+    for source in pending:   # PDFs without any text
+        finish(source)
+    return progress, stats
+
+
+def merge_shards(progress, kind=INDEX_KIND, work=BUILD_WORK_DIR):
+    """
+    Full build, stage 2: merge the shards into chunks.bin, vectors.npy and
+    the FAISS index of a new index version, all sorted by chunk id, and
+    publish it. Vectors are scattered into a memory-mapped vectors.npy and
+    the index is built from that file, so the only thing held in memory is
+    the index itself. Returns (index, params, published IndexVersion).
+    """
+    names = [s for f in progress["files"].values() for s in f["shards"]]
+    stores = [open_chunks(_shard_file(work, s, ".chunks")) for s in names]
+    offsets = np.cumsum([0] + [len(st) for st in stores])
+    n, dim = int(offsets[-1]), progress["dim"]
+    if not n:
+        raise RuntimeError("❌ No text found in PDFs")
 
-    # normalize vectors (for cosine similarity)
-    faiss.normalize_L2(X)
+    ids = np.concatenate([st.chunk_id for st in stores]).astype("int64")
+    order = np.argsort(ids, kind="stable")
+    ids = ids[order]
+    if (np.diff(ids) == 0).any():
+        raise ValueError("duplicate chunk ids")
+    rank = np.empty(n, dtype="int64")
+    rank[order] = np.arange(n)
+
+    staged = stage_version()
+    try:
+        X = np.lib.format.open_memmap(staged.vectors_path, mode="w+", dtype="float32", shape=(n, dim))
+        for s, start, stop in zip(names, offsets[:-1], offsets[1:]):
+            X[rank[start:stop]] = np.load(_shard_file(work, s, ".npy"))
+        X.flush()
+
+        def sorted_rows():
+            shard = np.searchsorted(offsets, order, side="right") - 1
+            for i, k in zip(order, shard):
+                yield stores[k][int(i - offsets[k])]
+
+        write_chunks(staged.chunks_path, sorted_rows())
+
+        print(f"\n🧱 Building {kind} index over {n} chunks (dim={dim})...")
+        index, params = build_ann_index(X, kind, ids=ids)
+        del X
+        faiss.write_index(index, staged.faiss_path)
+        manifest = make_manifest(kind, params, dim, index.ntotal, EMBED_MODEL, staged.vectors_path,
+                                 EMBED_DIMS, staged.chunks_path)
+        manifest.update({"chunker": CHUNKER, "sources": len(progress["files"]), "trained_count": n, "churn": 0})
+        write_manifest(staged.manifest_path, manifest)
+        published = publish(staged)
+    except BaseException:
+        discard(staged)
+        raise
+    return index, params, published
+
+
+def full_build(client, cache, pdf_files, settings, report=None):
+    """Streaming full build; returns (index, params, published version, files_state, stats)."""
+    present = []
+    for pdf_path in pdf_files:
+        if not pdf_path.exists():
+            print(f"⚠ {pdf_path} not found, skipping...")
+            continue
+        present.append((pdf_path, file_sha256(str(pdf_path))))
 
-    dim = X.shape[1]
-    index = faiss.IndexFlatIP(dim)
-    index.add(X)
+    dim = output_dims(client, EMBED_MODEL, EMBED_DIMS)
+    progress, stats = build_shards(client, cache, present, settings, dim, report=report)
+    index, params, published = merge_shards(progress)
+    files_state = {name: {"sha256": f["sha256"], "pages": f["pages"]} for name, f in progress["files"].items()}
+    return index, params, published, files_state, stats
 
-    faiss.write_index(index, FAISS_PATH)
 
-    with open(META_PATH, "w", encoding="utf-8") as f:
-        for row in meta:
-            f.write(json.dumps(row, ensure_ascii=False) + "\n")
+# ---------------------------
+# MAIN PROCESS
+# ---------------------------
+def build(full=False, pdf_files=None, report=None, allow_full=True):
+    """
+    Build or incrementally update the index over `pdf_files` (default:
+    config.corpus_pdfs()) and publish it as a new version. `report(stage,
+    done, total)` is called as the build progresses. Returns a summary
+    dict; "version" is None when the index was already up to date. With
+    allow_full=False (API ingestion) a build that would have to start over
+    raises RuntimeError instead.
+    """
+    report = report or (lambda stage, done=0, total=0: None)
+    pdf_files = corpus_pdfs() if pdf_files is None else pdf_files
+
+    with writer_lock():
+        settings = build_settings()
+        state = read_build_manifest(BUILD_MANIFEST_PATH)
+        ci = None if full else load_previous(state, settings)
+        if ci is None and not allow_full:
+            raise RuntimeError("the index needs a full rebuild (build manifest missing or out of date); "
+                               "run build_index.py, the PDF stays in DOCS_DIR and goes in with it")
+        client = make_client()
+        cache = open_cache()
+        try:
+            if ci is None:
+                print("\n🆕 Full build")
+                report("reading", 0, len(pdf_files))
+                index, params, published, files_state, stats = full_build(client, cache, pdf_files, settings, report)
+                write_build_manifest(BUILD_MANIFEST_PATH, {"settings": settings, "files": files_state})
+                shutil.rmtree(BUILD_WORK_DIR, ignore_errors=True)
+                kind, embedded, cached, count = INDEX_KIND, stats["embedded"], stats["cached"], index.ntotal
+                result = {"added": count, "updated": 0, "deleted": 0, "compacted": False}
+                raw_bytes = count * index.d * 4
+            else:
+                old_files = state["files"]
+                print(f"\n♻ Incremental build over {len(ci.rows)} indexed chunks")
+                report("reading", 0, len(pdf_files))
+                meta, files_state, stats = collect_chunks(pdf_files, old_files, ci)
+
+                if not meta:
+                    raise RuntimeError("❌ No text found in PDFs")
+                if files_state == old_files:
+                    print("\n✅ Index is up to date (no PDF changes)")
+                    return {"version": None, "full": False, "chunks": len(ci.rows), "added": 0, "updated": 0,
+                            "deleted": 0, "compacted": False, "embedded": 0, "cached": 0, **stats}
+
+                # only new chunks and chunks whose text or section changed are upserted
+                old_hash = {cid: h for f in old_files.values() for p in f["pages"].values() for h, cid in p["chunks"]}
+                old_row = ci.find([r["id"] for r in meta])
+                changed = [r for r, j in zip(meta, old_row)
+                           if j < 0 or old_hash.get(r["id"]) != r["hash"] or ci.rows[j]["section"] != r["section"]]
+                gone = set(old_hash) - {r["id"] for r in meta}
+
+                # text that was indexed before (moved or duplicated) reuses that vector
+                by_hash = ids_by_hash(state)
+
+                def reuse(h):
+                    cid = by_hash.get(h)
+                    row = int(ci.find([cid])[0]) if cid is not None else -1
+                    return ci.vectors[row] if row >= 0 else None
+
+                X = np.empty((len(changed), ci.vectors.shape[1]), dtype="float32")
+                embedded, cached = embed_rows(client, changed, X, cache, reuse, report)
+                print(f"\n🧱 Updating {ci.kind} index: upsert {len(changed)}, delete {len(gone)}...")
+                report("indexing", 0, len(changed) + len(gone))
+                result = ci.apply(changed, X, gone)
+                report("publishing")
+                published = ci.save()
+                write_build_manifest(BUILD_MANIFEST_PATH, {"settings": settings, "files": files_state})
+                index, kind, params, count, raw_bytes = ci.index, ci.kind, ci.params, len(ci.rows), ci.vectors.nbytes
+        finally:
+            close_cache(cache)   # also when the build fails
+
+    return {
+        "version": published.version, "directory": published.directory, "manifest": published.manifest_path,
+        "full": ci is None, "kind": kind, "params": params, "chunks": count, "embedded": embedded, "cached": cached,
+        "index_bytes": index_nbytes(index), "raw_bytes": raw_bytes, **result, **stats,
+    }
+
+
+def main(full=False):
+    result = build(full)
+    if result["version"] is None:
+        return
 
     print("\n✅ Index built successfully!")
-    print(f"Chunks indexed: {len(all_chunks)}")
-    print(f"Saved index: {FAISS_PATH}")
-    print(f"Metadata: {META_PATH}")
+    print(f"Chunks indexed: {result['chunks']} (added {result['added']}, updated {result['updated']}, "
+          f"deleted {result['deleted']}; vectors computed {result['embedded']}, from cache {result['cached']})"
+          + (" — index retrained (compacted)" if result["compacted"] else ""))
+    print(f"PDFs: {result['files_read']} read, {result['files_reused']} unchanged; "
+          f"pages: {result['pages_chunked']} re-chunked, {result['pages_reused']} unchanged")
+    print(f"Published version: {result['version']} ({result['directory']})")
+    print(f"Manifest: {result['manifest']} ({result['kind']} {result['params']})")
+    print(f"Index size: {result['index_bytes'] / 1e6:.1f} MB per worker "
+          f"(uncompressed: {result['raw_bytes'] / 1e6:.1f} MB)")
 
 
 if __name__ == "__main__":
-    main()
+    ap = argparse.ArgumentParser(description="Build or incrementally update the FAISS index")
+    ap.add_argument("--full", action="store_true", help="ignore the previous build and re-embed everything")
+    ap.add_argument("--compact", action="store_true", help="retrain the built index from its live vectors and exit")
+    args = ap.parse_args()
+    if args.compact:
+        print(compact_index())
+    else:
+        main(full=args.full)
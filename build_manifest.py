@@ -0,0 +1,72 @@
+"""
+Build manifest (data/build_manifest.json): what the last build_index.py run
+indexed, so the next run only extracts, embeds and inserts what changed.
+
+    {
+      "settings": {...},          # embed model/dims, index kind, chunker
+      "files": {
+        "imirire.pdf": {
+          "sha256": "...",
+          "pages": {"3": {"hash": "...", "chunks": [["<text sha256>", <chunk id>], ...]}}
+        }
+      }
+    }
+
+A file whose sha256 is unchanged is not even opened. A page whose hash
+(page text + the section heading carried into it) is unchanged keeps its
+chunks and vectors. On changed pages only chunks whose text hash changed
+are re-embedded and upserted (chunk ids are chunk_index.chunk_id of
+source/page/position); ids that are no longer listed are deleted.
+"""
+import hashlib
+import json
+import os
+from typing import Dict, List
+
+VERSION = 2
+
+
+def file_sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def text_hash(*parts: str) -> str:
+    return hashlib.sha256("\0".join(parts).encode("utf-8")).hexdigest()
+
+
+def read_build_manifest(path: str) -> Dict:
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        state = json.load(f)
+    return state if state.get("version") == VERSION else {}
+
+
+def write_build_manifest(path: str, state: Dict) -> None:
+    state = dict(state, version=VERSION)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+def page_ids(file_state: Dict) -> List[int]:
+    return [cid for page in file_state.get("pages", {}).values() for _, cid in page["chunks"]]
+
+
+def all_ids(state: Dict) -> List[int]:
+    return [cid for f in state.get("files", {}).values() for cid in page_ids(f)]
+
+
+def ids_by_hash(state: Dict) -> Dict[str, int]:
+    """Text hash -> one chunk id that had that text (to reuse its vector)."""
+    out: Dict[str, int] = {}
+    for f in state.get("files", {}).values():
+        for page in f.get("pages", {}).values():
+            for h, cid in page["chunks"]:
+                out.setdefault(h, cid)
+    return out
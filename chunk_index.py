@@ -0,0 +1,177 @@
+"""
+Updatable view of a built index: FAISS index + chunks.bin + vectors.npy,
+all keyed by stable 64-bit chunk ids.
+
+    ci = ChunkIndex.open()
+    ci.apply(rows, X, delete_ids=[...])   # upsert rows (with vectors X), delete ids
+    ci.save()                             # publishes a new index version
+
+A chunk's id is a hash of (source, page, position of the chunk on the
+page), so the same slot keeps its id across rebuilds and an edited chunk
+is an upsert of that id. Indexes that support remove_ids (flat, IVF) are
+updated in place; HNSW graphs are rebuilt from vectors.npy. Trained
+indexes (IVF, PQ, OPQ) are compacted, i.e. retrained from the live
+vectors, once the churn since they were trained exceeds
+INDEX_COMPACT_RATIO of their size. The published version is never
+modified: save() writes a new one (see index_version).
+"""
+import hashlib
+from typing import Dict, Iterable, List
+
+import faiss
+import numpy as np
+
+from chunk_store import open_chunks, write_chunks
+from config import INDEX_DIR, INDEX_COMPACT_RATIO, EMBED_MODEL, EMBED_DIMS
+from index_store import (
+    apply_search_params, build_ann_index, default_params, make_manifest, read_manifest,
+    supports_remove, write_manifest,
+)
+from index_version import IndexVersion, discard, publish, resolve_index, stage_version
+
+_ID_MASK = (1 << 63) - 1   # FAISS ids are signed; -1 means "no result"
+
+
+def chunk_id(source: str, page: int, position: int) -> int:
+    """Stable non-negative 63-bit id for the `position`-th chunk of a page."""
+    digest = hashlib.blake2b(f"{source}\0{page}\0{position}".encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little") & _ID_MASK
+
+
+class ChunkIndex:
+    def __init__(self, index, kind: str, params: Dict, rows: List[Dict], vectors: np.ndarray, manifest: Dict,
+                 files: IndexVersion, index_dir: str = INDEX_DIR):
+        self.index = index
+        self.kind = kind
+        self.params = params
+        self.rows = rows            # sorted by id
+        self.vectors = vectors      # row i belongs to rows[i]
+        self.manifest = manifest
+        self.files = files          # version the index was loaded from / last saved as
+        self.index_dir = index_dir
+
+    # ---------------------------
+    # OPEN
+    # ---------------------------
+    @classmethod
+    def open(cls, index_dir: str = INDEX_DIR) -> "ChunkIndex":
+        """Load the published index for updating. Raises ValueError if its files disagree."""
+        files = resolve_index(index_dir)
+        manifest = read_manifest(files.manifest_path)
+        if not manifest.get("chunks") or not manifest.get("vectors"):
+            raise ValueError("index has no chunk ids or vectors; rebuild with `python build_index.py --full`")
+        store = open_chunks(files.chunks_path)
+        vectors = np.load(files.vectors_path, mmap_mode="r")
+        index = faiss.read_index(files.faiss_path)
+        if not (len(store) == len(vectors) == index.ntotal):
+            raise ValueError(f"index ({index.ntotal}), chunks ({len(store)}) and vectors ({len(vectors)}) "
+                             "are out of sync; rebuild with `python build_index.py --full`")
+        kind = manifest.get("index_kind", "flat")
+        return cls(index, kind, manifest.get("params") or {}, list(store), vectors, manifest, files, index_dir)
+
+    # ---------------------------
+    # UPDATE
+    # ---------------------------
+    @property
+    def ids(self) -> np.ndarray:
+        return _ids(self.rows)
+
+    def find(self, ids) -> np.ndarray:
+        """Row of each chunk id (-1 where the id is not indexed)."""
+        own = self.ids
+        ids = np.asarray(ids, dtype="int64")
+        if not len(own):
+            return np.full(ids.shape, -1, dtype="int64")
+        rows = np.searchsorted(own, ids).clip(0, len(own) - 1)
+        return np.where(own[rows] == ids, rows, -1)
+
+    def apply(self, rows: List[Dict], X: np.ndarray, delete_ids: Iterable[int] = ()) -> Dict:
+        """
+        Upsert `rows` (dicts with "id", "source", "page", "section", "text")
+        with their normalized vectors X, and delete `delete_ids`. Returns counts.
+        """
+        new_ids = _ids(rows)
+        if len(np.unique(new_ids)) != len(new_ids):
+            raise ValueError("duplicate chunk ids in upsert")
+        old_ids = self.ids
+        deleted = np.intersect1d(np.asarray(list(delete_ids), dtype="int64"), old_ids)
+        deleted = np.setdiff1d(deleted, new_ids)
+        replaced = np.intersect1d(new_ids, old_ids)
+        drop = np.union1d(deleted, replaced)
+
+        keep = ~np.isin(old_ids, drop)
+        merged_ids = np.concatenate([old_ids[keep], new_ids])
+        order = np.argsort(merged_ids, kind="stable")
+        kept_rows = [r for r, k in zip(self.rows, keep) if k]
+        merged_rows = kept_rows + list(rows)
+        self.rows = [merged_rows[i] for i in order]
+        self.vectors = np.concatenate([np.asarray(self.vectors[keep]), np.asarray(X, dtype="float32")])[order]
+
+        if supports_remove(self.kind):
+            if len(drop):
+                self.index.remove_ids(drop)
+            if len(new_ids):
+                self.index.add_with_ids(np.ascontiguousarray(X, dtype="float32"), new_ids)
+        elif len(drop) or len(new_ids):
+            self.index, self.params = build_ann_index(self.vectors, self.kind, self.params, ids=self.ids)
+
+        self.manifest["churn"] = int(self.manifest.get("churn", 0)) + len(drop) + len(new_ids)
+        compacted = self.maybe_compact()
+        return {"added": len(new_ids) - len(replaced), "updated": len(replaced),
+                "deleted": len(deleted), "compacted": compacted}
+
+    def delete(self, ids: Iterable[int]) -> Dict:
+        return self.apply([], np.empty((0, self.vectors.shape[1]), dtype="float32"), ids)
+
+    def needs_compaction(self, ratio: float = INDEX_COMPACT_RATIO) -> bool:
+        if ratio <= 0 or not self._trainable():
+            return False
+        trained = int(self.manifest.get("trained_count") or len(self.rows) or 1)
+        return int(self.manifest.get("churn", 0)) > ratio * trained
+
+    def maybe_compact(self) -> bool:
+        if not self.needs_compaction():
+            return False
+        self.compact()
+        return True
+
+    def compact(self) -> None:
+        """Retrain and rebuild the index from the live vectors (fresh nlist / PQ bits for the new size)."""
+        n, dim = self.vectors.shape
+        params = default_params(self.kind, n, dim, self.params.get("quant", "none"))
+        self.index, self.params = build_ann_index(np.ascontiguousarray(self.vectors), self.kind, params, ids=self.ids)
+        self.manifest["trained_count"] = n
+        self.manifest["churn"] = 0
+
+    def _trainable(self) -> bool:
+        return self.kind == "ivf" or self.params.get("quant", "none") in ("pq", "opq")
+
+    # ---------------------------
+    # SAVE
+    # ---------------------------
+    def save(self) -> IndexVersion:
+        """Write index, vectors and chunks as a new version and publish it."""
+        apply_search_params(self.index, self.kind, self.params)
+        staged = stage_version(self.index_dir)
+        try:
+            faiss.write_index(self.index, staged.faiss_path)
+            np.save(staged.vectors_path, np.ascontiguousarray(self.vectors, dtype="float32"))
+            write_chunks(staged.chunks_path, self.rows)
+            manifest = dict(self.manifest)
+            manifest.update(make_manifest(self.kind, self.params, self.vectors.shape[1], self.index.ntotal,
+                                          self.manifest.get("embed_model") or EMBED_MODEL, staged.vectors_path,
+                                          self.manifest.get("embed_dims", EMBED_DIMS), staged.chunks_path))
+            manifest["trained_count"] = int(self.manifest.get("trained_count") or self.index.ntotal)
+            manifest["churn"] = int(self.manifest.get("churn", 0))
+            write_manifest(staged.manifest_path, manifest)
+            self.files = publish(staged, self.index_dir)
+        except BaseException:
+            discard(staged)
+            raise
+        self.manifest = read_manifest(self.files.manifest_path)
+        return self.files
+
+
+def _ids(rows: List[Dict]) -> np.ndarray:
+    return np.fromiter((int(r["id"]) for r in rows), dtype="int64", count=len(rows))
+
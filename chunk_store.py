@@ -0,0 +1,305 @@
+"""
+Compact columnar store for chunk metadata (data/chunks.bin).
+
+Layout: 8-byte magic, uint64 header length, JSON header, then 8-byte
+aligned column arrays and one UTF-8 text blob:
+
+    text_offsets  uint64[n+1]   byte range of row i in the blob
+    chunk_id      int64[n]      stable id (the FAISS id), ascending
+    source_id     uint32[n]     index into header["sources"]
+    section_id    uint32[n]     index into header["sections"]
+    page          int32[n]
+    tokens        uint32[n]     token count of the text (0 = unknown)
+    blob          bytes         all chunk texts back to back
+
+The file is loaded with one read (or one mmap, shared by every worker),
+and a row's strings are only decoded when that row is accessed. Full
+scans (the keyword fallback) go over the text column with texts() or
+term_counts() instead of building every row.
+"""
+import io
+import json
+import mmap
+import os
+import re
+import shutil
+from array import array
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence
+
+import numpy as np
+
+MAGIC = b"ITCHUNK1"
+
+_COLUMNS = (
+    ("text_offsets", "<u8"),
+    ("chunk_id", "<i8"),
+    ("source_id", "<u4"),
+    ("section_id", "<u4"),
+    ("page", "<i4"),
+    ("tokens", "<u4"),
+)
+
+
+# ---------------------------
+# WRITE
+# ---------------------------
+def _pad(n: int) -> int:
+    return (8 - n % 8) % 8
+
+
+class ChunkWriter:
+    """
+    Builds a chunk store one row at a time. Per-row columns are kept in
+    compact arrays (~32 bytes a row) and texts go straight to `blob`, a
+    binary file object (a temp file for write_chunks, BytesIO for
+    encode_chunks), so memory does not grow with the corpus text.
+    """
+
+    def __init__(self, blob, info: Optional[Dict] = None):
+        self.blob = blob
+        self.info = info or {}
+        self.sources: Dict[str, int] = {}
+        self.sections: Dict[str, int] = {}
+        self.chunk_id = array("q")
+        self.source_id = array("I")
+        self.section_id = array("I")
+        self.page = array("i")
+        self.tokens = array("I")
+        self.text_offsets = array("Q", [0])
+
+    def add(self, row: Dict) -> None:
+        self.chunk_id.append(int(row.get("id", len(self.chunk_id))))
+        self.source_id.append(self.sources.setdefault(str(row.get("source", "")), len(self.sources)))
+        self.section_id.append(self.sections.setdefault(str(row.get("section", "")), len(self.sections)))
+        self.page.append(int(row.get("page") or 0))
+        self.tokens.append(int(row.get("tokens") or 0))
+        t = str(row.get("text", "")).encode("utf-8")
+        self.blob.write(t)
+        self.text_offsets.append(self.text_offsets[-1] + len(t))
+
+    def __len__(self) -> int:
+        return len(self.chunk_id)
+
+    def head(self) -> bytes:
+        """Magic, header and column arrays; the text blob follows them."""
+        arrays = {name: np.asarray(getattr(self, name), dtype=dtype) for name, dtype in _COLUMNS}
+
+        # header offsets are relative to the start of the data section
+        layout, pos = {}, 0
+        for name, _ in _COLUMNS:
+            layout[name] = [pos, len(arrays[name])]
+            pos += arrays[name].nbytes + _pad(arrays[name].nbytes)
+        header = {
+            "count": len(self),
+            "sources": list(self.sources),
+            "sections": list(self.sections),
+            "columns": layout,
+            "blob": [pos, int(self.text_offsets[-1])],
+            "info": self.info,
+        }
+        hbytes = json.dumps(header, ensure_ascii=False).encode("utf-8")
+        hbytes += b" " * _pad(len(MAGIC) + 8 + len(hbytes))
+
+        parts = [MAGIC, np.uint64(len(hbytes)).tobytes(), hbytes]
+        for name, _ in _COLUMNS:
+            b = arrays[name].tobytes()
+            parts.append(b + b"\0" * _pad(len(b)))
+        return b"".join(parts)
+
+
+def encode_chunks(rows: Iterable[Dict], info: Optional[Dict] = None) -> bytes:
+    """
+    Serialize rows of {"source", "page", "section", "text"} (and optionally
+    "id", defaulting to the row position, and "tokens") to the chunk store format.
+    """
+    blob = io.BytesIO()
+    writer = ChunkWriter(blob, info)
+    for row in rows:
+        writer.add(row)
+    return writer.head() + blob.getvalue()
+
+
+def write_chunks(path: str, rows: Iterable[Dict], info: Optional[Dict] = None) -> int:
+    """
+    Stream rows into the store and replace `path` atomically (readers never
+    see a half-written file). Texts are spooled to a temp file, not memory.
+    """
+    blob_path = path + ".blob.tmp"
+    with open(blob_path, "w+b") as blob:
+        writer = ChunkWriter(blob, info)
+        for row in rows:
+            writer.add(row)
+        blob.seek(0)
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(writer.head())
+            shutil.copyfileobj(blob, f, 1 << 20)
+    os.remove(blob_path)
+    os.replace(tmp, path)
+    return len(writer)
+
+
+# ---------------------------
+# READ
+# ---------------------------
+def read_header(buf) -> Dict:
+    if bytes(buf[: len(MAGIC)]) != MAGIC:
+        raise ValueError("not a chunk store file")
+    hlen = int(np.frombuffer(buf, dtype="<u8", count=1, offset=len(MAGIC))[0])
+    start = len(MAGIC) + 8
+    header = json.loads(bytes(buf[start : start + hlen]).decode("utf-8"))
+    header["data_start"] = start + hlen
+    return header
+
+
+class ChunkStore(Sequence):
+    """
+    Read-only rows over a chunk store buffer (bytes or mmap). Indexing
+    returns the same {"source", "page", "section", "text"} dicts that
+    meta.jsonl used to hold (plus the chunk "id" and "tokens"), built on demand.
+    """
+
+    def __init__(self, buf):
+        self._buf = buf
+        header = read_header(buf)
+        self.info: Dict = header.get("info") or {}
+        self.sources: List[str] = header["sources"]
+        self.sections: List[str] = header["sections"]
+        base = header["data_start"]
+        for name, dtype in _COLUMNS:
+            if name in header["columns"]:
+                off, count = header["columns"][name]
+                setattr(self, name, np.frombuffer(buf, dtype=dtype, count=count, offset=base + off))
+        blob_off, blob_len = header["blob"]
+        self._blob = memoryview(buf)[base + blob_off : base + blob_off + blob_len]
+        self._count = header["count"]
+        if not hasattr(self, "chunk_id"):
+            self.chunk_id = np.arange(self._count, dtype="<i8")
+        if not hasattr(self, "tokens"):   # stores written before token counts
+            self.tokens = np.zeros(self._count, dtype="<u4")
+        self._lower_ok: Optional[bool] = None   # see _ascii_lower_ok
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[Dict], info: Optional[Dict] = None) -> "ChunkStore":
+        """In-memory store, e.g. for chunks that are never written to disk."""
+        return cls(encode_chunks(rows, info))
+
+    def __len__(self) -> int:
+        return self._count
+
+    def text(self, i: int) -> str:
+        return str(self._blob[int(self.text_offsets[i]) : int(self.text_offsets[i + 1])], "utf-8")
+
+    def texts(self) -> Iterator[str]:
+        """Every row's text in order, without building the row dicts."""
+        offsets = self.text_offsets.tolist()
+        for start, end in zip(offsets, offsets[1:]):
+            yield str(self._blob[start:end], "utf-8")
+
+    def term_counts(self, terms: Iterable[str]) -> np.ndarray:
+        """
+        Occurrences of the (lowercase) terms in each row's lowercased text,
+        summed per row, like str.lower().count() on every row but without
+        decoding the rows: the text column is lowercased once as bytes, and
+        a rare term is located by one search over it instead of per row
+        (a match running from one row into the next is not counted).
+        """
+        terms = [t for t in terms if t]
+        counts = np.zeros(len(self), dtype=np.int64)
+        if not terms or not len(self):
+            return counts
+        if not self._ascii_lower_ok():
+            for i, text in enumerate(self.texts()):
+                text = text.lower()
+                counts[i] = sum(text.count(t) for t in terms)
+            return counts
+        lowered = bytes(self._blob).lower()
+        offsets = self.text_offsets.astype(np.int64)
+        spans = None
+        for term in terms:
+            needle = term.encode("utf-8")
+            found = lowered.count(needle)
+            if not found:
+                continue
+            if found < len(self):
+                starts = np.fromiter((m.start() for m in re.finditer(re.escape(needle), lowered)),
+                                     dtype=np.int64, count=found)
+                rows = np.searchsorted(offsets, starts, side="right") - 1
+                inside = starts + len(needle) <= offsets[rows + 1]   # not running into the next row
+                np.add.at(counts, rows[inside], 1)
+            else:
+                spans = spans or list(zip(offsets[:-1].tolist(), offsets[1:].tolist()))
+                counts += np.fromiter((lowered.count(needle, a, b) for a, b in spans),
+                                      dtype=np.int64, count=len(self))
+        return counts
+
+    def _ascii_lower_ok(self) -> bool:
+        """Whether lowercasing the text as bytes (ASCII only) gives what str.lower() does."""
+        if self._lower_ok is None:
+            blob = bytes(self._blob)
+            self._lower_ok = str(blob, "utf-8").lower().encode("utf-8") == blob.lower()
+        return self._lower_ok
+
+    def find(self, ids) -> np.ndarray:
+        """Row of each chunk id (-1 where the id is not in the store)."""
+        ids = np.asarray(ids, dtype="int64")
+        if not len(self):
+            return np.full(ids.shape, -1, dtype="int64")
+        rows = np.searchsorted(self.chunk_id, ids).clip(0, len(self) - 1)
+        return np.where(self.chunk_id[rows] == ids, rows, -1)
+
+    def source(self, i: int) -> str:
+        return self.sources[int(self.source_id[i])]
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return {
+            "id": int(self.chunk_id[i]),
+            "source": self.sources[int(self.source_id[i])],
+            "page": int(self.page[i]),
+            "section": self.sections[int(self.section_id[i])],
+            "text": self.text(i),
+            "tokens": int(self.tokens[i]),
+        }
+
+    def __iter__(self) -> Iterator[Dict]:
+        for i in range(len(self)):
+            yield self[i]
+
+
+def term_counts(rows: Sequence[Dict], terms: Iterable[str]) -> np.ndarray:
+    """ChunkStore.term_counts for a chunk store or a list of row dicts (legacy meta.jsonl)."""
+    if isinstance(rows, ChunkStore):
+        return rows.term_counts(terms)
+    terms = [t for t in terms if t]
+    counts = np.zeros(len(rows), dtype=np.int64)
+    for i, row in enumerate(rows):
+        text = str(row.get("text", "")).lower()
+        counts[i] = sum(text.count(t) for t in terms)
+    return counts
+
+
+def open_chunks(path: str, use_mmap: bool = True) -> ChunkStore:
+    """mmap the store (pages shared between workers) or read it in one call."""
+    with open(path, "rb") as f:
+        if use_mmap and os.fstat(f.fileno()).st_size:
+            return ChunkStore(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+        return ChunkStore(f.read())
+
+
+def read_meta(meta_path: str) -> List[Dict]:
+    """Legacy meta.jsonl from builds before the chunk store, parsed into memory."""
+    with open(meta_path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def load_rows(path: str, use_mmap: bool = True) -> Sequence[Dict]:
+    """Chunk rows from a chunk store, or from a legacy meta.jsonl."""
+    with open(path, "rb") as f:
+        is_store = f.read(len(MAGIC)) == MAGIC
+    return open_chunks(path, use_mmap) if is_store else read_meta(path)
@@ -10,7 +10,8 @@ DATA = ROOT / "data"
 def pick_path(primary: Path, fallback: Path) -> str:
     return str(primary if primary.exists() else fallback)
 
-PDF_PATHS = [
+# the built-in guides; PDF_PATHS (os.pathsep-separated) replaces the list
+PDF_PATHS = [Path(p) for p in os.getenv("PDF_PATHS", "").split(os.pathsep) if p] or [
     DATA / "imirire.pdf",
     DATA / "tubiteho.pdf",
     DATA / "BROCHURE_IMBONEZAMIKURIRE_Y_ABANA_BATO (1).pdf",
@@ -22,19 +23,121 @@ PDF_PATHS = [
     DATA / "4.2 Prenatal newborn postnatal care BR DRAFT 5 (V14.10.22) Kinyarwanda.pdf",
 ]
 
+# PDFs uploaded through POST /admin/documents; every PDF in here is part of the corpus too
+DOCS_DIR = Path(os.getenv("DOCS_DIR") or DATA / "documents")
+
+def corpus_pdfs() -> list:
+    """Every PDF to index: PDF_PATHS, then the uploads in DOCS_DIR (by name)."""
+    uploads = sorted(DOCS_DIR.glob("*.pdf")) if DOCS_DIR.is_dir() else []
+    return PDF_PATHS + [p for p in uploads if p.name not in {q.name for q in PDF_PATHS}]
+
 PDF_PATH   = os.getenv("PDF_PATH")   or pick_path(DATA / "imirire.pdf", DATA / "imirire.pdf")
 FAISS_PATH = os.getenv("FAISS_PATH") or pick_path(DATA / "index.faiss", DATA / "index.faiss")
-META_PATH  = os.getenv("META_PATH")  or pick_path(DATA / "meta.jsonl", DATA / "meta.jsonl")
+META_PATH  = os.getenv("META_PATH")  or pick_path(DATA / "meta.jsonl", DATA / "meta.jsonl")   # legacy builds
+CHUNKS_PATH = os.getenv("CHUNKS_PATH") or pick_path(DATA / "chunks.bin", DATA / "chunks.bin")
 SYN_PATH   = os.getenv("SYN_PATH")   or pick_path(DATA / "synonyms.json", DATA / "synonyms.json")
+MANIFEST_PATH = os.getenv("MANIFEST_PATH") or pick_path(DATA / "manifest.json", DATA / "manifest.json")
+VECTORS_PATH  = os.getenv("VECTORS_PATH")  or pick_path(DATA / "vectors.npy", DATA / "vectors.npy")
+EMBED_CACHE_PATH = os.getenv("EMBED_CACHE_PATH", str(DATA / "embed_cache.sqlite"))   # "" disables the cache
+BUILD_MANIFEST_PATH = os.getenv("BUILD_MANIFEST_PATH") or pick_path(DATA / "build_manifest.json", DATA / "build_manifest.json")
+
+# Published index versions (INDEX_DIR/versions/<version>, INDEX_DIR/current -> the live one).
+# FAISS_PATH / CHUNKS_PATH / VECTORS_PATH / MANIFEST_PATH are only read when nothing is published yet.
+INDEX_DIR           = os.getenv("INDEX_DIR") or str(DATA / "index")
+INDEX_KEEP_VERSIONS = int(os.getenv("INDEX_KEEP_VERSIONS", "3"))
+INDEX_VERIFY        = int(os.getenv("INDEX_VERIFY", "0"))   # 1 = check sha256 of every file on load
+INDEX_WATCH_INTERVAL = float(os.getenv("INDEX_WATCH_INTERVAL", "5"))   # seconds between checks for a new version; 0 = off
+
+# Module whose get_response answers /chat in main.py: src.chat, or one of the FAISS pipelines
+# src.chats, src.chat_flexible, src.chat_strict_without_paraphrasing
+CHAT_PIPELINE = os.getenv("CHAT_PIPELINE", "src.chat")
+
+# Token for the /admin endpoints of main.py (sent as X-Admin-Token); unset = admin endpoints disabled
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+# Uploads accepted by POST /admin/documents
+MAX_UPLOAD_MB = int(os.getenv("MAX_UPLOAD_MB", "50"))
+
+# Sampling profiler of /chat (see profiler.py): share of requests profiled (0 = off), stack sample
+# interval, and "cpu" (weight samples by the thread's CPU time) or "wall"
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+PROFILE_MODE        = os.getenv("PROFILE_MODE", "cpu").lower()
+
+# Seconds a /chat request may take (see deadline.py; 0 = no deadline); past it the pipeline answers
+# with the last full answer to the question (up to ANSWER_CACHE_SIZE kept), a PDF extract or its fallback
+CHAT_DEADLINE_SECONDS = float(os.getenv("CHAT_DEADLINE_SECONDS", "8"))
+ANSWER_CACHE_SIZE     = int(os.getenv("ANSWER_CACHE_SIZE", "1000"))
+
+# OpenAI token budgets (see budget.py; 0 = no limit): per /chat request, and per client
+# (X-Client-Key header, else address) per UTC day. Past BUDGET_CHEAP_AT of its daily budget a
+# client's requests run in the cheap mode, capped at BUDGET_CHEAP_REQUEST_TOKENS.
+BUDGET_REQUEST_TOKENS       = int(os.getenv("BUDGET_REQUEST_TOKENS", "0"))
+BUDGET_CLIENT_DAILY_TOKENS  = int(os.getenv("BUDGET_CLIENT_DAILY_TOKENS", "0"))
+BUDGET_CHEAP_AT             = float(os.getenv("BUDGET_CHEAP_AT", "0.8"))
+BUDGET_CHEAP_REQUEST_TOKENS = int(os.getenv("BUDGET_CHEAP_REQUEST_TOKENS", "20000"))
+BUDGET_PATH = os.getenv("BUDGET_PATH", str(DATA / "budget.sqlite"))   # "" = per worker, in memory
+# USD per million tokens, "model=PROMPT/COMPLETION,...", for the cost estimates
+OPENAI_PRICES = os.getenv("OPENAI_PRICES", "gpt-4o-mini=0.15/0.60,gpt-4o=2.50/10.00,"
+                          "text-embedding-3-large=0.13,text-embedding-3-small=0.02")
 
 EMBED_MODEL = os.getenv("EMBED_MODEL", "text-embedding-3-large")
+EMBED_DIMS  = int(os.getenv("EMBED_DIMS", "0"))   # 0 = model's full size (3072 for -3-large)
 CHAT_MODEL  = os.getenv("CHAT_MODEL", "gpt-4o-mini")
 
+# OpenAI client (see openai_replay): "live", "record" (live + save every response) or "replay" (offline)
+OPENAI_MODE            = os.getenv("OPENAI_MODE", "live").lower()
+OPENAI_RECORDINGS_PATH = os.getenv("OPENAI_RECORDINGS_PATH") or str(DATA / "openai_recordings.sqlite")
+OPENAI_REPLAY_MISS     = os.getenv("OPENAI_REPLAY_MISS", "error").lower()   # or "synthesize" for unrecorded requests
+# replay only: simulated latency ("fixed:MS", "uniform:LO,HI", "lognormal:MEDIAN,SIGMA") and share of 429s
+OPENAI_FAKE_CHAT_LATENCY  = os.getenv("OPENAI_FAKE_CHAT_LATENCY", "")
+OPENAI_FAKE_EMBED_LATENCY = os.getenv("OPENAI_FAKE_EMBED_LATENCY", "")
+OPENAI_FAKE_429_RATE      = float(os.getenv("OPENAI_FAKE_429_RATE", "0"))
+
+# Index build embedding stage: requests in flight, inputs per request, quota (0 = no limit)
+EMBED_CONCURRENCY = int(os.getenv("EMBED_CONCURRENCY", "4"))
+EMBED_BATCH       = int(os.getenv("EMBED_BATCH", "64"))
+EMBED_RPM         = int(os.getenv("EMBED_RPM", "0"))
+EMBED_TPM         = int(os.getenv("EMBED_TPM", "0"))
+EMBED_MAX_RETRIES = int(os.getenv("EMBED_MAX_RETRIES", "6"))
+
+# PDF text extraction: processes (0 = one per CPU, 1 = sequential) and pages per task
+PDF_WORKERS        = int(os.getenv("PDF_WORKERS", "0"))
+PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", "16"))
+
+# Full builds stream chunks to resumable shards of this many rows under BUILD_WORK_DIR
+BUILD_WORK_DIR   = os.getenv("BUILD_WORK_DIR") or str(DATA / "build_tmp")
+BUILD_SHARD_ROWS = int(os.getenv("BUILD_SHARD_ROWS", "4096"))
+
 CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", "500"))
 OVERLAP    = int(os.getenv("OVERLAP", "100"))
 
 TOP_K           = int(os.getenv("TOP_K", "10"))
 SCORE_THRESHOLD = float(os.getenv("SCORE_THRESHOLD", "0.1"))
 
+# FAISS index type: "flat" (exact), "hnsw" or "ivf" (approximate)
+INDEX_KIND           = os.getenv("INDEX_KIND", "flat").lower()
+HNSW_M               = int(os.getenv("HNSW_M", "32"))
+HNSW_EF_CONSTRUCTION = int(os.getenv("HNSW_EF_CONSTRUCTION", "200"))
+HNSW_EF_SEARCH       = int(os.getenv("HNSW_EF_SEARCH", "64"))
+IVF_NLIST            = int(os.getenv("IVF_NLIST", "0"))   # 0 = pick from corpus size
+IVF_NPROBE           = int(os.getenv("IVF_NPROBE", "8"))
+
+# Vector compression: "none", "sq8" (4x smaller), "pq" / "opq" (product quantization)
+INDEX_QUANT = os.getenv("INDEX_QUANT", "none").lower()
+PQ_M        = int(os.getenv("PQ_M", "64"))       # bytes per vector at 8 bits
+PQ_NBITS    = int(os.getenv("PQ_NBITS", "8"))
+RERANK_K    = int(os.getenv("RERANK_K", "0"))    # >0: rescore this many candidates with full vectors
+
+# Retrain IVF/PQ indexes once upserts + deletes since the last training exceed this share of the index
+INDEX_COMPACT_RATIO = float(os.getenv("INDEX_COMPACT_RATIO", "0.3"))
+
+# Train IVF/PQ on at most this many vectors; vectors are added in blocks of INDEX_ADD_BLOCK
+INDEX_TRAIN_MAX = int(os.getenv("INDEX_TRAIN_MAX", "65536"))
+INDEX_ADD_BLOCK = int(os.getenv("INDEX_ADD_BLOCK", "16384"))
+
+# Serve vectors and the chunk store from memory-mapped files shared by all workers
+INDEX_MMAP = int(os.getenv("INDEX_MMAP", "1"))
+
 BOT_NAME         = os.getenv("BOT_NAME", "Umufasha w'Itetero")
 GREETINGS_PERSIST = int(os.getenv("GREETINGS_PERSIST", "0"))
\ No newline at end of file
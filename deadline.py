@@ -0,0 +1,168 @@
+"""
+Deadline of the /chat request being answered (CHAT_DEADLINE_SECONDS), and
+what to answer once it has passed.
+
+    with deadline.request() as dl:     # main.py
+        text = get_response(question)
+    ...
+    except deadline.DeadlineExceeded:  # pipelines
+        return deadline.best_effort(question, chunks, FALLBACK, served.version)
+
+Every OpenAI call made for the request (openai_replay.CountingClient)
+gets the time left as its timeout. 429s and server errors are retried
+only while there is time left; the SDK's own retries would overrun the
+deadline. A call that would start with less than MIN_CALL_SECONDS left,
+or that times out, raises DeadlineExceeded. The pipeline then
+answers with the best it has:
+1. the last full answer to the same question from the index version
+   being served (ANSWERS, in memory);
+2. else an extract of the best chunk retrieved so far;
+3. else its FALLBACK.
+The same answer goes to a question that used up its own token budget
+(budget.BudgetExceeded "request"), with reason="budget".
+"""
+import contextvars
+import re
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, Optional, Sequence
+
+import metrics
+from config import ANSWER_CACHE_SIZE, CHAT_DEADLINE_SECONDS
+
+MIN_CALL_SECONDS = 0.25   # less than this left: an OpenAI call cannot come back in time
+SNIPPET_CHARS = 500
+
+
+class DeadlineExceeded(Exception):
+    """The request's deadline passed (or is too close for another OpenAI call)."""
+
+
+class Deadline:
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.expires = time.monotonic() + seconds
+        self.degraded: Optional[str] = None   # "cached", "snippet" or "fallback" once best_effort answered
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires - time.monotonic())
+
+    def timeout(self) -> float:
+        """Seconds left for the next OpenAI call; DeadlineExceeded when that is not enough."""
+        left = self.remaining()
+        if left < MIN_CALL_SECONDS:
+            raise DeadlineExceeded(f"{self.seconds:g} s deadline passed")
+        return left
+
+    def to_dict(self) -> Dict:
+        return {"seconds": self.seconds, "left_ms": round(self.remaining() * 1000.0, 1),
+                "degraded": self.degraded}
+
+
+_CURRENT: contextvars.ContextVar[Optional[Deadline]] = contextvars.ContextVar("deadline", default=None)
+
+
+@contextmanager
+def request(seconds: float = CHAT_DEADLINE_SECONDS):
+    """Deadline `seconds` from now for the block; with 0 there is none and it yields None."""
+    dl = Deadline(seconds) if seconds > 0 else None
+    token = _CURRENT.set(dl)
+    try:
+        yield dl
+    finally:
+        _CURRENT.reset(token)
+
+
+def current() -> Optional[Deadline]:
+    return _CURRENT.get()
+
+
+def remaining() -> Optional[float]:
+    """Seconds left for the request being answered; None without a deadline."""
+    dl = _CURRENT.get()
+    return dl.remaining() if dl is not None else None
+
+
+def timeout() -> Optional[float]:
+    """Timeout for the next OpenAI call; None without a deadline, DeadlineExceeded when too late."""
+    dl = _CURRENT.get()
+    return dl.timeout() if dl is not None else None
+
+
+# ---------------------------
+# BEST EFFORT
+# ---------------------------
+def _question_key(question: str, version: Optional[str]) -> tuple:
+    return version, " ".join(question.lower().split())
+
+
+class AnswerCache:
+    """
+    The last full answers by index version and question (case and spacing
+    ignored), least recently used dropped first. An answer built from one
+    index version is never served for another; entries of retired versions
+    age out. `version` is None for pipelines without an index (src.chat).
+    """
+
+    def __init__(self, size: int = ANSWER_CACHE_SIZE):
+        self.size = size
+        self._answers: "OrderedDict[tuple, str]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, question: str, version: Optional[str] = None) -> Optional[str]:
+        key = _question_key(question, version)
+        with self._lock:
+            answer = self._answers.get(key)
+            if answer is not None:
+                self._answers.move_to_end(key)
+        metrics.CACHE.inc(cache="answers", result="hit" if answer is not None else "miss")
+        return answer
+
+    def put(self, question: str, answer: str, version: Optional[str] = None) -> None:
+        if self.size <= 0:
+            return
+        key = _question_key(question, version)
+        with self._lock:
+            self._answers[key] = answer
+            self._answers.move_to_end(key)
+            while len(self._answers) > self.size:
+                self._answers.popitem(last=False)
+
+
+ANSWERS = AnswerCache()
+
+
+def snippet(chunk: Dict, limit: int = SNIPPET_CHARS) -> str:
+    """The start of a chunk, cut at a sentence end where possible, with its source and page."""
+    text = " ".join(str(chunk.get("text", "")).split())
+    if len(text) > limit:
+        head = text[:limit]
+        ends = [m.end() for m in re.finditer(r"[.!?](\s|$)", head)]
+        text = head[:ends[-1]].rstrip() if ends else head.rsplit(" ", 1)[0] + " …"
+    return f"{text}\n\n({chunk.get('source', '?')}, p.{chunk.get('page', '?')})"
+
+
+def best_effort(question: str, chunks: Sequence[Dict], fallback: str, version: Optional[str] = None,
+                reason: str = "deadline") -> str:
+    """
+    Answer once the deadline has passed (or, reason="budget", the request's
+    token cap was reached): the answer cached for the index `version`
+    being served, else an extract of chunks[0], else fallback. `reason` is
+    the route counted.
+    """
+    answer = ANSWERS.get(question, version)
+    if answer is not None:
+        kind = "cached"
+    elif chunks:
+        answer, kind = snippet(chunks[0]), "snippet"
+    else:
+        answer, kind = fallback, "fallback"
+    dl = _CURRENT.get()
+    if dl is not None:
+        dl.degraded = kind
+    if reason == "deadline":
+        metrics.DEADLINE_DEGRADED.inc(result=kind)
+    metrics.route(reason)
+    return answer
@@ -0,0 +1,83 @@
+"""
+On-disk embedding cache (data/embed_cache.sqlite) for index builds.
+
+Every vector the API returns is stored under (model, dims, sha256 of the
+exact text sent), so re-chunking, reordering PDFs or a --full rebuild only
+pays for text that was never embedded before. Vectors are stored as the
+raw float32 bytes the API sent (before normalization).
+"""
+import hashlib
+import sqlite3
+from typing import Dict, List
+
+import numpy as np
+
+import metrics
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS embeddings (
+    model  TEXT    NOT NULL,
+    dims   INTEGER NOT NULL,
+    hash   TEXT    NOT NULL,
+    vector BLOB    NOT NULL,
+    PRIMARY KEY (model, dims, hash)
+) WITHOUT ROWID
+"""
+
+# stay under SQLite's bound-parameter limit on older builds (999)
+_LOOKUP_BATCH = 500
+
+
+def text_key(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    def __init__(self, path: str, name: str = "embeddings"):
+        self.path = path
+        self.name = name   # `cache` label of chatbot_cache_lookups_total
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(_SCHEMA)
+        self.hits = 0
+        self.misses = 0
+        self.stored = 0
+
+    def get_many(self, model: str, dims: int, keys: List[str]) -> Dict[str, np.ndarray]:
+        found: Dict[str, np.ndarray] = {}
+        unique = list(dict.fromkeys(keys))
+        for i in range(0, len(unique), _LOOKUP_BATCH):
+            part = unique[i:i + _LOOKUP_BATCH]
+            marks = ",".join("?" * len(part))
+            cur = self.conn.execute(
+                f"SELECT hash, vector FROM embeddings WHERE model = ? AND dims = ? AND hash IN ({marks})",
+                [model, int(dims), *part],
+            )
+            for key, blob in cur:
+                found[key] = np.frombuffer(blob, dtype="<f4")
+        hits = sum(1 for k in keys if k in found)
+        self.hits += hits
+        self.misses += len(keys) - hits
+        metrics.CACHE.inc(hits, cache=self.name, result="hit")
+        metrics.CACHE.inc(len(keys) - hits, cache=self.name, result="miss")
+        return found
+
+    def put_many(self, model: str, dims: int, items: Dict[str, np.ndarray]) -> None:
+        self.stored += len(items)
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, dims, hash, vector) VALUES (?, ?, ?, ?)",
+                [(model, int(dims), k, np.asarray(v, dtype="<f4").tobytes()) for k, v in items.items()],
+            )
+
+    def count(self) -> int:
+        return self.conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def report(self) -> str:
+        total = self.hits + self.misses
+        rate = self.hits / total * 100 if total else 0.0
+        return (f"{self.hits} hits, {self.misses} misses ({rate:.0f}% hit rate), "
+                f"{self.stored} new texts embedded; {self.count()} vectors in {self.path}")
+
+    def close(self) -> None:
+        self.conn.close()
@@ -0,0 +1,190 @@
+import base64
+import random
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Dict, List, Optional, Sequence, Union
+
+import numpy as np
+import openai
+
+from config import EMBED_MODEL, EMBED_DIMS, EMBED_MAX_RETRIES
+import metrics
+
+NATIVE_DIMS = {
+    "text-embedding-3-large": 3072,
+    "text-embedding-3-small": 1536,
+    "text-embedding-ada-002": 1536,
+}
+
+
+# ---------------------------
+# REQUEST / DECODE
+# ---------------------------
+def request_kwargs(model: str = EMBED_MODEL, dims: int = EMBED_DIMS) -> Dict:
+    """
+    Arguments for client.embeddings.create. Asking for base64 explicitly makes
+    the SDK hand back the raw little-endian float32 bytes instead of turning
+    them into a Python list of floats.
+    """
+    kwargs = {"model": model, "encoding_format": "base64"}
+    if dims:
+        kwargs["dimensions"] = dims
+    return kwargs
+
+
+def decode_embedding(emb: Union[str, List[float]]) -> np.ndarray:
+    """Zero-copy float32 view of a base64 embedding (read-only)."""
+    if isinstance(emb, str):
+        return np.frombuffer(base64.b64decode(emb), dtype="<f4")
+    return np.asarray(emb, dtype="float32")  # servers that ignore encoding_format
+
+
+# ---------------------------
+# RATE LIMITS / RETRIES
+# ---------------------------
+class RateLimiter:
+    """
+    Client-side RPM / TPM budget over a sliding one-minute window, shared by
+    every thread sending embedding requests. 0 disables a limit.
+    """
+
+    WINDOW = 60.0
+
+    def __init__(self, rpm: int = 0, tpm: int = 0):
+        self.rpm = rpm
+        self.tpm = tpm
+        self._sent = deque()   # (monotonic time, tokens)
+        self._tokens = 0
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens: int) -> None:
+        if not self.rpm and not self.tpm:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                while self._sent and now - self._sent[0][0] >= self.WINDOW:
+                    self._tokens -= self._sent.popleft()[1]
+                rpm_ok = not self.rpm or len(self._sent) < self.rpm
+                # a single request bigger than the TPM budget still goes out, alone
+                tpm_ok = not self.tpm or self._tokens + tokens <= self.tpm or not self._sent
+                if rpm_ok and tpm_ok:
+                    self._sent.append((now, tokens))
+                    self._tokens += tokens
+                    return
+                wait = self._sent[0][0] + self.WINDOW - now
+            time.sleep(min(max(wait, 0.05), 1.0))
+
+
+_RETRYABLE = (openai.RateLimitError, openai.APIConnectionError, openai.APITimeoutError,
+              openai.InternalServerError)
+
+
+def retry_after(err: Exception) -> float:
+    """Seconds the API asked us to wait (Retry-After header or message), or 0."""
+    response = getattr(err, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    for name in ("retry-after-ms", "retry-after"):
+        value = headers.get(name)
+        if value:
+            try:
+                return float(value) / (1000.0 if name.endswith("-ms") else 1.0)
+            except ValueError:
+                pass
+    m = re.search(r"try again in (\d+(?:\.\d+)?)(ms|s)", str(err), re.IGNORECASE)
+    if m:
+        return float(m.group(1)) / (1000.0 if m.group(2).lower() == "ms" else 1.0)
+    return 0.0
+
+
+def estimate_tokens(texts: Sequence[str]) -> int:
+    """Rough token count for TPM budgeting (~4 characters per token)."""
+    return sum(len(t) // 4 + 1 for t in texts)
+
+
+def create_embeddings(client, texts: List[str], model: str = EMBED_MODEL, dims: int = EMBED_DIMS,
+                      limiter: Optional[RateLimiter] = None, max_retries: int = EMBED_MAX_RETRIES,
+                      tokens: Optional[int] = None):
+    """
+    client.embeddings.create with rate limiting and retries on 429 / 5xx /
+    connection errors (exponential backoff with jitter, or the server's
+    Retry-After). Out-of-quota 429s are not retried. `tokens` is the
+    request's token count when the caller knows it (else estimated).
+    """
+    wait = 1.0
+    for attempt in range(max_retries + 1):
+        if limiter is not None:
+            limiter.acquire(tokens or estimate_tokens(texts))
+        try:
+            return client.embeddings.create(input=texts, **request_kwargs(model, dims))
+        except _RETRYABLE as e:
+            if attempt == max_retries or getattr(e, "code", None) == "insufficient_quota":
+                raise
+            metrics.OPENAI_RETRIES.inc(endpoint="embeddings")
+            time.sleep(retry_after(e) or wait * (1 + 0.25 * random.random()))
+            wait = min(wait * 2, 60.0)
+
+
+def embed_into(client, texts: List[str], out: np.ndarray, model: str = EMBED_MODEL, dims: int = EMBED_DIMS,
+               limiter: Optional[RateLimiter] = None, tokens: Optional[int] = None):
+    """
+    Embed `texts` and write row i of the result into out[i], where `out` is a
+    slice of a preallocated (or memory-mapped) float32 matrix.
+    Returns the API response so callers can read `usage`.
+    """
+    response = create_embeddings(client, texts, model, dims, limiter, tokens=tokens)
+    if len(response.data) != len(texts):
+        raise RuntimeError(f"Asked for {len(texts)} embeddings, got {len(response.data)}")
+    for i, e in enumerate(response.data):
+        out[getattr(e, "index", i)] = decode_embedding(e.embedding)
+    return response
+
+
+def output_dims(client, model: str = EMBED_MODEL, dims: int = EMBED_DIMS) -> int:
+    """Vector size the API will return, so the matrix can be allocated up front."""
+    if dims:
+        return dims
+    if model in NATIVE_DIMS:
+        return NATIVE_DIMS[model]
+    return len(embed_one(client, "dim probe", model, dims))
+
+
+def embed_one(client, text: str, model: str = EMBED_MODEL, dims: int = EMBED_DIMS) -> np.ndarray:
+    """Single query embedding as a writable float32 vector."""
+    response = client.embeddings.create(input=[text], **request_kwargs(model, dims))
+    return decode_embedding(response.data[0].embedding).copy()
+
+
+# ---------------------------
+# CONCURRENT BATCHES
+# ---------------------------
+def embed_batches(client, batches: List[List[str]], dim: int,
+                  on_batch: Callable[[int, np.ndarray], None],
+                  model: str = EMBED_MODEL, dims: int = EMBED_DIMS,
+                  concurrency: int = 4, limiter: Optional[RateLimiter] = None,
+                  batch_tokens: Optional[List[int]] = None) -> None:
+    """
+    Embed several batches with up to `concurrency` requests in flight.
+    on_batch(i, vectors) runs in the calling thread as each batch finishes
+    (in completion order), so it can write results and checkpoint them.
+    If a batch still fails after retries, pending batches are cancelled and
+    the error is raised; batches already handed to on_batch are kept.
+    `batch_tokens[i]` is the token count of batch i, if known (0 = estimate).
+    """
+    def work(i, texts):
+        out = np.empty((len(texts), dim), dtype="float32")
+        embed_into(client, texts, out, model, dims, limiter, batch_tokens[i] if batch_tokens else None)
+        return out
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+        futures = {pool.submit(work, i, texts): i for i, texts in enumerate(batches)}
+        try:
+            for future in as_completed(futures):
+                on_batch(futures[future], future.result())
+        except BaseException:
+            for f in futures:
+                f.cancel()
+            raise
@@ -0,0 +1,140 @@
+"""
+Hot reload of published index versions (see index_version) in a running
+server, without a restart:
+
+    holder = IndexHolder(loader)
+    served = holder.get()      # once per request; use `served` until the response is sent
+    holder.reload_async()      # admin endpoint / watcher: load in the background, then swap
+
+A reload loads the new version completely (FAISS index, chunk rows,
+embedding settings) in a background thread while requests keep using the
+old one, then swaps it in with a single reference assignment, so a
+request sees one version or the other, never a mix. Requests that started
+before the swap hold the old ServedIndex and finish on it; its memory
+(FAISS index, mmaps) is freed by reference counting once the last of them
+is done. status() reports how many retired versions are still in use.
+
+Each server process has its own holder; watch() polls INDEX_DIR/current
+so every worker picks up a new version, not only the one that served the
+admin request.
+"""
+import threading
+import time
+import weakref
+from typing import Callable, Dict, Optional, Sequence
+
+from config import INDEX_DIR
+from index_version import LEGACY_VERSION, IndexVersion, current_version, resolve_index
+
+
+class ServedIndex:
+    """Everything a request needs from one index version."""
+
+    def __init__(self, version: str, index, rows: Sequence[Dict], embed_model: str, embed_dims: int):
+        self.version = version
+        self.index = index
+        self.rows = rows
+        self.embed_model = embed_model
+        self.embed_dims = embed_dims
+        self.loaded_at = time.time()
+
+
+class IndexHolder:
+    def __init__(self, loader: Callable[[IndexVersion], ServedIndex], index_dir: str = INDEX_DIR):
+        self._loader = loader
+        self.index_dir = index_dir
+        self._current: Optional[ServedIndex] = None
+        self._load_lock = threading.Lock()      # one load at a time
+        self._retired = weakref.WeakSet()       # swapped-out versions still referenced by requests
+        self._thread: Optional[threading.Thread] = None
+        self._watcher: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self.reloads = 0
+        self.last_error: Optional[str] = None
+
+    @property
+    def version(self) -> Optional[str]:
+        """The live version's name; None until one is loaded."""
+        served = self._current
+        return served.version if served else None
+
+    def get(self) -> ServedIndex:
+        """The live version (loaded on first use)."""
+        served = self._current
+        if served is None:
+            with self._load_lock:
+                if self._current is None:
+                    self._swap(self._loader(resolve_index(self.index_dir)))
+                served = self._current
+        return served
+
+    def reload(self, force: bool = False) -> bool:
+        """Load the published version if it is not the live one. Returns whether it swapped."""
+        with self._load_lock:
+            version = current_version(self.index_dir) or LEGACY_VERSION
+            if not force and self._current is not None and self._current.version == version:
+                return False
+            try:
+                served = self._loader(resolve_index(self.index_dir))
+            except (Exception, SystemExit) as e:   # loaders exit when there is no index at all
+                self.last_error = f"{version}: {e}"
+                raise
+            self._swap(served)
+            self.last_error = None
+            return True
+
+    def reload_async(self, force: bool = False) -> bool:
+        """reload() in a background thread. False if a reload is already running."""
+        if self._thread is not None and self._thread.is_alive():
+            return False
+        self._thread = threading.Thread(target=self._reload_quietly, args=(force,),
+                                        name="index-reload", daemon=True)
+        self._thread.start()
+        return True
+
+    def watch(self, interval: float) -> None:
+        """Poll INDEX_DIR/current every `interval` seconds and reload when it changes."""
+        if self._watcher is not None and self._watcher.is_alive():
+            return
+        self._stop.clear()
+        self._watcher = threading.Thread(target=self._watch, args=(interval,), name="index-watch", daemon=True)
+        self._watcher.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def status(self) -> Dict:
+        served = self._current
+        return {
+            "version": served.version if served else None,
+            "published": current_version(self.index_dir) or LEGACY_VERSION,
+            "chunks": len(served.rows) if served else 0,
+            "vectors": served.index.ntotal if served else 0,
+            "loaded_at": served.loaded_at if served else None,
+            "reloads": self.reloads,
+            "reloading": self._thread is not None and self._thread.is_alive(),
+            "watching": self._watcher is not None and self._watcher.is_alive(),
+            "retired_in_use": len(self._retired),
+            "last_error": self.last_error,
+        }
+
+    def _swap(self, served: ServedIndex) -> None:
+        old, self._current = self._current, served
+        if old is not None:
+            self._retired.add(old)
+            self.reloads += 1
+
+    def _reload_quietly(self, force: bool = False) -> None:
+        try:
+            if self.reload(force):
+                print(f"♻ Index version {self._current.version} loaded")
+        except (Exception, SystemExit) as e:
+            print(f"⚠ Index reload failed, still serving {self.status()['version']}: {e}")
+
+    def _watch(self, interval: float) -> None:
+        while not self._stop.wait(interval):
+            served = self._current
+            published = current_version(self.index_dir) or LEGACY_VERSION
+            failed = (self.last_error or "").startswith(published + ":")   # don't retry a damaged version
+            if served is not None and published != served.version and not failed:
+                self._reload_quietly()
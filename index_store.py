@@ -0,0 +1,411 @@
+import json
+import math
+import os
+import time
+from typing import Dict, Optional, Tuple
+
+import faiss
+import numpy as np
+
+from chunk_store import open_chunks
+from config import (
+    INDEX_KIND, HNSW_M, HNSW_EF_CONSTRUCTION, HNSW_EF_SEARCH,
+    IVF_NLIST, IVF_NPROBE,
+    INDEX_QUANT, PQ_M, PQ_NBITS, RERANK_K, VECTORS_PATH, CHUNKS_PATH,
+    EMBED_MODEL, EMBED_DIMS, INDEX_MMAP, INDEX_TRAIN_MAX, INDEX_ADD_BLOCK,
+)
+
+INDEX_KINDS = ("flat", "hnsw", "ivf")
+QUANTS = ("none", "sq8", "pq", "opq")
+
+
+# ---------------------------
+# INDEX PARAMETERS
+# ---------------------------
+def default_params(kind: str = INDEX_KIND, n: int = 0, dim: int = 0, quant: str = INDEX_QUANT) -> Dict:
+    """
+    Build-time parameters for an index kind + compression, taken from config.
+    `n` is the corpus size (picks nlist / PQ bits), `dim` the vector size.
+    """
+    if kind not in INDEX_KINDS:
+        raise ValueError(f"Unknown INDEX_KIND '{kind}' (expected one of {', '.join(INDEX_KINDS)})")
+    if quant not in QUANTS:
+        raise ValueError(f"Unknown INDEX_QUANT '{quant}' (expected one of {', '.join(QUANTS)})")
+    if kind == "hnsw" and quant in ("pq", "opq"):
+        raise ValueError("HNSW supports INDEX_QUANT=none or sq8 only; use flat or ivf for pq/opq")
+
+    params: Dict = {"quant": quant}
+    if kind == "hnsw":
+        params.update({
+            "M": HNSW_M,
+            "efConstruction": HNSW_EF_CONSTRUCTION,
+            "efSearch": HNSW_EF_SEARCH,
+        })
+    elif kind == "ivf":
+        params.update({
+            "nlist": IVF_NLIST or auto_nlist(n),
+            "nprobe": IVF_NPROBE,
+        })
+    if quant in ("pq", "opq"):
+        params.update({
+            "pq_m": pq_subquantizers(dim, PQ_M) if dim else PQ_M,
+            "pq_nbits": auto_pq_nbits(n, PQ_NBITS),
+        })
+    if quant != "none":
+        params["rerank_k"] = RERANK_K
+    return params
+
+
+def auto_nlist(n: int) -> int:
+    """
+    ~4*sqrt(n) lists, capped so every centroid gets at least 39 training
+    points (FAISS warns and clusters badly below that).
+    """
+    if n <= 0:
+        return 1
+    return max(1, min(int(4 * math.sqrt(n)), n // 39))
+
+
+def auto_pq_nbits(n: int, nbits: int = PQ_NBITS) -> int:
+    """PQ codebooks have 2**nbits centroids; shrink them until the corpus can train them."""
+    if n <= 0:
+        return nbits
+    while nbits > 4 and n < 39 * (1 << nbits):
+        nbits -= 1
+    return nbits
+
+
+def pq_subquantizers(dim: int, m: int) -> int:
+    """Largest sub-quantizer count <= m that divides dim."""
+    m = max(1, min(m, dim))
+    while dim % m:
+        m -= 1
+    return m
+
+
+def factory_string(kind: str, params: Dict) -> str:
+    quant = params.get("quant", "none")
+    if quant in ("pq", "opq"):
+        codec = f"PQ{params['pq_m']}x{params['pq_nbits']}"
+    elif quant == "sq8":
+        codec = "SQ8"
+    else:
+        codec = "Flat"
+
+    if kind == "hnsw":
+        desc = f"HNSW{params['M']}" + ("_SQ8" if quant == "sq8" else "")
+    elif kind == "ivf":
+        desc = f"IVF{params['nlist']},{codec}"
+    else:
+        desc = codec
+
+    if quant == "opq":
+        desc = f"OPQ{params['pq_m']}," + desc
+    return desc
+
+
+# ---------------------------
+# BUILD / TUNE
+# ---------------------------
+def build_ann_index(X: np.ndarray, kind: str = INDEX_KIND, params: Optional[Dict] = None,
+                    ids: Optional[np.ndarray] = None):
+    """
+    Build an inner-product index over L2-normalized vectors X (float32, n x d).
+    Returns (index, params) where params are the values actually used.
+
+    With `ids` (int64, one per row) the index returns those ids instead of
+    row numbers and supports remove_ids / add_with_ids, which is what
+    incremental builds use. IVF stores ids natively; other kinds are
+    wrapped in an IndexIDMap2.
+
+    X may be a memory-mapped .npy: training reads a sample of at most
+    INDEX_TRAIN_MAX rows and vectors are added INDEX_ADD_BLOCK rows at a
+    time, so only the index itself has to fit in memory.
+    """
+    n, dim = X.shape
+    params = dict(params) if params else default_params(kind, n, dim)
+    params.setdefault("quant", "none")
+    if kind == "ivf":
+        params["nlist"] = max(1, min(int(params["nlist"]), n))
+
+    index = faiss.index_factory(dim, factory_string(kind, params), faiss.METRIC_INNER_PRODUCT)
+    if kind == "hnsw":
+        faiss.downcast_index(index).hnsw.efConstruction = int(params["efConstruction"])
+    if not index.is_trained:
+        sample = np.arange(n)
+        if INDEX_TRAIN_MAX and n > INDEX_TRAIN_MAX:
+            sample = np.sort(np.random.default_rng(0).choice(n, INDEX_TRAIN_MAX, replace=False))
+        index.train(np.ascontiguousarray(X[sample], dtype="float32"))
+
+    if ids is not None:
+        ids = np.ascontiguousarray(ids, dtype="int64")
+        if kind != "ivf":
+            index = faiss.IndexIDMap2(index)
+    block = INDEX_ADD_BLOCK or n or 1
+    for start in range(0, n, block):
+        part = np.ascontiguousarray(X[start:start + block], dtype="float32")
+        if ids is None:
+            index.add(part)
+        else:
+            index.add_with_ids(part, ids[start:start + block])
+    apply_search_params(index, kind, params)
+    return index, params
+
+
+def supports_remove(kind: str) -> bool:
+    """HNSW graphs cannot drop vectors; those indexes are rebuilt from vectors.npy instead."""
+    return kind != "hnsw"
+
+
+def base_index(index):
+    """The concrete index under an IndexIDMap/IndexIDMap2 wrapper, if any."""
+    index = faiss.downcast_index(index)
+    if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+        index = faiss.downcast_index(index.index)
+    return index
+
+
+def apply_search_params(index, kind: str, params: Dict) -> None:
+    """Set query-time knobs (efSearch / nprobe) on a built or loaded index."""
+    if kind == "hnsw" and "efSearch" in params:
+        base_index(index).hnsw.efSearch = int(params["efSearch"])
+    elif kind == "ivf" and "nprobe" in params:
+        faiss.extract_index_ivf(index).nprobe = int(params["nprobe"])
+
+
+def index_nbytes(index) -> int:
+    """Size of the serialized index, i.e. what each worker holds after read_index."""
+    return int(faiss.serialize_index(index).nbytes)
+
+
+# ---------------------------
+# CHUNK IDS -> ROWS
+# ---------------------------
+class RowIndex:
+    """
+    Wraps an ID-mapped index so search returns row numbers into
+    chunks.bin / vectors.npy again. `ids` is the chunk store's ascending
+    chunk_id column; ids missing from it come back as -1.
+    """
+
+    def __init__(self, index, ids: np.ndarray):
+        self.index = index
+        self.ids = ids
+
+    @property
+    def ntotal(self) -> int:
+        return self.index.ntotal
+
+    @property
+    def d(self) -> int:
+        return self.index.d
+
+    def search(self, Q: np.ndarray, k: int):
+        D, I = self.index.search(Q, k)
+        if not len(self.ids):
+            return D, np.full_like(I, -1)
+        rows = np.searchsorted(self.ids, I).clip(0, len(self.ids) - 1)
+        return D, np.where((I >= 0) & (self.ids[rows] == I), rows, -1)
+
+
+# ---------------------------
+# EXACT RE-RANKING
+# ---------------------------
+class RerankIndex:
+    """
+    Wraps a compressed index: fetches `rerank_k` candidates from it and
+    re-scores them with the full float32 vectors (row i = FAISS id i).
+    The vectors are expected to be a read-only np.memmap, so they live
+    in the shared page cache rather than in each worker's heap.
+    """
+
+    def __init__(self, index, vectors: np.ndarray, rerank_k: int):
+        self.index = index
+        self.vectors = vectors
+        self.rerank_k = rerank_k
+
+    @property
+    def ntotal(self) -> int:
+        return self.index.ntotal
+
+    @property
+    def d(self) -> int:
+        return self.index.d
+
+    def search(self, Q: np.ndarray, k: int):
+        _, I = self.index.search(Q, max(k, self.rerank_k))
+        D_out = np.full((len(Q), k), -np.finfo("float32").max, dtype="float32")
+        I_out = np.full((len(Q), k), -1, dtype="int64")
+        for qi, cand in enumerate(I):
+            cand = cand[cand >= 0]
+            if not len(cand):
+                continue
+            exact = self.vectors[cand] @ Q[qi]
+            order = np.argsort(-exact)[:k]
+            D_out[qi, : len(order)] = exact[order]
+            I_out[qi, : len(order)] = cand[order]
+        return D_out, I_out
+
+
+class MmapFlatIndex:
+    """
+    Exact inner-product search straight over a read-only memory-mapped
+    vectors.npy. Same results as IndexFlatIP, but the matrix lives in the
+    shared page cache instead of each worker's heap.
+    """
+
+    def __init__(self, vectors: np.ndarray):
+        self.vectors = vectors
+
+    @property
+    def ntotal(self) -> int:
+        return self.vectors.shape[0]
+
+    @property
+    def d(self) -> int:
+        return self.vectors.shape[1]
+
+    def search(self, Q: np.ndarray, k: int):
+        n = self.ntotal
+        D_out = np.full((len(Q), k), -np.finfo("float32").max, dtype="float32")
+        I_out = np.full((len(Q), k), -1, dtype="int64")
+        if not n:
+            return D_out, I_out
+        kk = min(k, n)
+        scores = Q @ self.vectors.T
+        top = np.argpartition(-scores, kk - 1, axis=1)[:, :kk]
+        for qi in range(len(Q)):
+            order = top[qi][np.argsort(-scores[qi, top[qi]])]
+            D_out[qi, :kk] = scores[qi, order]
+            I_out[qi, :kk] = order
+        return D_out, I_out
+
+
+# ---------------------------
+# MANIFEST
+# ---------------------------
+def make_manifest(kind: str, params: Dict, dim: int, count: int, embed_model: str,
+                  vectors_path: Optional[str] = None, embed_dims: int = 0,
+                  chunks_path: Optional[str] = None) -> Dict:
+    return {
+        "index_kind": kind,
+        "params": params,
+        "dim": dim,
+        "count": count,
+        "metric": "inner_product",
+        "embed_model": embed_model,
+        "embed_dims": embed_dims,
+        "vectors": os.path.basename(vectors_path) if vectors_path else None,
+        "chunks": os.path.basename(chunks_path) if chunks_path else None,
+        "built_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+    }
+
+
+def write_manifest(path: str, manifest: Dict) -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+
+def read_manifest(path: str) -> Dict:
+    """
+    Returns the manifest written next to the index, or a flat-index
+    manifest for indexes built before manifests existed.
+    """
+    if not os.path.exists(path):
+        return {"index_kind": "flat", "params": {}}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+# ---------------------------
+# LOAD
+# ---------------------------
+def embedding_settings(manifest: Dict) -> Tuple[str, int]:
+    """
+    (model, dimensions) that query embeddings must use to match the index.
+    The manifest wins over config: the vectors on disk were made with it.
+    """
+    model = manifest.get("embed_model") or EMBED_MODEL
+    dims = int(manifest.get("embed_dims") or 0)
+    if model != EMBED_MODEL or dims != EMBED_DIMS:
+        print(f"⚠ Index was built with {model} ({dims or 'full'} dims) but config says "
+              f"{EMBED_MODEL} ({EMBED_DIMS or 'full'} dims); using the index settings. "
+              f"Rebuild the index to switch.")
+    return model, dims
+
+
+def _sibling_file(faiss_path: str, manifest: Dict, key: str, fallback: str) -> Optional[str]:
+    """
+    The file the manifest names under `key`, next to the index. Only the
+    legacy flat layout may fall back to the configured path; a published
+    version missing one of its files is damaged (ValueError), since the
+    file of another build would not match its index.
+    """
+    name = manifest.get(key)
+    if not name:
+        return None
+    path = os.path.join(os.path.dirname(os.path.abspath(faiss_path)), name)
+    if os.path.exists(path):
+        return path
+    if manifest.get("version"):
+        raise ValueError(f"index version {manifest['version']} is damaged: {name} missing")
+    return fallback if os.path.exists(fallback) else None
+
+
+def vectors_file(faiss_path: str, manifest: Dict) -> Optional[str]:
+    """Full float32 vectors saved by build_index.py next to the index, if any."""
+    return _sibling_file(faiss_path, manifest, "vectors", VECTORS_PATH)
+
+
+def chunk_ids(faiss_path: str, manifest: Dict) -> Optional[np.ndarray]:
+    """
+    Chunk ids of the rows in chunks.bin, when the index was built with ids
+    that are not simply 0..n-1 (after incremental builds). None otherwise.
+    """
+    path = _sibling_file(faiss_path, manifest, "chunks", CHUNKS_PATH)
+    if not path:
+        return None
+    ids = open_chunks(path, use_mmap=True).chunk_id
+    if len(ids) and ids[0] == 0 and ids[-1] == len(ids) - 1:
+        return None  # ascending and unique, so this is the identity
+    return ids
+
+
+def load_index(faiss_path: str, manifest_path: str, mmap: bool = bool(INDEX_MMAP)):
+    """
+    Read the FAISS index and apply the search parameters from its manifest.
+
+    With `mmap`, the vectors stay in the page cache and are shared by every
+    worker on the box instead of being copied into each process:
+    exact flat indexes are served from the memory-mapped vectors.npy,
+    IVF inverted lists are mapped by FAISS (IO_FLAG_MMAP). HNSW graphs
+    are still read into memory on this FAISS version.
+
+    Compressed indexes with `rerank_k` > 0 come back wrapped in a
+    RerankIndex over the memory-mapped full vectors. Either way search
+    returns row numbers into chunks.bin / vectors.npy (RowIndex maps the
+    chunk ids of incrementally built indexes back to rows).
+    """
+    manifest = read_manifest(manifest_path)
+    kind = manifest.get("index_kind", "flat")
+    params = manifest.get("params") or {}
+    vectors_path = vectors_file(faiss_path, manifest)
+
+    if mmap and kind == "flat" and params.get("quant", "none") == "none" and vectors_path:
+        return MmapFlatIndex(np.load(vectors_path, mmap_mode="r"))
+
+    flags = 0
+    if mmap:
+        flags = faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY | getattr(faiss, "IO_FLAG_MMAP_IFC", 0)
+    index = faiss.read_index(faiss_path, flags)
+    apply_search_params(index, kind, params)
+    ids = chunk_ids(faiss_path, manifest)
+    if ids is not None:
+        index = RowIndex(index, ids)
+
+    rerank_k = int(params.get("rerank_k") or 0)
+    if rerank_k > 0 and manifest.get("vectors"):
+        if vectors_path:
+            return RerankIndex(index, np.load(vectors_path, mmap_mode="r"), rerank_k)
+        print(f"⚠ vectors for {faiss_path} not found, serving compressed scores without re-ranking")
+    return index
@@ -0,0 +1,222 @@
+"""
+Versioned, atomically published indexes (INDEX_DIR, default data/index):
+
+    data/index/
+      current -> versions/20261019T101500123456-3f9a1c      (symlink)
+      versions/20261019T101500123456-3f9a1c/
+        index.faiss  chunks.bin  vectors.npy  manifest.json
+
+A build writes every file into a fresh staging directory, then publish()
+records the version, sizes and sha256 checksums in its manifest.json,
+renames the directory into versions/ and points `current` at it by
+renaming a new symlink over the old one. That switch is atomic: a reader
+sees the old version or the new one, never a mix of the two.
+
+Readers call resolve_index() once and open every file from the directory
+it returns, so a build that publishes mid-load cannot hand them an index
+from one version and chunks from another. The last INDEX_KEEP_VERSIONS
+versions are kept for workers still serving them (and for rollback).
+
+Trees without data/index/current fall back to the flat FAISS_PATH /
+CHUNKS_PATH / VECTORS_PATH / MANIFEST_PATH layout of older builds.
+"""
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional
+
+from config import (
+    INDEX_DIR, INDEX_KEEP_VERSIONS, INDEX_VERIFY,
+    FAISS_PATH, CHUNKS_PATH, VECTORS_PATH, MANIFEST_PATH,
+)
+
+FILES = {"faiss": "index.faiss", "chunks": "chunks.bin", "vectors": "vectors.npy", "manifest": "manifest.json"}
+LEGACY_VERSION = "legacy"
+
+
+class IndexVersion:
+    """Paths of one published index version (or of the legacy flat layout)."""
+
+    def __init__(self, version: str, faiss_path: str, chunks_path: str, vectors_path: str, manifest_path: str):
+        self.version = version
+        self.faiss_path = faiss_path
+        self.chunks_path = chunks_path
+        self.vectors_path = vectors_path
+        self.manifest_path = manifest_path
+
+    @classmethod
+    def in_dir(cls, directory: str, version: str) -> "IndexVersion":
+        return cls(version, *(os.path.join(directory, FILES[k]) for k in ("faiss", "chunks", "vectors", "manifest")))
+
+    @property
+    def directory(self) -> str:
+        return os.path.dirname(self.faiss_path)
+
+    def __repr__(self) -> str:
+        return f"IndexVersion({self.version!r}, {self.directory!r})"
+
+
+def _versions_dir(index_dir: str) -> str:
+    return os.path.join(index_dir, "versions")
+
+
+def _current_link(index_dir: str) -> str:
+    return os.path.join(index_dir, "current")
+
+
+def new_version_id() -> str:
+    """Unique version name that sorts by creation time: UTC time to the microsecond + random suffix."""
+    now = time.time()
+    return time.strftime("%Y%m%dT%H%M%S", time.gmtime(now)) + f"{int(now % 1 * 1e6):06d}-" + uuid.uuid4().hex[:6]
+
+
+def current_version(index_dir: str = INDEX_DIR) -> Optional[str]:
+    """Name of the published version (cheap: one readlink), or None."""
+    try:
+        return os.path.basename(os.readlink(_current_link(index_dir)))
+    except OSError:
+        return None
+
+
+def resolve_index(index_dir: str = INDEX_DIR, verify: bool = bool(INDEX_VERIFY)) -> IndexVersion:
+    """
+    The published version, resolved once to its own directory. With
+    `verify`, every file is checked against the manifest's sha256
+    (sizes are always checked). Raises ValueError on a mismatch.
+    """
+    version = current_version(index_dir)
+    if version is None:
+        return IndexVersion(LEGACY_VERSION, FAISS_PATH, CHUNKS_PATH, VECTORS_PATH, MANIFEST_PATH)
+    found = IndexVersion.in_dir(os.path.join(_versions_dir(index_dir), version), version)
+    problems = check_files(found, checksums=verify)
+    if problems:
+        raise ValueError(f"index version {version} is damaged: " + "; ".join(problems))
+    return found
+
+
+def stage_version(index_dir: str = INDEX_DIR) -> IndexVersion:
+    """Empty directory for a new version; it is invisible to readers until publish()."""
+    version = new_version_id()
+    directory = os.path.join(_versions_dir(index_dir), f".staging-{version}")
+    os.makedirs(directory)
+    return IndexVersion.in_dir(directory, version)
+
+
+def file_checksums(directory: str) -> Dict[str, Dict]:
+    out = {}
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        if name == FILES["manifest"] or not os.path.isfile(path):
+            continue
+        h = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                h.update(block)
+        out[name] = {"bytes": os.path.getsize(path), "sha256": h.hexdigest()}
+    return out
+
+
+def check_files(found: IndexVersion, checksums: bool = False) -> List[str]:
+    """Differences between a version's files and its manifest (empty if it is intact)."""
+    try:
+        with open(found.manifest_path, "r", encoding="utf-8") as f:
+            expected = json.load(f).get("files") or {}
+    except (OSError, ValueError) as e:
+        return [f"manifest unreadable ({e})"]
+    actual = file_checksums(found.directory) if checksums else {}
+    problems = []
+    for name, want in expected.items():
+        path = os.path.join(found.directory, name)
+        if not os.path.exists(path):
+            problems.append(f"{name} missing")
+        elif os.path.getsize(path) != want["bytes"]:
+            problems.append(f"{name} has {os.path.getsize(path)} bytes, manifest says {want['bytes']}")
+        elif checksums and actual[name]["sha256"] != want["sha256"]:
+            problems.append(f"{name} checksum mismatch")
+    return problems
+
+
+def _fsync(path: str) -> None:
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def publish(staged: IndexVersion, index_dir: str = INDEX_DIR, keep: int = INDEX_KEEP_VERSIONS) -> IndexVersion:
+    """
+    Seal a staged version (version + checksums into its manifest, files
+    synced to disk) and switch `current` to it atomically. Returns the
+    published IndexVersion.
+    """
+    with open(staged.manifest_path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    manifest["version"] = staged.version
+    manifest["files"] = file_checksums(staged.directory)
+    with open(staged.manifest_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    for name in os.listdir(staged.directory):
+        _fsync(os.path.join(staged.directory, name))
+
+    final = os.path.join(_versions_dir(index_dir), staged.version)
+    os.rename(staged.directory, final)
+    _fsync(_versions_dir(index_dir))
+
+    link = _current_link(index_dir)
+    tmp = f"{link}.{staged.version}.tmp"
+    os.symlink(os.path.join("versions", staged.version), tmp)
+    os.replace(tmp, link)
+    _fsync(index_dir)
+
+    prune(index_dir, keep)
+    return IndexVersion.in_dir(final, staged.version)
+
+
+@contextmanager
+def writer_lock(index_dir: str = INDEX_DIR) -> Iterator[None]:
+    """
+    Serialize writers (build_index.py runs, upserts, API ingestion jobs)
+    across processes, so two of them never start from the same version
+    and publish over each other. Readers never take it.
+    """
+    os.makedirs(index_dir, exist_ok=True)
+    with open(os.path.join(index_dir, ".lock"), "w") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def discard(staged: IndexVersion) -> None:
+    """Drop a staged version that failed before publish()."""
+    shutil.rmtree(staged.directory, ignore_errors=True)
+
+
+def list_versions(index_dir: str = INDEX_DIR) -> List[str]:
+    """Published versions, oldest first."""
+    root = _versions_dir(index_dir)
+    if not os.path.isdir(root):
+        return []
+    return sorted(v for v in os.listdir(root) if not v.startswith("."))
+
+
+def prune(index_dir: str = INDEX_DIR, keep: int = INDEX_KEEP_VERSIONS) -> None:
+    """Delete all but the newest `keep` versions (never the current one) and stale staging dirs."""
+    root = _versions_dir(index_dir)
+    current = current_version(index_dir)
+    versions = list_versions(index_dir)
+    for v in versions[:max(0, len(versions) - max(1, keep))]:
+        if v != current:
+            shutil.rmtree(os.path.join(root, v), ignore_errors=True)
+    for name in os.listdir(root):
+        path = os.path.join(root, name)
+        # staging dirs of builds that died more than a day ago
+        if name.startswith(".staging-") and time.time() - os.path.getmtime(path) > 86400:
+            shutil.rmtree(path, ignore_errors=True)
@@ -0,0 +1,298 @@
+"""
+Background ingestion of uploaded PDFs (POST /admin/documents in main.py).
+
+    queue = IngestQueue(on_published=INDEX.reload_async)
+    job = queue.submit(tmp_path, "guide.pdf")   # validated, moved into DOCS_DIR
+    queue.get(job.id).to_dict()                 # state, stage, done/total
+
+An upload is saved to DOCS_DIR, which is part of the corpus
+(config.corpus_pdfs), and a job is queued. One worker thread per server
+process runs its jobs in order, each in a child process (python
+ingest.py JOB_ID), so the API worker neither forks the PDF extraction
+pool from a multithreaded process nor holds a second copy of the index
+while it keeps serving. The child runs an incremental
+build_index.build(): unchanged PDFs are not even opened, the new one is
+extracted, chunked and embedded, its chunks are added to the index and a
+new index version is published, which every worker then swaps in
+between requests (index_reload). No downtime and no full rebuild: when
+the build manifest does not match the index, the job fails and asks for
+build_index.py instead.
+
+Jobs are JSON files in JOBS_DIR (INDEX_DIR/jobs), so any worker of the
+server answers for any job. Ingestion builds take JOBS_DIR/.lock; a job
+whose upload was already picked up by a build that started after it
+was queued, in this process or another, is done without a build of its
+own. Re-uploading a file name replaces that guide.
+"""
+import argparse
+import fcntl
+import json
+import os
+import queue
+import re
+import subprocess
+import sys
+import threading
+import time
+import traceback
+import uuid
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional
+
+from config import DOCS_DIR, INDEX_DIR, PDF_PATHS
+from utils import pdf_page_count
+
+JOBS_DIR = os.path.join(INDEX_DIR, "jobs")
+_KEEP_JOBS = 100   # finished jobs kept for GET /admin/documents/{id}
+_JOB_ID = re.compile(r"[0-9a-f]{12}")
+
+
+class Job:
+    def __init__(self, filename: str, path: str, jobs_dir: str = JOBS_DIR):
+        self.id = uuid.uuid4().hex[:12]
+        self.filename = filename
+        self.path = path
+        self.jobs_dir = jobs_dir
+        self.pid = os.getpid()       # the process that runs it: the server, then the build
+        self.state = "queued"        # queued -> running -> done | failed
+        self.stage = ""
+        self.done = 0
+        self.total = 0
+        self.result: Optional[Dict] = None
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+    def report(self, stage: str, done: int = 0, total: int = 0) -> None:
+        self.stage, self.done, self.total = stage, done, total
+        self.save()
+
+    def save(self) -> None:
+        """Write the job to JOBS_DIR/<id>.json (atomically)."""
+        os.makedirs(self.jobs_dir, exist_ok=True)
+        path = os.path.join(self.jobs_dir, f"{self.id}.json")
+        tmp = f"{path}.{self.pid}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(dict(self.to_dict(), path=self.path), f, ensure_ascii=False)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str) -> Optional["Job"]:
+        """The job saved at `path`, or None if it is gone or unreadable."""
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return None
+        job = cls.__new__(cls)
+        job.jobs_dir = os.path.dirname(path)
+        for key in ("id", "filename", "path", "pid", "state", "stage", "done", "total",
+                    "result", "error", "created_at", "started_at", "finished_at"):
+            setattr(job, key, state.get(key))
+        if job.state in ("queued", "running") and not _alive(job.pid):
+            job.state, job.finished_at = "failed", job.finished_at or time.time()
+            job.error = (f"interrupted: process {job.pid} exited; "
+                         "the PDF stays in DOCS_DIR and goes in with the next build")
+        return job
+
+    def to_dict(self) -> Dict:
+        return {
+            "id": self.id,
+            "filename": self.filename,
+            "pid": self.pid,
+            "state": self.state,
+            "stage": self.stage,
+            "done": self.done,
+            "total": self.total,
+            "result": self.result,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+def _alive(pid: Optional[int]) -> bool:
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def safe_pdf_name(filename: str) -> str:
+    """Plain file name ending in .pdf; raises ValueError for anything else."""
+    name = os.path.basename((filename or "").replace("\\", "/")).strip()
+    name = re.sub(r"[^\w.()\- ]+", "_", name)
+    if not name.lower().endswith(".pdf") or name.startswith("."):
+        raise ValueError("filename must be a .pdf file name")
+    if name in {p.name for p in PDF_PATHS}:
+        raise ValueError(f"{name} is one of the built-in guides (config.PDF_PATHS)")
+    return name
+
+
+def check_pdf(path: str) -> int:
+    """Page count of a readable PDF; raises ValueError otherwise."""
+    with open(path, "rb") as f:
+        if f.read(5) != b"%PDF-":
+            raise ValueError("not a PDF file")
+    try:
+        pages = pdf_page_count(path)
+    except Exception as e:
+        raise ValueError(f"unreadable PDF: {e}")
+    if not pages:
+        raise ValueError("PDF has no pages")
+    return pages
+
+
+class IngestQueue:
+    """
+    `on_published` is called when a job published a new version. Jobs are
+    shared through `jobs_dir` by every server process on this host (the
+    liveness of a queued or running job is checked by process id).
+    """
+
+    def __init__(self, on_published: Optional[Callable[[], object]] = None, jobs_dir: str = JOBS_DIR):
+        self._on_published = on_published
+        self.jobs_dir = jobs_dir
+        self._queue: "queue.Queue[Job]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._worker: Optional[threading.Thread] = None
+
+    def submit(self, tmp_path: str, filename: str) -> Job:
+        """
+        Validate the uploaded file at `tmp_path`, move it into DOCS_DIR as
+        `filename` and queue its ingestion. Raises ValueError (and removes
+        the upload) if it is not a usable PDF.
+        """
+        try:
+            name = safe_pdf_name(filename)
+            check_pdf(tmp_path)
+        except ValueError:
+            os.remove(tmp_path)
+            raise
+        os.makedirs(DOCS_DIR, exist_ok=True)
+        path = os.path.join(DOCS_DIR, name)
+        os.replace(tmp_path, path)   # a build never sees a half-written upload
+
+        job = Job(name, path, self.jobs_dir)
+        job.save()
+        finished = [j for j in self.list() if j.state in ("done", "failed")]
+        for old in finished[:max(0, len(finished) - _KEEP_JOBS)]:
+            try:
+                os.remove(os.path.join(self.jobs_dir, f"{old.id}.json"))
+            except FileNotFoundError:
+                pass
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._work, name="ingest", daemon=True)
+                self._worker.start()
+        self._queue.put(job)
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        if not _JOB_ID.fullmatch(job_id or ""):
+            return None
+        return Job.load(os.path.join(self.jobs_dir, f"{job_id}.json"))
+
+    def list(self) -> List[Job]:
+        """Jobs of every server process, oldest first."""
+        if not os.path.isdir(self.jobs_dir):
+            return []
+        jobs = [Job.load(os.path.join(self.jobs_dir, name))
+                for name in os.listdir(self.jobs_dir) if name.endswith(".json")]
+        return sorted((j for j in jobs if j is not None), key=lambda j: j.created_at or 0)
+
+    def pending(self) -> int:
+        return sum(j.state == "queued" for j in self.list())
+
+    @contextmanager
+    def _build_lock(self) -> Iterator[None]:
+        """One ingestion build at a time across server processes."""
+        os.makedirs(self.jobs_dir, exist_ok=True)
+        with open(os.path.join(self.jobs_dir, ".lock"), "w") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _covered_by(self, job: Job) -> Optional[Job]:
+        """A finished build that started after `job` was queued, so it already read its PDF."""
+        for other in self.list():
+            if (other.id != job.id and other.state == "done" and other.result
+                    and "covered_by" not in other.result and (other.started_at or 0) >= job.created_at):
+                return other
+        return None
+
+    def _build(self, job: Job) -> Job:
+        """Run the job's build in a child process; the job as the child left it."""
+        job.state = "running"
+        job.save()
+        code = subprocess.run([sys.executable, os.path.abspath(__file__), job.id, "--jobs-dir", self.jobs_dir],
+                              cwd=os.path.dirname(os.path.abspath(__file__))).returncode
+        finished = Job.load(os.path.join(self.jobs_dir, f"{job.id}.json")) or job
+        if finished.state not in ("done", "failed"):   # the child did not get as far as the job
+            finished.state, finished.finished_at = "failed", time.time()
+            finished.error = f"build process exited with code {code}"
+            finished.save()
+        return finished
+
+    def _work(self) -> None:
+        while True:
+            job = self._queue.get()
+            try:
+                with self._build_lock():
+                    job.started_at = time.time()
+                    covered = self._covered_by(job)
+                    if covered is None:
+                        job = self._build(job)
+                    else:
+                        job.result = {"version": None, "covered_by": covered.id}
+                        job.state, job.stage, job.finished_at = "done", "done", time.time()
+                        job.save()
+                if job.state == "done" and job.result.get("version") and self._on_published:
+                    self._on_published()
+            except Exception as e:
+                traceback.print_exc()
+                job.state, job.error, job.finished_at = "failed", f"{type(e).__name__}: {e}", time.time()
+                job.save()
+            finally:
+                self._queue.task_done()
+
+
+def run_job(job_id: str, jobs_dir: str = JOBS_DIR) -> int:
+    """
+    The build of one job, in the child process IngestQueue starts for it:
+    an incremental build_index.build(), its progress and result written to
+    the job's file. Returns the exit code (0 when the job is done).
+    """
+    job = Job.load(os.path.join(jobs_dir, f"{job_id}.json"))
+    if job is None:
+        print(f"❌ no ingestion job {job_id} in {jobs_dir}", file=sys.stderr)
+        return 2
+    job.pid, job.state = os.getpid(), "running"
+    job.save()
+    try:
+        from build_index import build
+        job.result = build(report=job.report, allow_full=False)
+        job.state, job.stage = "done", "done"   # done/total keep the last counts
+    except Exception as e:
+        traceback.print_exc()
+        job.state, job.error = "failed", f"{type(e).__name__}: {e}"
+    job.finished_at = time.time()
+    job.save()
+    return 0 if job.state == "done" else 1
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Run the build of one queued ingestion job (started by IngestQueue)")
+    ap.add_argument("job_id")
+    ap.add_argument("--jobs-dir", default=JOBS_DIR)
+    args = ap.parse_args()
+    sys.exit(run_job(args.job_id, args.jobs_dir))
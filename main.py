@@ -1,13 +1,54 @@
+import importlib
 import os
-from fastapi import FastAPI, HTTPException
+import secrets
+import uuid
+from contextlib import asynccontextmanager
+from typing import Optional
+from fastapi import FastAPI, Header, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from src.chat import get_response
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel
+from config import (
+    ADMIN_TOKEN, BUDGET_CHEAP_AT, BUDGET_CHEAP_REQUEST_TOKENS, BUDGET_CLIENT_DAILY_TOKENS,
+    BUDGET_REQUEST_TOKENS, CHAT_PIPELINE, DOCS_DIR, INDEX_WATCH_INTERVAL, MAX_UPLOAD_MB,
+)
+from ingest import IngestQueue
+from openai_replay import USAGE
+from profiler import PROFILER, ProfileMiddleware
+import budget
+import deadline
+import metrics
+
+# the pipeline answering /chat (src.chat unless CHAT_PIPELINE says otherwise)
+PIPELINE = importlib.import_module(CHAT_PIPELINE)
+get_response = PIPELINE.get_response
+metrics.PIPELINE_INFO.set(1, pipeline=CHAT_PIPELINE)
+
+# the live FAISS index of that pipeline (index_reload.IndexHolder); None for src.chat,
+# which reads the PDFs itself
+INDEX = getattr(PIPELINE, "INDEX", None)
+
+# uploaded PDFs are ingested one build at a time across workers; a published version is loaded right away
+INGEST = IngestQueue(on_published=INDEX.reload_async if INDEX is not None else None)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # load the index in the background and pick up newly published versions
+    if INDEX is not None:
+        INDEX.reload_async()
+        if INDEX_WATCH_INTERVAL > 0:
+            INDEX.watch(INDEX_WATCH_INTERVAL)
+    yield
+    if INDEX is not None:
+        INDEX.stop()
+
 
 app = FastAPI(
     title="Kinyarwanda Chatbot API",
     description="RAG-based chatbot for Kinyarwanda PDF content",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan,
 )
 
 # ⭐⭐⭐ THIS IS THE FIX - CORS Middleware ⭐⭐⭐
@@ -17,10 +58,14 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],  # Allows all methods (GET, POST, etc.)
     allow_headers=["*"],  # Allows all headers
+    expose_headers=["Server-Timing", "Retry-After"],  # readable by browser clients
 )
+# samples a PROFILE_SAMPLE_RATE share of /chat requests (off by default)
+app.add_middleware(ProfileMiddleware, profiler=PROFILER)
 
 class ChatRequest(BaseModel):
     query: str
+    debug: bool = False
 
 @app.get("/")
 def read_root():
@@ -30,7 +75,15 @@ def read_root():
         "endpoints": {
             "GET /chat": "Query with ?query=your_question",
             "POST /chat": "Send JSON body with {query: 'your_question'}",
-            "GET /health": "Health check endpoint"
+            "GET /health": "Health check endpoint",
+            "GET /metrics": "Prometheus metrics of this worker",
+            "GET /admin/index": "Live index version (needs X-Admin-Token)",
+            "POST /admin/reload": "Load the newest published index version (needs X-Admin-Token)",
+            "GET /admin/usage": "OpenAI calls and tokens, and answers by route, of this worker (needs X-Admin-Token)",
+            "GET /admin/profile": "Sampled /chat CPU profile as collapsed stacks, or ?format=top (needs X-Admin-Token)",
+            "GET /admin/budget": "OpenAI tokens and cost per client for a day (needs X-Admin-Token)",
+            "POST /admin/documents": "Upload a PDF (?filename=...) to be indexed in the background (needs X-Admin-Token)",
+            "GET /admin/documents/{job_id}": "Ingestion job progress (needs X-Admin-Token)"
         }
     }
 
@@ -42,35 +95,198 @@ def health_check():
         "version": "1.0.0"
     }
 
+@app.get("/metrics")
+def metrics_endpoint():
+    """Stage latencies, routes, OpenAI calls / tokens / 429s and index gauges of this worker"""
+    if INDEX is not None:
+        status = INDEX.status()
+        metrics.INDEX_CHUNKS.set(status["chunks"])
+        metrics.INDEX_VECTORS.set(status["vectors"])
+        metrics.INDEX_LOADED.set(status["loaded_at"] or 0)
+        metrics.INDEX_INFO.clear()
+        if status["version"]:
+            metrics.INDEX_INFO.set(1, version=status["version"])
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+def require_admin(token: Optional[str]):
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled (set ADMIN_TOKEN)")
+    if not token or not secrets.compare_digest(token, ADMIN_TOKEN):
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+
+def require_index():
+    if INDEX is None:
+        raise HTTPException(status_code=404, detail=f"{CHAT_PIPELINE} does not serve a FAISS index")
+
+def client_key(request: Request, key: Optional[str]) -> str:
+    """Whom the token budgets are kept for: the X-Client-Key header, else the caller's address."""
+    if key and key.strip():
+        return "key:" + key.strip()[:128]
+    return "ip:" + (request.client.host if request.client else "unknown")
+
+def answer(query: str, response: Response, debug: bool, admin_token: Optional[str], client: str):
+    """
+    Run the pipeline; stage durations go out in the Server-Timing header.
+    With debug (needs X-Admin-Token) the body also carries the route,
+    retrieved chunks with scores, OpenAI calls and tokens, the budget and
+    the deadline. A client over its daily token budget gets a 429; a
+    question over its own cap gets the best-effort answer. Full PDF and
+    general answers are kept, per index version, for when the same question
+    runs out of time.
+    """
+    if debug:
+        require_admin(admin_token)
+    with metrics.request() as trace, PROFILER.request(trace.current_stage):
+        try:
+            with budget.request(client) as spend, deadline.request() as dl:
+                try:
+                    text = get_response(query)
+                except budget.BudgetExceeded as e:
+                    if e.limit != "request":
+                        raise
+                    # the question's own cap, hit in a step the pipeline has no best effort for
+                    text = deadline.best_effort(query, [], PIPELINE.FALLBACK, trace.index_version, reason="budget")
+        except budget.BudgetExceeded as e:
+            # the client's daily budget: nothing is answered until it resets
+            raise HTTPException(status_code=429, detail=f"Token budget exceeded: {e}",
+                                headers={"Server-Timing": trace.server_timing(),
+                                         "Retry-After": str(budget.seconds_to_midnight())})
+        except deadline.DeadlineExceeded as e:
+            # pipelines answer with their best effort; this is for one that does not
+            raise HTTPException(status_code=504, detail=f"Answer took too long: {e}",
+                                headers={"Server-Timing": trace.server_timing()})
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Error processing query: {str(e)}",
+                                headers={"Server-Timing": trace.server_timing()})
+        response.headers["Server-Timing"] = trace.server_timing()
+    # under the index version the pipeline answered from (None for src.chat)
+    if (dl is None or dl.degraded is None) and trace.route in ("pdf", "general"):
+        deadline.ANSWERS.put(query, text, trace.index_version)
+    if debug:
+        return {"response": text, "debug": {"pipeline": CHAT_PIPELINE, **trace.to_dict(), "budget": spend.to_dict(),
+                                            "deadline": dl.to_dict() if dl is not None else None}}
+    return {"response": text}
+
 @app.get("/chat")
-def chat_get(query: str):
+def chat_get(query: str, request: Request, response: Response, debug: bool = False,
+             x_admin_token: Optional[str] = Header(None), x_client_key: Optional[str] = Header(None)):
     """
     GET endpoint for chat queries
-    Example: /chat?query=Muraho
+    Example: /chat?query=Muraho  (add &debug=true with X-Admin-Token for the trace)
     """
     if not query or not query.strip():
         raise HTTPException(status_code=400, detail="Query parameter is required")
     
-    try:
-        response = get_response(query)
-        return {"response": response}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error processing query: {str(e)}")
+    return answer(query, response, debug, x_admin_token, client_key(request, x_client_key))
 
 @app.post("/chat")
-def chat_post(body: ChatRequest):
+def chat_post(body: ChatRequest, request: Request, response: Response,
+              x_admin_token: Optional[str] = Header(None), x_client_key: Optional[str] = Header(None)):
     """
     POST endpoint for chat queries
-    Body: {"query": "Muraho"}
+    Body: {"query": "Muraho"}  (add "debug": true with X-Admin-Token for the trace)
     """
     if not body.query or not body.query.strip():
         raise HTTPException(status_code=400, detail="Query field is required")
     
+    return answer(body.query, response, body.debug, x_admin_token, client_key(request, x_client_key))
+
+@app.get("/admin/index")
+def admin_index(x_admin_token: Optional[str] = Header(None)):
+    """Which index version this worker serves, and reload state"""
+    require_admin(x_admin_token)
+    require_index()
+    return INDEX.status()
+
+@app.post("/admin/reload")
+def admin_reload(force: bool = False, x_admin_token: Optional[str] = Header(None)):
+    """
+    Load the published index version in the background and swap it in
+    between requests (in-flight requests finish on the old one).
+    Other workers pick it up through the INDEX_WATCH_INTERVAL watcher.
+    """
+    require_admin(x_admin_token)
+    require_index()
+    started = INDEX.reload_async(force)
+    return {"started": started, **INDEX.status()}
+
+@app.get("/admin/usage")
+def admin_usage(x_admin_token: Optional[str] = Header(None)):
+    """OpenAI calls, failures and tokens, and /chat answers by route, of this worker since it started"""
+    require_admin(x_admin_token)
+    return {"pipeline": CHAT_PIPELINE, **USAGE.snapshot(), "routes": metrics.ROUTES.totals()}
+
+@app.get("/admin/budget")
+def admin_budget(day: Optional[str] = None, x_admin_token: Optional[str] = Header(None)):
+    """OpenAI requests, calls, tokens and estimated cost per client on a UTC day (YYYY-MM-DD, default today)"""
+    require_admin(x_admin_token)
+    day = day or budget.today()
+    return {
+        "day": day,
+        "limits": {"request_tokens": BUDGET_REQUEST_TOKENS, "client_daily_tokens": BUDGET_CLIENT_DAILY_TOKENS,
+                   "cheap_at": BUDGET_CHEAP_AT, "cheap_request_tokens": BUDGET_CHEAP_REQUEST_TOKENS},
+        "clients": budget.LEDGER.report(day),
+    }
+
+@app.get("/admin/profile")
+def admin_profile(format: str = "folded", reset: bool = False, x_admin_token: Optional[str] = Header(None)):
+    """
+    Aggregated stack samples of profiled /chat requests (PROFILE_SAMPLE_RATE).
+    folded: one "stage;frame;...;frame microseconds" line per stack, e.g.
+        curl -H "X-Admin-Token: $ADMIN_TOKEN" http://127.0.0.1:1000/admin/profile > chat.folded
+        flamegraph.pl chat.folded > chat.svg     # or open chat.folded in speedscope
+    top: the heaviest functions by self and total time. reset=true starts over.
+    """
+    require_admin(x_admin_token)
+    body = PROFILER.top() if format == "top" else PROFILER.folded()
+    if reset:
+        PROFILER.reset()
+    if format == "top":
+        return body
+    return Response(body, media_type="text/plain; charset=utf-8")
+
+@app.post("/admin/documents", status_code=202)
+async def admin_add_document(request: Request, filename: str, x_admin_token: Optional[str] = Header(None)):
+    """
+    Add a guide: send the PDF as the raw request body, e.g.
+        curl -X POST -H "X-Admin-Token: $ADMIN_TOKEN" -H "Content-Type: application/pdf" \
+             --data-binary @guide.pdf "http://127.0.0.1:1000/admin/documents?filename=guide.pdf"
+    The file is stored in DOCS_DIR and indexed by a background job; poll
+    GET /admin/documents/{id} for progress. It is searchable once the job is done.
+    """
+    require_admin(x_admin_token)
+    os.makedirs(DOCS_DIR, exist_ok=True)
+    tmp = os.path.join(DOCS_DIR, f".upload-{uuid.uuid4().hex}.tmp")
+    size, limit = 0, MAX_UPLOAD_MB * 1024 * 1024
     try:
-        response = get_response(body.query)
-        return {"response": response}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error processing query: {str(e)}")
+        with open(tmp, "wb") as f:
+            async for block in request.stream():
+                size += len(block)
+                if size > limit:
+                    raise HTTPException(status_code=413, detail=f"PDF larger than {MAX_UPLOAD_MB} MB")
+                f.write(block)
+        job = await run_in_threadpool(INGEST.submit, tmp, filename)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return job.to_dict()
+
+@app.get("/admin/documents")
+def admin_list_documents(x_admin_token: Optional[str] = Header(None)):
+    """Recent ingestion jobs, newest last"""
+    require_admin(x_admin_token)
+    return {"pending": INGEST.pending(), "jobs": [job.to_dict() for job in INGEST.list()]}
+
+@app.get("/admin/documents/{job_id}")
+def admin_document_job(job_id: str, x_admin_token: Optional[str] = Header(None)):
+    """Progress of one ingestion job"""
+    require_admin(x_admin_token)
+    job = INGEST.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown job")
+    return job.to_dict()
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,313 @@
+"""
+Prometheus metrics of one API worker, served by GET /metrics, and the
+trace of the request being answered.
+
+    with metrics.stage("classifier"):
+        related = is_parenting_related(client, question)
+    metrics.route("general")
+
+Counters, gauges and histograms are kept in this process and rendered in
+the Prometheus text format (version 0.0.4), so there is no extra
+dependency. Each worker has its own numbers: run one worker per
+container, or scrape every worker's port, and sum in PromQL.
+
+Inside `with metrics.request() as trace:` the same calls also fill that
+request's Trace (stage durations, route, retrieved chunks, OpenAI usage),
+which main.py turns into the Server-Timing header and the debug payload.
+"""
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Sequence, Tuple
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# seconds; OpenAI round trips dominate, local stages sit in the first buckets
+STAGE_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+REQUEST_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 3.0, 5.0, 8.0, 13.0, 20.0, 30.0, 60.0)
+
+_REGISTRY: List["_Metric"] = []
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(pairs: Sequence[Tuple[str, str]]) -> str:
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[str, ...], object] = {}
+        _REGISTRY.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} takes labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._values.clear()
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            return [f"{self.name}{_labels(list(zip(self.labelnames, key)))} {_number(v)}"
+                    for key, v in sorted(self._values.items())]
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"] + self.samples()
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def totals(self) -> Dict[str, float]:
+        """Current values by label values (joined with ",")."""
+        with self._lock:
+            return {",".join(key): v for key, v in sorted(self._values.items())}
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = float(value)
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels) -> None:
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets=STAGE_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, upper in enumerate(self.buckets):
+                if value <= upper:
+                    counts[i] += 1
+                    break
+            self._values[key] = (counts, total + value)
+
+    def samples(self) -> List[str]:
+        out = []
+        with self._lock:
+            for key, (counts, total) in sorted(self._values.items()):
+                pairs = list(zip(self.labelnames, key))
+                running = 0
+                for upper, n in zip(self.buckets, counts):
+                    running += n
+                    out.append(f"{self.name}_bucket{_labels(pairs + [('le', _number(upper))])} {running}")
+                out.append(f"{self.name}_sum{_labels(pairs)} {_number(total)}")
+                out.append(f"{self.name}_count{_labels(pairs)} {running}")
+        return out
+
+
+def render() -> str:
+    return "\n".join(line for metric in _REGISTRY for line in metric.render()) + "\n"
+
+
+# ---------------------------
+# METRICS
+# ---------------------------
+STAGE_SECONDS = Histogram(
+    "chatbot_stage_seconds",
+    "Time per answer pipeline stage (smalltalk, moderation, clean, expand, embed, search, filter, "
+    "keyword, answer, classifier, general)",
+    ("stage",),
+)
+REQUEST_SECONDS = Histogram("chatbot_request_seconds", "Time to answer a /chat request", ("status",),
+                            buckets=REQUEST_BUCKETS)
+INFLIGHT = Gauge("chatbot_inflight_requests", "/chat requests being answered")
+ROUTES = Counter("chatbot_routes_total",
+                 "Answers by route: smalltalk, blocked, pdf, general, out_of_scope, deadline, budget", ("route",))
+CACHE = Counter("chatbot_cache_lookups_total", "Cache lookups by cache and result (hit / miss)",
+                ("cache", "result"))
+OPENAI_CALLS = Counter("chatbot_openai_calls_total", "OpenAI requests, failed ones included", ("endpoint",))
+OPENAI_ERRORS = Counter("chatbot_openai_errors_total", "OpenAI requests that raised", ("endpoint",))
+OPENAI_RATE_LIMITED = Counter("chatbot_openai_rate_limited_total", "OpenAI requests answered with a 429",
+                              ("endpoint",))
+OPENAI_RETRIES = Counter("chatbot_openai_retries_total", "OpenAI requests sent again after an error",
+                         ("endpoint",))
+OPENAI_TOKENS = Counter("chatbot_openai_tokens_total", "Tokens reported by OpenAI (prompt / completion)",
+                        ("kind",))
+OPENAI_COST = Counter("chatbot_openai_cost_usd_total", "Estimated OpenAI spend at OPENAI_PRICES", ("endpoint",))
+BUDGET_REQUESTS = Counter("chatbot_budget_requests_total", "/chat requests by budget mode: full, cheap, refused",
+                          ("mode",))
+DEADLINE_DEGRADED = Counter("chatbot_deadline_degraded_total",
+                            "Answers given after the deadline passed: cached, snippet or fallback", ("result",))
+BUDGET_EXCEEDED = Counter("chatbot_budget_exceeded_total",
+                          "Requests or OpenAI calls stopped by a token budget (request cap / client daily)",
+                          ("limit",))
+INDEX_CHUNKS = Gauge("chatbot_index_chunks", "Chunks in the served index version")
+INDEX_VECTORS = Gauge("chatbot_index_vectors", "Vectors in the served FAISS index")
+INDEX_LOADED = Gauge("chatbot_index_loaded_timestamp_seconds", "When the served index version was loaded")
+INDEX_INFO = Gauge("chatbot_index_info", "Served index version (always 1)", ("version",))
+PIPELINE_INFO = Gauge("chatbot_pipeline_info", "Module answering /chat (always 1)", ("pipeline",))
+
+
+# ---------------------------
+# REQUEST TRACE
+# ---------------------------
+class Trace:
+    """Stage durations, route, index version, retrieved chunks and OpenAI usage of one /chat request."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages: Dict[str, float] = {}   # ms, summed when a stage runs twice
+        self.route: Optional[str] = None
+        self.index_version: Optional[str] = None   # the index version the pipeline answered from
+        self.chunks: List[Dict] = []
+        self.active: List[str] = []   # metrics.stage blocks running now, innermost last
+        self.openai = {"calls": {"chat": 0, "embeddings": 0}, "errors": 0,
+                       "prompt_tokens": 0, "completion_tokens": 0}
+
+    def add_stage(self, name: str, ms: float) -> None:
+        self.stages[name] = self.stages.get(name, 0.0) + ms
+
+    def current_stage(self) -> Optional[str]:
+        """Innermost running stage; read by the profiler from its own thread."""
+        active = self.active
+        return active[-1] if active else None
+
+    def total_ms(self) -> float:
+        return (time.perf_counter() - self.started) * 1000.0
+
+    def server_timing(self) -> str:
+        """Server-Timing header value: each stage, then the whole request as `total`."""
+        parts = [f"{name};dur={ms:.1f}" for name, ms in self.stages.items()]
+        return ", ".join(parts + [f"total;dur={self.total_ms():.1f}"])
+
+    def to_dict(self) -> Dict:
+        return {"route": self.route, "index_version": self.index_version, "stages_ms": {k: round(v, 1) for k, v in self.stages.items()},
+                "total_ms": round(self.total_ms(), 1), "chunks": self.chunks, "openai": self.openai}
+
+
+_TRACE: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar("trace", default=None)
+
+
+def current_trace() -> Optional[Trace]:
+    return _TRACE.get()
+
+
+@contextmanager
+def stage(name: str):
+    """Time the block into chatbot_stage_seconds{stage=name} and the trace, also when it raises."""
+    trace = _TRACE.get()
+    if trace is not None:
+        trace.active.append(name)
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        ms = (time.perf_counter() - t0) * 1000.0
+        STAGE_SECONDS.observe(ms / 1000.0, stage=name)
+        if trace is not None:
+            trace.active.pop()
+            trace.add_stage(name, ms)
+
+
+def route(name: str) -> None:
+    """The way this request was answered: smalltalk, blocked, pdf, general, out_of_scope, deadline or budget."""
+    ROUTES.inc(route=name)
+    trace = _TRACE.get()
+    if trace is not None:
+        trace.route = name
+
+
+def served(version: str) -> None:
+    """The index version this request is answered from (FAISS pipelines)."""
+    trace = _TRACE.get()
+    if trace is not None:
+        trace.index_version = version
+
+
+def retrieved(chunks: Sequence[Dict], scores: Sequence[float]) -> None:
+    """Chunks handed to the answer step, with their vector scores (None for keyword fallback hits)."""
+    trace = _TRACE.get()
+    if trace is None:
+        return
+    if "keyword" in trace.stages:
+        scores = [None] * len(chunks)
+    trace.chunks = [{"id": c.get("id"), "source": c.get("source"), "page": c.get("page"),
+                     "score": None if s is None else round(float(s), 4)}
+                    for c, s in zip(chunks, scores)]
+
+
+def openai_call(endpoint: str, usage=None, error: Optional[Exception] = None, rate_limited: bool = False) -> None:
+    """One OpenAI request (counted by openai_replay.CountingClient)."""
+    OPENAI_CALLS.inc(endpoint=endpoint)
+    trace = _TRACE.get()
+    if trace is not None:
+        trace.openai["calls"][endpoint] += 1
+    if error is not None:
+        OPENAI_ERRORS.inc(endpoint=endpoint)
+        if rate_limited:
+            OPENAI_RATE_LIMITED.inc(endpoint=endpoint)
+        if trace is not None:
+            trace.openai["errors"] += 1
+        return
+    prompt = int(getattr(usage, "prompt_tokens", 0) or 0)
+    completion = int(getattr(usage, "completion_tokens", 0) or 0)
+    OPENAI_TOKENS.inc(prompt, kind="prompt")
+    OPENAI_TOKENS.inc(completion, kind="completion")
+    if trace is not None:
+        trace.openai["prompt_tokens"] += prompt
+        trace.openai["completion_tokens"] += completion
+
+
+@contextmanager
+def request():
+    """Count a /chat request as in flight, time it by outcome, and trace it."""
+    INFLIGHT.inc()
+    status = "error"
+    with tracing() as trace:
+        try:
+            yield trace
+            status = "ok"
+        finally:
+            INFLIGHT.dec()
+            REQUEST_SECONDS.observe(time.perf_counter() - trace.started, status=status)
+
+
+@contextmanager
+def tracing():
+    """A Trace current for the block, without counting a request (benchmarks)."""
+    trace = Trace()
+    token = _TRACE.set(trace)
+    try:
+        yield trace
+    finally:
+        _TRACE.reset(token)
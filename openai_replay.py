@@ -0,0 +1,429 @@
+"""
+Record/replay stand-in for the OpenAI client, selected by OPENAI_MODE:
+
+    client = make_client()     # everywhere the code used to call OpenAI()
+
+    live     the real client (default)
+    record   the real client; every chat completion and embedding it
+             returns is also saved to OPENAI_RECORDINGS_PATH
+    replay   no network: answers come from the recordings
+
+Chat completions are keyed by a hash of the whole request (model,
+messages, temperature, ...). Embeddings are stored per input text under
+(model, dims), in the embedding cache format (embed_cache), so a replayed
+build may batch its texts differently than the recorded one did.
+
+In replay mode, OPENAI_FAKE_CHAT_LATENCY / OPENAI_FAKE_EMBED_LATENCY add a
+simulated response time ("fixed:MS", "uniform:LO,HI" or
+"lognormal:MEDIAN,SIGMA", in ms) and OPENAI_FAKE_429_RATE the share of
+calls that fail with a rate-limit error, so retries and throughput can be
+load-tested on one machine; a call whose `timeout` is shorter than its
+simulated latency times out. An unrecorded request raises ReplayMiss, or
+with OPENAI_REPLAY_MISS=synthesize gets a deterministic pseudo-random
+vector / placeholder reply (for load tests with unseen questions). A
+synthesized reply to a yes/no prompt (smalltalk detection, moderation,
+topic classifier) is the verdict that lets the question go on to
+retrieval and the answer step, so replayed pipelines do the same work as
+live ones. USAGE counts the misses.
+"""
+import base64
+import hashlib
+import itertools
+import json
+import math
+import random
+import threading
+import time
+from types import SimpleNamespace
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+import openai
+from openai.types.chat import ChatCompletion
+
+from config import (
+    OPENAI_MODE, OPENAI_RECORDINGS_PATH, OPENAI_REPLAY_MISS,
+    OPENAI_FAKE_CHAT_LATENCY, OPENAI_FAKE_EMBED_LATENCY, OPENAI_FAKE_429_RATE,
+)
+import budget
+import deadline
+import metrics
+from embed_cache import EmbeddingCache, text_key
+from embeddings import NATIVE_DIMS, decode_embedding, estimate_tokens
+
+_CHAT_SCHEMA = """
+CREATE TABLE IF NOT EXISTS completions (
+    hash TEXT PRIMARY KEY,
+    body TEXT NOT NULL
+) WITHOUT ROWID
+"""
+
+SYNTHETIC_REPLY = "(replay) no recorded reply for this request"
+# (text in the prompt, synthesized reply): the verdict that sends a question on to retrieval
+SYNTHETIC_VERDICTS = (
+    ("NOT_SMALLTALK", "NOT_SMALLTALK"),          # src/greetings*.handle_smalltalk
+    ('"HARMFUL" cyangwa "SAFE"', "SAFE"),         # src/greetings.py moderation
+    ("You are a classifier.", "YES"),            # is_parenting_related
+)
+
+
+def synthetic_reply(messages) -> str:
+    """Placeholder reply to an unrecorded chat request."""
+    prompt = "\n".join(str(m.get("content", "")) for m in messages)
+    for marker, reply in SYNTHETIC_VERDICTS:
+        if marker in prompt:
+            return reply
+    return SYNTHETIC_REPLY
+
+
+class ReplayMiss(LookupError):
+    """A replayed request that was never recorded."""
+
+
+class InjectedTimeoutError(openai.APITimeoutError):
+    """Simulated timeout: the simulated latency was longer than the call's timeout."""
+
+    def __init__(self, message: str):
+        Exception.__init__(self, message)
+        self.message = message
+        self.body = None
+        self.request = None
+
+
+class InjectedRateLimitError(openai.RateLimitError):
+    """Simulated 429 (OPENAI_FAKE_429_RATE); there is no HTTP response behind it."""
+
+    def __init__(self, message: str):
+        Exception.__init__(self, message)
+        self.message = message
+        self.status_code = 429
+        self.code = "rate_limit_exceeded"
+        self.type = "requests"
+        self.param = None
+        self.body = None
+        self.response = None
+        self.request = None
+        self.request_id = None
+
+
+def parse_latency(spec: str) -> Optional[Callable[[random.Random], float]]:
+    """Sampler of simulated latency in seconds from "fixed:MS" / "uniform:LO,HI" / "lognormal:MEDIAN,SIGMA"."""
+    if not spec:
+        return None
+    kind, _, args = spec.partition(":")
+    try:
+        nums = [float(x) for x in args.split(",") if x.strip()]
+        if kind == "fixed":
+            ms, = nums
+            return lambda rng: ms / 1000.0
+        if kind == "uniform":
+            lo, hi = nums
+            return lambda rng: rng.uniform(lo, hi) / 1000.0
+        if kind == "lognormal":
+            median, sigma = nums
+            return lambda rng: median * math.exp(sigma * rng.gauss(0.0, 1.0)) / 1000.0
+    except ValueError:
+        pass
+    raise ValueError(f"bad latency spec {spec!r}: use fixed:MS, uniform:LO,HI or lognormal:MEDIAN,SIGMA")
+
+
+def request_key(kwargs: Dict) -> str:
+    """Hash of a chat request's arguments, independent of keyword order (and of its timeout)."""
+    blob = json.dumps({k: v for k, v in kwargs.items() if k != "timeout"},
+                      sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+class Recordings:
+    """Recorded responses in one SQLite file; a connection per thread (API workers, embedding pool)."""
+
+    def __init__(self, path: str = OPENAI_RECORDINGS_PATH):
+        self.path = path
+        self._local = threading.local()
+
+    @property
+    def vectors(self) -> EmbeddingCache:
+        cache = getattr(self._local, "cache", None)
+        if cache is None:
+            cache = EmbeddingCache(self.path, name="recordings")
+            cache.conn.execute(_CHAT_SCHEMA)
+            self._local.cache = cache
+        return cache
+
+    def get_chat(self, key: str) -> Optional[str]:
+        row = self.vectors.conn.execute("SELECT body FROM completions WHERE hash = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def put_chat(self, key: str, body: str) -> None:
+        with self.vectors.conn:
+            self.vectors.conn.execute("INSERT OR REPLACE INTO completions (hash, body) VALUES (?, ?)", (key, body))
+
+    def count(self) -> Dict[str, int]:
+        conn = self.vectors.conn
+        return {"completions": conn.execute("SELECT COUNT(*) FROM completions").fetchone()[0],
+                "embeddings": self.vectors.count()}
+
+
+def _texts(input) -> List[str]:
+    return [input] if isinstance(input, str) else list(input)
+
+
+class _Endpoint:
+    def __init__(self, create: Callable):
+        self.create = create
+
+
+class RecordingClient:
+    """The real client, saving every chat completion and embedding it returns."""
+
+    def __init__(self, client, recordings: Recordings):
+        self._client = client
+        self.recordings = recordings
+        self.chat = SimpleNamespace(completions=_Endpoint(self._chat))
+        self.embeddings = _Endpoint(self._embed)
+
+    def _chat(self, **kwargs):
+        response = self._client.chat.completions.create(**kwargs)
+        self.recordings.put_chat(request_key(kwargs), response.model_dump_json())
+        return response
+
+    def _embed(self, input, model, **kwargs):
+        response = self._client.embeddings.create(input=input, model=model, **kwargs)
+        texts = _texts(input)
+        self.recordings.vectors.put_many(model, kwargs.get("dimensions") or 0, {
+            text_key(texts[getattr(e, "index", i)]): decode_embedding(e.embedding)
+            for i, e in enumerate(response.data)
+        })
+        return response
+
+    def with_options(self, **options) -> "RecordingClient":
+        """The wrapped client with `options` (e.g. max_retries), still recording."""
+        return RecordingClient(self._client.with_options(**options), self.recordings)
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+
+class ReplayClient:
+    """Offline client answering from Recordings, with optional simulated latency and 429s."""
+
+    def __init__(self, recordings: Recordings, miss: str = "error",
+                 chat_latency: Optional[Callable] = None, embed_latency: Optional[Callable] = None,
+                 rate_429: float = 0.0, seed: Optional[int] = None):
+        self.recordings = recordings
+        self.miss = miss
+        self.chat_latency = chat_latency
+        self.embed_latency = embed_latency
+        self.rate_429 = rate_429
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.chat = SimpleNamespace(completions=_Endpoint(self._chat))
+        self.embeddings = _Endpoint(self._embed)
+
+    def _simulate(self, latency: Optional[Callable], timeout: Optional[float] = None) -> None:
+        with self._lock:
+            limited = self._rng.random() < self.rate_429
+            delay = latency(self._rng) if latency else 0.0
+        if limited:
+            raise InjectedRateLimitError("Error code: 429 - Rate limit reached (simulated by "
+                                         "OPENAI_FAKE_429_RATE). Please try again in 0.2s.")
+        if timeout is not None and delay > timeout:
+            time.sleep(timeout)
+            raise InjectedTimeoutError(f"Request timed out after {timeout:.2f}s (simulated)")
+        if delay > 0:
+            time.sleep(delay)
+
+    def _missing(self, what: str) -> ReplayMiss:
+        return ReplayMiss(f"no recorded {what} in {self.recordings.path}; record it with "
+                          "OPENAI_MODE=record or set OPENAI_REPLAY_MISS=synthesize")
+
+    def _chat(self, **kwargs):
+        self._simulate(self.chat_latency, kwargs.get("timeout"))
+        key = request_key(kwargs)
+        body = self.recordings.get_chat(key)
+        if body is not None:
+            return ChatCompletion.model_validate_json(body)
+        if self.miss != "synthesize":
+            raise self._missing("chat completion for this request")
+        USAGE.missed("chat")
+        reply = synthetic_reply(kwargs.get("messages", []))
+        prompt = estimate_tokens([str(m.get("content", "")) for m in kwargs.get("messages", [])])
+        completion = estimate_tokens([reply])
+        return ChatCompletion.model_validate({
+            "id": f"replay-{key[:24]}",
+            "object": "chat.completion",
+            "created": 0,
+            "model": kwargs.get("model", ""),
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": reply}}],
+            "usage": {"prompt_tokens": prompt, "completion_tokens": completion,
+                      "total_tokens": prompt + completion},
+        })
+
+    def _embed(self, input, model, dimensions=0, encoding_format=None, **kwargs):
+        self._simulate(self.embed_latency, kwargs.get("timeout"))
+        texts = _texts(input)
+        keys = [text_key(t) for t in texts]
+        found = self.recordings.vectors.get_many(model, dimensions or 0, keys)
+        for t, k in zip(texts, keys):
+            if k in found:
+                continue
+            if self.miss != "synthesize":
+                raise self._missing(f"{model} embedding for {t[:40]!r}")
+            USAGE.missed("embeddings")
+            rng = np.random.default_rng(int(k[:16], 16))
+            v = rng.standard_normal(dimensions or NATIVE_DIMS.get(model, 1536)).astype("<f4")
+            found[k] = v / np.linalg.norm(v)
+        data = []
+        for i, k in enumerate(keys):
+            v = np.asarray(found[k], dtype="<f4")
+            emb = base64.b64encode(v.tobytes()).decode("ascii") if encoding_format == "base64" else v.tolist()
+            data.append(SimpleNamespace(embedding=emb, index=i, object="embedding"))
+        tokens = estimate_tokens(texts)
+        return SimpleNamespace(data=data, model=model, object="list",
+                               usage=SimpleNamespace(prompt_tokens=tokens, total_tokens=tokens))
+
+
+# ---------------------------
+# USAGE
+# ---------------------------
+class Usage:
+    """
+    Process-wide OpenAI calls, failures and tokens of every client made by
+    make_client, and the replayed calls that had no recording (synthesized).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = {"chat": 0, "embeddings": 0}
+        self.errors = {"chat": 0, "embeddings": 0}
+        self.replay_misses = {"chat": 0, "embeddings": 0}
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+    def add(self, endpoint: str, usage=None, failed: bool = False) -> None:
+        with self._lock:
+            self.calls[endpoint] += 1
+            if failed:
+                self.errors[endpoint] += 1
+            self.prompt_tokens += int(getattr(usage, "prompt_tokens", 0) or 0)
+            self.completion_tokens += int(getattr(usage, "completion_tokens", 0) or 0)
+
+    def missed(self, endpoint: str) -> None:
+        with self._lock:
+            self.replay_misses[endpoint] += 1
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {"calls": dict(self.calls), "errors": dict(self.errors),
+                    "replay_misses": dict(self.replay_misses),
+                    "prompt_tokens": self.prompt_tokens, "completion_tokens": self.completion_tokens}
+
+
+USAGE = Usage()
+
+
+# retried by CountingClient under a deadline, in place of the SDK's own retries (same count and backoff)
+_RETRYABLE = (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError)
+DEADLINE_RETRIES = 2
+DEADLINE_RETRY_WAIT = 0.5   # seconds, doubled per retry
+# a completion is left at the model's own limit while the request's cap leaves at least this much
+# (setting max_tokens above a model's output limit is an API error)
+CAP_COMPLETION_BELOW = 4096
+
+
+class CountingClient:
+    """
+    Any of the clients above, with every call counted in USAGE and metrics
+    (failed ones too, e.g. 429s), charged to the request's token budget and
+    held to its deadline.
+    """
+
+    def __init__(self, client, usage: Usage = USAGE):
+        self._client = client
+        # under a deadline: the SDK's retries (2 by default, each with the full timeout) would overrun it
+        live = isinstance(client, (openai.OpenAI, RecordingClient))
+        self._no_retries = client.with_options(max_retries=0) if live else client
+        self.usage = usage
+        self.chat = SimpleNamespace(completions=_Endpoint(self._chat))
+        self.embeddings = _Endpoint(self._embed)
+
+    def _client_for(self, kwargs: Dict):
+        """The client for this call; under a deadline the time left becomes its timeout."""
+        left = deadline.timeout()   # raises DeadlineExceeded when too little is left
+        if left is None:
+            return self._client
+        kwargs["timeout"] = min(left, kwargs.get("timeout") or left)
+        return self._no_retries
+
+    def _call(self, endpoint: str, create: Callable, kwargs: Dict):
+        spend = budget.current()
+        if spend is not None:
+            allowed = spend.check(_prompt_tokens(endpoint, kwargs))
+            if allowed is not None and endpoint == "chat":
+                # the completion may not run past the request's cap either
+                key = "max_completion_tokens" if "max_completion_tokens" in kwargs else "max_tokens"
+                asked = kwargs.get(key)
+                if asked is not None or allowed < CAP_COMPLETION_BELOW:
+                    kwargs[key] = min(asked or allowed, allowed)
+        for attempt in itertools.count():
+            try:
+                response = create(**kwargs)
+                break
+            except Exception as e:
+                self.usage.add(endpoint, failed=True)
+                metrics.openai_call(endpoint, error=e, rate_limited=isinstance(e, openai.RateLimitError))
+                if deadline.current() is None:
+                    raise
+                if isinstance(e, openai.APITimeoutError):
+                    raise deadline.DeadlineExceeded(f"{endpoint} call timed out at the deadline") from e
+                # what the SDK retries would have done, as long as the deadline leaves room
+                wait = DEADLINE_RETRY_WAIT * 2 ** attempt
+                left = deadline.remaining()
+                if not isinstance(e, _RETRYABLE) or attempt >= DEADLINE_RETRIES \
+                        or left < wait + deadline.MIN_CALL_SECONDS:
+                    raise
+                metrics.OPENAI_RETRIES.inc(endpoint=endpoint)
+                time.sleep(wait)
+                kwargs["timeout"] = deadline.timeout()
+        usage = getattr(response, "usage", None)
+        self.usage.add(endpoint, usage)
+        metrics.openai_call(endpoint, usage)
+        if spend is not None:
+            spend.charge(endpoint, kwargs.get("model", ""), usage)
+        return response
+
+    def _chat(self, **kwargs):
+        return self._call("chat", self._client_for(kwargs).chat.completions.create, kwargs)
+
+    def _embed(self, **kwargs):
+        return self._call("embeddings", self._client_for(kwargs).embeddings.create, kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+
+def _prompt_tokens(endpoint: str, kwargs: Dict) -> int:
+    """Estimated input tokens of a call, before it is sent."""
+    if endpoint == "chat":
+        return estimate_tokens([str(m.get("content", "")) for m in kwargs.get("messages", [])])
+    return estimate_tokens(_texts(kwargs.get("input", [])))
+
+
+def make_client(api_key: Optional[str] = None, mode: str = OPENAI_MODE):
+    """
+    OpenAI client for OPENAI_MODE: the real one, a recording wrapper, or
+    the offline replay client; its calls are counted in USAGE.
+    """
+    if mode == "replay":
+        return CountingClient(ReplayClient(
+            Recordings(OPENAI_RECORDINGS_PATH), OPENAI_REPLAY_MISS,
+            parse_latency(OPENAI_FAKE_CHAT_LATENCY), parse_latency(OPENAI_FAKE_EMBED_LATENCY),
+            OPENAI_FAKE_429_RATE,
+        ))
+    client = openai.OpenAI(api_key=api_key) if api_key else openai.OpenAI()
+    if mode == "record":
+        return CountingClient(RecordingClient(client, Recordings(OPENAI_RECORDINGS_PATH)))
+    if mode != "live":
+        raise ValueError(f"OPENAI_MODE must be live, record or replay, not {mode!r}")
+    return CountingClient(client)
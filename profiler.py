@@ -0,0 +1,222 @@
+"""
+Sampling profiler for /chat under real traffic, switched on by PROFILE_SAMPLE_RATE.
+
+That share of /chat requests is profiled. While one is in flight, a
+background thread reads the Python stacks (sys._current_frames) every
+PROFILE_INTERVAL_MS of
+  - the worker thread answering it, under the pipeline stage running at
+    the time (smalltalk, answer, ...; "pipeline" between stages), and
+  - the event loop thread, under "event_loop": request body JSON parsing,
+    pydantic validation and response encoding happen there. Its stacks end
+    at the innermost coroutine: the loop suspends and resumes coroutines
+    while the walk runs, and following f_back out of one that was just
+    suspended can crash the process (CPython 3.11).
+In PROFILE_MODE=cpu (default) each sample is weighted by the CPU time the
+thread used since the previous one, so waiting on OpenAI costs nothing
+and regex scans or keyword counting show up as they are; "wall" counts
+every sample as one interval.
+
+GET /admin/profile returns the aggregate in the collapsed-stack format
+("stage;frame;frame... microseconds" per line) read by flamegraph.pl,
+speedscope and inferno, or the heaviest functions with ?format=top.
+With the rate at 0 (default) a request pays one comparison.
+"""
+import gc
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Optional
+
+from config import PROFILE_INTERVAL_MS, PROFILE_MODE, PROFILE_SAMPLE_RATE
+
+MAX_DEPTH = 128
+
+# generator / coroutine / async generator code flags
+_SUSPENDABLE = 0x20 | 0x80 | 0x100 | 0x200
+
+# innermost Python frames of an event loop waiting for I/O (asyncio, uvloop); not work, skipped
+_IDLE_LEAVES = {"run (runners.py)", "select (selectors.py)", "run_forever (base_events.py)",
+                "run_until_complete (base_events.py)"}
+
+# set by ProfileMiddleware for the requests picked for profiling
+_SAMPLED: ContextVar[bool] = ContextVar("profiled", default=False)
+
+
+def _frame_name(code) -> str:
+    return f"{code.co_name} ({os.path.basename(code.co_filename)})"
+
+
+def _current_frames() -> Dict[int, object]:
+    """sys._current_frames with the collector paused: a collection started inside it,
+    while it holds the thread list lock, can deadlock the process (CPython gh-106883)."""
+    if not gc.isenabled():
+        return sys._current_frames()
+    gc.disable()
+    try:
+        return sys._current_frames()
+    finally:
+        gc.enable()
+
+
+def _thread_clock(thread_id: int) -> Optional[int]:
+    """CPU clock of another thread (Linux and most Unixes), or None where unsupported."""
+    try:
+        return time.pthread_getcpuclockid(thread_id)
+    except (AttributeError, OSError):
+        return None
+
+
+class _Target:
+    """A thread being sampled: how many profiled requests hold it, and its root label."""
+
+    def __init__(self, root: Callable[[], str], mode: str, thread_id: int, coroutines: bool):
+        self.holders = 0
+        self.root = root
+        self.coroutines = coroutines   # runs coroutines: stop the walk at the first one
+        self.clock = _thread_clock(thread_id) if mode == "cpu" else None
+        self.last_cpu = time.clock_gettime(self.clock) if self.clock is not None else 0.0
+
+
+class Profiler:
+    def __init__(self, rate: float = PROFILE_SAMPLE_RATE, interval_ms: float = PROFILE_INTERVAL_MS,
+                 mode: str = PROFILE_MODE):
+        self.rate = rate
+        self.interval = max(0.001, interval_ms / 1000.0)
+        self.mode = mode if mode in ("cpu", "wall") else "cpu"
+        self.stacks: Counter = Counter()    # folded stack -> microseconds
+        self.requests = 0
+        self.samples = 0
+        self.started = time.time()
+        self._targets: Dict[int, _Target] = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def sample(self) -> bool:
+        """Whether to profile this request."""
+        return self.rate > 0 and random.random() < self.rate
+
+    @contextmanager
+    def track(self, root: Callable[[], str], coroutines: bool = False):
+        """Sample the calling thread, under root(), until the block ends."""
+        thread_id = threading.get_ident()
+        with self._lock:
+            target = self._targets.get(thread_id)
+            if target is None:
+                target = self._targets[thread_id] = _Target(root, self.mode, thread_id, coroutines)
+            target.holders += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+                self._thread.start()
+            self._wake.set()
+        try:
+            yield
+        finally:
+            with self._lock:
+                target.holders -= 1
+                if target.holders == 0:
+                    del self._targets[thread_id]
+
+    @contextmanager
+    def request(self, stage: Callable[[], Optional[str]]):
+        """In the thread answering a request: profile it if ProfileMiddleware picked it."""
+        if not _SAMPLED.get():
+            yield
+            return
+        with self._lock:
+            self.requests += 1
+        with self.track(lambda: stage() or "pipeline"):
+            yield
+
+    def _run(self) -> None:
+        while True:
+            self._wake.wait()
+            time.sleep(self.interval)
+            with self._lock:
+                targets = list(self._targets.items())
+                if not targets:
+                    self._wake.clear()
+                    continue
+            frames = _current_frames()
+            for thread_id, target in targets:
+                frame = frames.get(thread_id)
+                if frame is None:
+                    continue
+                if target.clock is not None:
+                    now = time.clock_gettime(target.clock)
+                    weight, target.last_cpu = int((now - target.last_cpu) * 1e6), now
+                    if weight <= 0:
+                        continue
+                else:
+                    weight = int(self.interval * 1e6)
+                stack: List[str] = []
+                while frame is not None and len(stack) < MAX_DEPTH:
+                    code = frame.f_code
+                    stack.append(_frame_name(code))
+                    if target.coroutines and code.co_flags & _SUSPENDABLE:
+                        break
+                    frame = frame.f_back
+                if stack[0] in _IDLE_LEAVES:
+                    continue
+                stack.append(target.root())
+                key = ";".join(reversed(stack))
+                with self._lock:
+                    self.stacks[key] += weight
+                    self.samples += 1
+
+    def reset(self) -> None:
+        with self._lock:
+            self.stacks.clear()
+            self.requests = self.samples = 0
+            self.started = time.time()
+
+    def folded(self) -> str:
+        with self._lock:
+            return "".join(f"{stack} {us}\n" for stack, us in sorted(self.stacks.items()))
+
+    def top(self, n: int = 30) -> Dict:
+        """Heaviest functions: self time (leaf of the stack) and total time (anywhere in it), in ms."""
+        own, total = Counter(), Counter()
+        with self._lock:
+            stacks = list(self.stacks.items())
+            summary = {"mode": self.mode, "rate": self.rate, "interval_ms": self.interval * 1000.0,
+                       "requests": self.requests, "samples": self.samples,
+                       "seconds": round(time.time() - self.started, 1)}
+        for stack, us in stacks:
+            frames = stack.split(";")
+            own[frames[-1]] += us
+            for name in set(frames[1:]):
+                total[name] += us
+        summary["functions"] = [{"function": name, "self_ms": round(us / 1000.0, 1),
+                                 "total_ms": round(total[name] / 1000.0, 1)}
+                                for name, us in own.most_common(n)]
+        return summary
+
+
+PROFILER = Profiler()
+
+
+class ProfileMiddleware:
+    """ASGI middleware picking a `rate` share of requests to `paths` for profiling."""
+
+    def __init__(self, app, profiler: Profiler = PROFILER, paths=("/chat",)):
+        self.app = app
+        self.profiler = profiler
+        self.paths = tuple(paths)
+
+    async def __call__(self, scope, receive, send):
+        if not self.profiler.rate or scope["type"] != "http" or scope["path"] not in self.paths \
+                or not self.profiler.sample():
+            await self.app(scope, receive, send)
+            return
+        token = _SAMPLED.set(True)
+        try:
+            with self.profiler.track(lambda: "event_loop", coroutines=True):
+                await self.app(scope, receive, send)
+        finally:
+            _SAMPLED.reset(token)
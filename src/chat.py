@@ -3,17 +3,21 @@ import sys
 import time
 import re
 import threading
+import contextvars
 from pathlib import Path
-from openai import OpenAI
 from dotenv import load_dotenv
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FuturesTimeout
 
 ROOT = Path(__file__).resolve().parent.parent
 if ROOT not in sys.path:
     sys.path.insert(0, str(ROOT))
 
-from utils import read_pdf_text, chunk_by_tokens
-from config import DATA, CHAT_MODEL, EMBED_MODEL
+from utils import read_pdfs, chunk_texts
+from config import CHAT_MODEL, EMBED_MODEL, corpus_pdfs
+from openai_replay import make_client
+import budget
+import deadline
+import metrics
 try:
     from .greetings import is_small_talk, get_smalltalk_response
 except ImportError:
@@ -22,6 +26,7 @@ except ImportError:
 FALLBACK        = "Munyihanganire, nta makuru mfite kuri iyi ngingo."
 RETRY_ATTEMPTS  = 5
 RETRY_BASE_WAIT = 2.0
+BATCH_OVERHEAD_TOKENS = 600   # system prompt, question and answer, on top of the chunks
 
 # ------------------------------------------------------------------
 # PDF loading
@@ -33,35 +38,31 @@ def load_pdf_chunks():
     if _cached_chunks is not None:
         return _cached_chunks
 
-    pdf_files = [
-        DATA / "imirire.pdf",
-        DATA / "tubiteho.pdf",
-        DATA / "BROCHURE_IMBONEZAMIKURIRE_Y_ABANA_BATO (1).pdf",
-        DATA / "6.1 First aid PG DRAFT 5 (V14.10.22) Kinyarwanda.pdf",
-        DATA / "all.pdf",
-        DATA / "3.1 Play PG DRAFT 5 (V14.10.22) Kinyarwanda.pdf",
-        DATA / "3.2 Play BR DRAFT 4 (V26.04.22) Kinyarwanda.pdf",
-        DATA / "4.1 Prenatal newborn postnatal care PG DRAFT 5 (V14.10.22) Kinyarwanda.pdf",
-        DATA / "4.2 Prenatal newborn postnatal care BR DRAFT 5 (V14.10.22) Kinyarwanda.pdf",
-    ]
+    pdf_files = corpus_pdfs()
 
     all_chunks = []
     print("📚 Loading PDFs and preparing skills data...")
+    present = []
     for pdf_path in pdf_files:
         if not pdf_path.exists():
             print(f"⚠  {pdf_path} not found, skipping...")
             continue
-        pages = read_pdf_text(str(pdf_path))
-        for page_no, txt in pages:
-            if not txt.strip():
-                continue
-            for ch in chunk_by_tokens(txt, chunk_size=900, overlap=200):
-                if ch.strip():
-                    all_chunks.append({
-                        "source": pdf_path.name,
-                        "page":   page_no,
-                        "text":   ch,
-                    })
+        present.append(pdf_path)
+
+    extracted = read_pdfs([str(p) for p in present])
+    for pdf_path in present:
+        pages = [(page_no, txt) for page_no, txt in extracted[str(pdf_path)] if txt.strip()]
+        # 900 / 200 token windows on sentence boundaries (this pipeline's own sizes, not the
+        # index's CHUNK_SIZE / OVERLAP), one tokenizer batch per PDF
+        for (page_no, _), chunks in zip(pages, chunk_texts([txt for _, txt in pages],
+                                                            chunk_size=900, overlap=200)):
+            for ch, tokens in chunks:
+                all_chunks.append({
+                    "source": pdf_path.name,
+                    "page":   page_no,
+                    "text":   ch,
+                    "tokens": tokens,
+                })
 
     print(f"✅ Loaded {len(all_chunks)} chunks from PDFs.\n")
     _cached_chunks = all_chunks
@@ -132,10 +133,17 @@ def _call_batch(batch_chunks, question, client, stop_event):
             )
             text = resp.choices[0].message.content.strip()
             return text if text != FALLBACK else ""
+        except (budget.BudgetExceeded, deadline.DeadlineExceeded):
+            stop_event.set()
+            return ""
         except Exception as e:
             err = str(e)
             if "429" in err or "rate_limit" in err.lower():
                 wait_for = _parse_retry_after(err) or wait
+                left = deadline.remaining()
+                if left is not None and wait_for >= left:
+                    return ""   # the retry could not come back before the deadline
+                metrics.OPENAI_RETRIES.inc(endpoint="chat")
                 ##print(f"  ⏳ Rate limit {wait_for:.1f}s "
                       ##f"(attempt {attempt+1}/{RETRY_ATTEMPTS})")
                 time.sleep(wait_for)
@@ -150,28 +158,72 @@ def _call_batch(batch_chunks, question, client, stop_event):
 # Orchestrator — send all chunks, collect first good answer
 # ------------------------------------------------------------------
 
+def _ranked(chunks, question):
+    """(words of the question found in the chunk, chunk), most words first."""
+    words = {w for w in re.findall(r"\w+", question.lower()) if len(w) > 3}
+    scored = [(sum(1 for w in words if w in c["text"].lower()), c) for c in chunks]
+    return sorted(scored, key=lambda sc: sc[0], reverse=True)
+
+
+def _affordable(chunks, question, batch_size):
+    """
+    The chunks the request's token budget covers: all of them without a
+    cap, else those sharing the most words with the question, in batches
+    of batch_size, until the planned tokens would pass what is left.
+    """
+    remaining = budget.remaining()
+    if remaining is None:
+        return chunks
+    picked, planned = [], 0
+    for _, c in _ranked(chunks, question):
+        cost = c.get("tokens", 0) + (BATCH_OVERHEAD_TOKENS if len(picked) % batch_size == 0 else 0)
+        if planned + cost > remaining:
+            break
+        picked.append(c)
+        planned += cost
+    return picked
+
+
 def ask_openai(chunks, question, client):
     BATCH = 35
-    batches = [chunks[i:i+BATCH] for i in range(0, len(chunks), BATCH)]
+    affordable = _affordable(chunks, question, BATCH)
+    batches = [affordable[i:i+BATCH] for i in range(0, len(affordable), BATCH)]
     ##print(f"  📄 {len(chunks)} chunks | {len(batches)} batches")
 
     answers    = []
+    wanted     = 1 if budget.cheap() else 2
     stop_event = threading.Event()
 
-    with ThreadPoolExecutor(max_workers=4) as executor:
+    executor = ThreadPoolExecutor(max_workers=4)
+    try:
+        # each batch runs in the request's context, so its calls count towards its trace, budget and deadline
         futures = {
-            executor.submit(_call_batch, b, question, client, stop_event): i
+            executor.submit(contextvars.copy_context().run, _call_batch, b, question, client, stop_event): i
             for i, b in enumerate(batches)
         }
-        for future in as_completed(futures):
+        for future in as_completed(futures, timeout=deadline.remaining()):
             result = future.result()
             if result:
                 answers.append(result)
-                if len(answers) >= 2:
-                    stop_event.set()
+                if len(answers) >= wanted:
                     break
+    except FuturesTimeout:
+        pass   # deadline passed: answer with what came back
+    finally:
+        # batches still in flight end at their next check, their calls at the deadline
+        stop_event.set()
+        executor.shutdown(wait=False, cancel_futures=True)
 
-    return max(answers, key=len) if answers else FALLBACK
+    if answers:
+        return max(answers, key=len)
+    best = [c for n, c in _ranked(chunks, question)[:1] if n]
+    spend = budget.current()
+    if spend is not None and (spend.exceeded or (chunks and not affordable)):
+        return deadline.best_effort(question, best, FALLBACK, reason="budget")
+    left = deadline.remaining()
+    if left is not None and left < deadline.MIN_CALL_SECONDS:
+        return deadline.best_effort(question, best, FALLBACK)
+    return FALLBACK
 
 
 # ------------------------------------------------------------------
@@ -181,17 +233,24 @@ def ask_openai(chunks, question, client):
 def get_response(question: str):
     load_dotenv()
     api_key = os.getenv("OPENAI_API_KEY")
-    client  = OpenAI(api_key=api_key) if api_key else OpenAI()
-    if is_small_talk(question):
-        return get_smalltalk_response(question, client)
+    client  = make_client(api_key)
+    with metrics.stage("smalltalk"):
+        small = is_small_talk(question)
+    if small:
+        return get_smalltalk_response(question, client)   # counts its own route
     chunks = load_pdf_chunks()
-    return ask_openai(chunks, question, client)
+    with metrics.stage("answer"):
+        answer = ask_openai(chunks, question, client)
+    trace = metrics.current_trace()
+    if trace is None or trace.route is None:   # else deadline.best_effort counted it
+        metrics.route("out_of_scope" if answer == FALLBACK else "pdf")
+    return answer
 
 
 def main():
     load_dotenv()
     api_key = os.getenv("OPENAI_API_KEY")
-    client  = OpenAI(api_key=api_key) if api_key else OpenAI()
+    client  = make_client(api_key)
     chunks  = load_pdf_chunks()
 
     print("Andika ikibazo cyawe (Ctrl+C gusohoka):")
@@ -2,7 +2,7 @@
 import os, json, sys, re
 import faiss
 import numpy as np
-from typing import List, Dict
+from typing import List, Dict, Sequence
 from dotenv import load_dotenv
 from openai import OpenAI
 
@@ -12,23 +12,30 @@ if ROOT not in sys.path:
     sys.path.insert(0, ROOT)
 
 from config import (
-    FAISS_PATH, META_PATH, SYN_PATH,
+    META_PATH, SYN_PATH,
     EMBED_MODEL, CHAT_MODEL,
-    TOP_K, SCORE_THRESHOLD,
+    TOP_K, SCORE_THRESHOLD, INDEX_MMAP,
 )
 
+import budget
+import deadline
+import metrics
+from chunk_store import load_rows, term_counts
+from embeddings import embed_one
+from index_store import embedding_settings, load_index, read_manifest
+from openai_replay import make_client
+from index_reload import IndexHolder, ServedIndex
+from index_version import IndexVersion
 from src.greetingsr import handle_smalltalk
 
 FALLBACK = "ntamakuru ndagira kuri iyi ngingo"
 
 # --------------- I/O helpers ---------------
 
-def load_meta(meta_path: str) -> List[Dict]:
-    rows = []
-    with open(meta_path, "r", encoding="utf-8") as f:
-        for line in f:
-            rows.append(json.loads(line))
-    return rows
+def load_meta(meta_path: str) -> Sequence[Dict]:
+    # chunks.bin is read in one call (or mmapped and shared by all workers with
+    # INDEX_MMAP); rows are decoded on access. meta.jsonl is the pre-store format.
+    return load_rows(meta_path, bool(INDEX_MMAP))
 
 
 def load_synonyms(path: str) -> Dict[str, List[str]]:
@@ -93,14 +100,14 @@ def expand_query_with_synonyms(q: str, syn: Dict[str, List[str]]) -> str:
 
 # --------------- Embedding & retrieval ---------------
 
-def embed_query(client: OpenAI, text: str) -> np.ndarray:
-    emb = client.embeddings.create(model=EMBED_MODEL, input=[text]).data[0].embedding
-    x = np.array(emb, dtype="float32")
+def embed_query(client: OpenAI, text: str, model: str = EMBED_MODEL, dims: int = 0) -> np.ndarray:
+    # must be the model and dimensions the index was built with (see _load_version)
+    x = embed_one(client, text, model, dims)
     faiss.normalize_L2(x.reshape(1, -1))
     return x
 
 
-def _keyword_candidates(meta_rows: List[Dict], query: str, syn: Dict[str, List[str]], topn: int = 5):
+def _keyword_candidates(meta_rows: Sequence[Dict], query: str, syn: Dict[str, List[str]], topn: int = 5):
     """
     Lightweight keyword fallback: rank chunks by query term frequency.
     """
@@ -124,37 +131,50 @@ def _keyword_candidates(meta_rows: List[Dict], query: str, syn: Dict[str, List[s
     if not vocab:
         return []
 
-    scored = []
-    for row in meta_rows:
-        text = str(row.get("text", "")).lower()
-        score = sum(text.count(term) for term in vocab)
-        if score > 0:
-            scored.append((score, row))
-    scored.sort(key=lambda x: x[0], reverse=True)
-    return [r for _, r in scored[:topn]]
+    # scores over the text column; full rows are built for the top hits only
+    scores = term_counts(meta_rows, vocab)
+    best = np.argsort(-scores, kind="stable")[:topn]
+    return [meta_rows[int(i)] for i in best if scores[i] > 0]
 
 
-def retrieve(client: OpenAI, index, meta_rows: List[Dict], question: str, syn: Dict[str, List[str]]):
-    base_q = _clean_kiny_query(question)
-    qx = expand_query_with_synonyms(base_q, syn)
-    qvec = embed_query(client, qx)
+def retrieve(client: OpenAI, index, meta_rows: Sequence[Dict], question: str, syn: Dict[str, List[str]],
+             embed_model: str = EMBED_MODEL, embed_dims: int = 0):
+    """
+    Top chunks for `question` and their scores. Each step is a
+    metrics.stage (clean, expand, embed, search, filter, plus keyword when
+    the fallback runs).
+    """
+    with metrics.stage("clean"):
+        base_q = _clean_kiny_query(question)
+    with metrics.stage("expand"):
+        qx = expand_query_with_synonyms(base_q, syn)
+    with metrics.stage("embed"):
+        qvec = embed_query(client, qx, embed_model, embed_dims)
+    if qvec.shape[0] != index.d:
+        raise RuntimeError(
+            f"Query embedding has {qvec.shape[0]} dims but the index has {index.d}. "
+            "Rebuild the index with the current EMBED_MODEL / EMBED_DIMS."
+        )
 
-    scores, idxs = index.search(qvec.reshape(1, -1), TOP_K)
+    with metrics.stage("search"):
+        scores, idxs = index.search(qvec.reshape(1, -1), TOP_K)
     scores = scores[0].tolist()
     idxs = idxs[0].tolist()
 
-    pairs = []
-    for score, i in zip(scores, idxs):
-        if i == -1:
-            continue
-        pairs.append((score, meta_rows[i]))
+    with metrics.stage("filter"):
+        pairs = []
+        for score, i in zip(scores, idxs):
+            if i == -1:
+                continue
+            pairs.append((score, meta_rows[i]))
 
-    # Filter by threshold
-    good = [m for (s, m) in pairs if s >= SCORE_THRESHOLD]
+        # Filter by threshold
+        good = [m for (s, m) in pairs if s >= SCORE_THRESHOLD]
 
     # Fallback: keyword search if nothing passed threshold
     if not good:
-        kw = _keyword_candidates(meta_rows, question, syn, topn=5)
+        with metrics.stage("keyword"):
+            kw = _keyword_candidates(meta_rows, question, syn, topn=5)
         if kw:
             good = kw[:3]
 
@@ -261,6 +281,8 @@ def is_parenting_related(client: OpenAI, question: str) -> bool:
         )
         answer = resp.choices[0].message.content.strip().upper()
         return "YES" in answer
+    except (budget.BudgetExceeded, deadline.DeadlineExceeded):
+        raise
     except Exception:
         return False
 
@@ -363,31 +385,38 @@ def ask_llm_general(client: OpenAI, question: str) -> str:
 
 # --------------- Init & public API ---------------
 
-_INDEX = None
-_META_ROWS = None
 _SYNONYMS = None
 _CLIENT = None
 
 
-def ensure_index_loaded(path: str):
-    if not os.path.exists(path):
-        raise SystemExit(f"FAISS index not found at {path}. Run build_index.py first.")
-    return faiss.read_index(path)
+def ensure_index_loaded(files: IndexVersion):
+    if not os.path.exists(files.faiss_path):
+        raise SystemExit(f"FAISS index not found at {files.faiss_path}. Run build_index.py first.")
+    return load_index(files.faiss_path, files.manifest_path)
+
+
+def _load_version(files: IndexVersion) -> ServedIndex:
+    # everything comes from one resolved version, even if a build publishes meanwhile
+    index = ensure_index_loaded(files)
+    embed_model, embed_dims = embedding_settings(read_manifest(files.manifest_path))
+    rows = load_meta(files.chunks_path if os.path.exists(files.chunks_path) else META_PATH)
+    return ServedIndex(files.version, index, rows, embed_model, embed_dims)
+
+
+# live index version; main.py reloads it when a new one is published
+INDEX = IndexHolder(_load_version)
 
 
 def _init_once():
     """Lazy init: load once."""
-    global _INDEX, _META_ROWS, _SYNONYMS, _CLIENT
+    global _SYNONYMS, _CLIENT
 
     if _CLIENT is None:
         load_dotenv()
         api_key = os.getenv("OPENAI_API_KEY")
-        _CLIENT = OpenAI(api_key=api_key) if api_key else OpenAI()
+        _CLIENT = make_client(api_key)
 
-    if _INDEX is None:
-        _INDEX = ensure_index_loaded(FAISS_PATH)
-    if _META_ROWS is None:
-        _META_ROWS = load_meta(META_PATH)
+    INDEX.get()
     if _SYNONYMS is None:
         _SYNONYMS = load_synonyms(SYN_PATH)
 
@@ -406,29 +435,62 @@ def get_response(question: str) -> str:
 
     # Check for small talk first (greetings, emotions, daily life conversation)
     # AI-powered: uses OpenAI to intelligently detect and respond naturally
-    small = handle_smalltalk(_CLIENT, question)
+    with metrics.stage("smalltalk"):
+        small = handle_smalltalk(_CLIENT, question)
     if small is not None:
+        metrics.route("smalltalk")
         return small
 
+    # this request stays on this index version even if a reload swaps it meanwhile
+    served = INDEX.get()
+    metrics.served(served.version)
+    found = []   # chunks retrieved so far, for deadline.best_effort
+    try:
+        return _answer(question, served, found)
+    except deadline.DeadlineExceeded:
+        # out of time (CHAT_DEADLINE_SECONDS): cached answer, PDF extract or FALLBACK
+        return deadline.best_effort(question, found, FALLBACK, served.version)
+    except budget.BudgetExceeded as e:
+        if e.limit != "request":
+            raise
+        # the question used its token cap: the same, instead of nothing for the tokens spent
+        return deadline.best_effort(question, found, FALLBACK, served.version, reason="budget")
+
+
+def _answer(question: str, served: ServedIndex, found: List[Dict]) -> str:
+    """Steps 2-4 of get_response; the retrieved chunks are also put in `found`."""
     # Try to retrieve relevant chunks from PDFs
-    chunks, scores = retrieve(_CLIENT, _INDEX, _META_ROWS, question, _SYNONYMS)
+    chunks, scores = retrieve(_CLIENT, served.index, served.rows, question, _SYNONYMS,
+                              served.embed_model, served.embed_dims)
+    metrics.retrieved(chunks, scores)
+    found.extend(chunks)
     
     # If we found relevant chunks in PDFs, try to get answer from them
     pdf_answer = None
     if chunks and len(chunks) > 0:
         context = format_context(chunks)
-        pdf_answer = ask_llm_with_context(_CLIENT, context, question)
+        with metrics.stage("answer"):
+            pdf_answer = ask_llm_with_context(_CLIENT, context, question)
         
         # If the LLM found a real answer in the context (not the fallback message)
         if pdf_answer and pdf_answer != FALLBACK and len(pdf_answer) > 20:
+            metrics.route("pdf")
             return pdf_answer
     
     # No good answer found in PDFs - check if question is parenting-related
-    if is_parenting_related(_CLIENT, question):
+    # (not in the cheap mode of a client near its daily token budget: no general answer then)
+    related = False
+    if not budget.cheap():
+        with metrics.stage("classifier"):
+            related = is_parenting_related(_CLIENT, question)
+    if related:
         # Question is about parenting (0-6 years), pregnancy, breastfeeding, or first aid - use OpenAI general knowledge
-        return ask_llm_general(_CLIENT, question)
+        metrics.route("general")
+        with metrics.stage("general"):
+            return ask_llm_general(_CLIENT, question)
     else:
         # Question is NOT about parenting - inform user
+        metrics.route("out_of_scope")
         return "Mbabarira, nta makuru mfite kuri iyi ngingo. Nshobora gufasha kubijanye n'uburere bw'abana bafite imyaka 0-6, inda, konsa, n'ubufasha bw'ibanze gusa."
 
 
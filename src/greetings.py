@@ -11,6 +11,8 @@ inappropriate messages before any conversational reply is generated.
 import re
 from openai import OpenAI
 
+import metrics
+
 # ============================================================
 # LAYER 1: Harmful content — fast regex block
 # ============================================================
@@ -688,11 +690,12 @@ def get_smalltalk_response(question: str, client: OpenAI) -> str:
       4. Canned fallback if the API call fails
     """
     # --- Harmful content gate ---
-    if is_harmful(question):
-        return FALLBACK
-
-    if is_harmful_llm(question, client):
+    with metrics.stage("moderation"):
+        blocked = is_harmful(question) or is_harmful_llm(question, client)
+    if blocked:
+        metrics.route("blocked")
         return FALLBACK
+    metrics.route("smalltalk")
 
     # --- Bio / identity check (precise, no LLM needed) ---
     bio_reply = get_bio_response(question)
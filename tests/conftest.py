@@ -0,0 +1,92 @@
+import os
+import sys
+
+# the modules under test live at the repository root
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+import subprocess
+from types import SimpleNamespace
+
+import pytest
+
+DATA = os.path.join(ROOT, "data")
+SMALL_PDF = os.path.join(DATA, "BROCHURE_IMBONEZAMIKURIRE_Y_ABANA_BATO (1).pdf")   # 3 pages
+OTHER_PDF = os.path.join(DATA, "6.2 First aid BR DRAFT 5 (V14.10.22) Kinyarwanda.pdf")
+
+
+@pytest.fixture
+def build_env(tmp_path, monkeypatch):
+    """
+    An offline corpus in tmp_path for builds run as child processes
+    (python build_index.py, python ingest.py): the small brochure as
+    PDF_PATHS, every output under tmp_path, and replayed OpenAI calls that
+    synthesize embeddings. `run(*args)` runs build_index.py with it.
+    """
+    if not os.path.exists(SMALL_PDF):
+        pytest.skip("needs the guides in data/")
+    try:
+        import tiktoken
+        tiktoken.get_encoding("cl100k_base")
+    except Exception as e:   # the encoding is downloaded on first use
+        pytest.skip(f"cl100k_base encoding not available: {e}")
+
+    paths = SimpleNamespace(
+        docs_dir=str(tmp_path / "documents"), index_dir=str(tmp_path / "index"),
+        build_manifest=str(tmp_path / "build_manifest.json"),
+    )
+    env = {
+        "PDF_PATHS": SMALL_PDF, "DOCS_DIR": paths.docs_dir, "INDEX_DIR": paths.index_dir,
+        "BUILD_MANIFEST_PATH": paths.build_manifest, "BUILD_WORK_DIR": str(tmp_path / "build_tmp"),
+        "FAISS_PATH": str(tmp_path / "index.faiss"), "CHUNKS_PATH": str(tmp_path / "chunks.bin"),
+        "MANIFEST_PATH": str(tmp_path / "manifest.json"), "VECTORS_PATH": str(tmp_path / "vectors.npy"),
+        "META_PATH": str(tmp_path / "meta.jsonl"), "EMBED_CACHE_PATH": "",
+        "OPENAI_MODE": "replay", "OPENAI_REPLAY_MISS": "synthesize",
+        "OPENAI_RECORDINGS_PATH": str(tmp_path / "recordings.sqlite"), "OPENAI_API_KEY": "offline",
+        "EMBED_DIMS": "64", "PDF_WORKERS": "1",
+    }
+    for key, value in env.items():
+        monkeypatch.setenv(key, value)
+
+    def run(*args):
+        return subprocess.run([sys.executable, os.path.join(ROOT, "build_index.py"), *args],
+                              cwd=ROOT, capture_output=True, text=True)
+
+    paths.run = run
+    return paths
+
+
+@pytest.fixture
+def byte_encoder(monkeypatch):
+    """utils.get_encoder as a byte-level encoding (one token per byte), so chunking needs no BPE download."""
+    import tiktoken
+    import utils
+
+    pattern = r"""'(?i:[sdmt]|ll|ve|re)|[^\r\n\p{L}\p{N}]?+\p{L}+|\p{N}{1,3}| ?[^\s\p{L}\p{N}]++[\r\n]*|\s*[\r\n]|\s+(?!\S)|\s+"""
+    enc = tiktoken.Encoding("bytes", pat_str=pattern, mergeable_ranks={bytes([i]): i for i in range(256)},
+                            special_tokens={})
+    monkeypatch.setattr(utils, "get_encoder", lambda encoding_name=None: enc)
+    return enc
+
+
+class Clock:
+    """Stands in for a module's `time`: sleep() moves monotonic() on instead of waiting."""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = []
+
+    def monotonic(self):
+        return self.now
+
+    time = perf_counter = monotonic
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock():
+    return Clock()
@@ -0,0 +1,101 @@
+"""Per-client daily budgets (cheap mode, refusal), the per-request cap and the completion it leaves."""
+from types import SimpleNamespace
+
+import pytest
+
+import budget
+from budget import BudgetExceeded, Ledger, RequestBudget
+from openai_replay import CountingClient, Usage
+
+
+@pytest.fixture
+def ledger(monkeypatch):
+    """An in-memory ledger, with a 1000-token daily budget per client (cheap from 800, capped at 100)."""
+    monkeypatch.setattr(budget, "BUDGET_CLIENT_DAILY_TOKENS", 1000)
+    monkeypatch.setattr(budget, "BUDGET_CHEAP_AT", 0.8)
+    monkeypatch.setattr(budget, "BUDGET_CHEAP_REQUEST_TOKENS", 100)
+    monkeypatch.setattr(budget, "BUDGET_REQUEST_TOKENS", 0)
+    return Ledger("")
+
+
+class Chat:
+    """chat.completions.create that records its arguments and uses 10 + 5 tokens."""
+
+    def __init__(self):
+        self.calls = []
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, **kwargs):
+        self.calls.append(kwargs)
+        return SimpleNamespace(usage=SimpleNamespace(prompt_tokens=10, completion_tokens=5))
+
+
+def _ask(client, **kwargs):
+    return client.chat.completions.create(model="gpt-4o-mini", messages=[{"role": "user", "content": "Muraho"}],
+                                          **kwargs)
+
+
+def test_modes_follow_the_days_spending(ledger):
+    with budget.request("a", ledger) as spend:
+        assert (spend.mode, spend.cap, budget.cheap()) == ("full", 1000, False)   # capped at what is left
+        spend.charge("chat", "gpt-4o-mini", SimpleNamespace(prompt_tokens=700, completion_tokens=150))
+    assert budget.current() is None
+    assert ledger.spent("a") == 850 and ledger.report()[0]["requests"] == 1
+
+    with budget.request("a", ledger) as spend:
+        assert (spend.mode, spend.cap, budget.cheap()) == ("cheap", 100, True)
+        assert budget.remaining() == 100
+        spend.charge("chat", "gpt-4o-mini", SimpleNamespace(prompt_tokens=100, completion_tokens=50))
+
+    with pytest.raises(BudgetExceeded) as refused:
+        with budget.request("a", ledger):
+            pass
+    assert refused.value.limit == "client"
+    with budget.request("b", ledger) as spend:   # other clients are not affected
+        assert spend.mode == "full"
+
+
+def test_no_limits_means_no_cap(ledger, monkeypatch):
+    monkeypatch.setattr(budget, "BUDGET_CLIENT_DAILY_TOKENS", 0)
+    with budget.request("a", ledger) as spend:
+        assert spend.cap == 0 and spend.check(10 ** 9) is None and budget.remaining() is None
+
+
+def test_check_leaves_the_rest_of_the_cap(ledger):
+    spend = RequestBudget("a", "full", 100, ledger)
+    assert spend.check(30) == 70
+    spend.charge("chat", "gpt-4o-mini", SimpleNamespace(prompt_tokens=60, completion_tokens=20))
+    assert spend.remaining() == 20
+    with pytest.raises(BudgetExceeded) as over:
+        spend.check(25)   # the prompt alone would pass the cap
+    assert over.value.limit == "request" and spend.exceeded == "request"
+
+
+def test_completions_are_capped_by_the_budget(ledger, monkeypatch):
+    monkeypatch.setattr(budget, "BUDGET_CLIENT_DAILY_TOKENS", 0)
+    inner = Chat()
+    client = CountingClient(inner, Usage())
+
+    _ask(client)   # outside a request: untouched
+    with budget.request("a", ledger) as spend:
+        spend.cap = 200
+        _ask(client)
+        _ask(client, max_tokens=50)
+        spend.cap = 10 ** 6
+        _ask(client)   # past CAP_COMPLETION_BELOW the model keeps its own limit
+        assert spend.tokens == 3 * 15
+    limits = [call.get("max_tokens") for call in inner.calls]
+    assert limits[0] is None
+    assert 0 < limits[1] < 200 and limits[2] == 50 and limits[3] is None
+
+
+def test_a_call_past_the_cap_is_not_sent(ledger, monkeypatch):
+    monkeypatch.setattr(budget, "BUDGET_CLIENT_DAILY_TOKENS", 0)
+    monkeypatch.setattr(budget, "BUDGET_REQUEST_TOKENS", 16)
+    inner = Chat()
+    client = CountingClient(inner, Usage())
+    with budget.request("a", ledger) as spend:
+        _ask(client)
+        with pytest.raises(BudgetExceeded):
+            _ask(client)
+    assert len(inner.calls) == 1 and spend.exceeded == "request"
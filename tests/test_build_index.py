@@ -0,0 +1,59 @@
+"""Incremental builds: only what changed in the corpus is read, embedded and upserted."""
+import os
+
+import numpy as np
+
+from build_manifest import all_ids, page_ids, read_build_manifest
+from chunk_index import ChunkIndex
+from conftest import OTHER_PDF, SMALL_PDF
+from index_version import current_version
+
+
+def _built(build_env, *args):
+    done = build_env.run(*args)
+    assert done.returncode == 0, done.stderr
+    return done.stdout
+
+
+def _vectors(ci, ids):
+    return np.asarray(ci.vectors[ci.find(ids)])
+
+
+def test_unchanged_corpus_publishes_nothing(build_env):
+    assert "Full build" in _built(build_env)
+    version = current_version(build_env.index_dir)
+
+    assert "Index is up to date" in _built(build_env)
+    assert current_version(build_env.index_dir) == version
+
+
+def test_added_and_removed_pdfs_touch_only_their_chunks(build_env, monkeypatch):
+    _built(build_env)
+    first = read_build_manifest(build_env.build_manifest)
+    small = os.path.basename(SMALL_PDF)
+    small_ids = page_ids(first["files"][small])
+    before = _vectors(ChunkIndex.open(build_env.index_dir), small_ids)
+
+    monkeypatch.setenv("PDF_PATHS", os.pathsep.join([SMALL_PDF, OTHER_PDF]))
+    out = _built(build_env)
+    assert "Incremental build" in out and "Reading 1 PDF(s)" in out
+    state = read_build_manifest(build_env.build_manifest)
+    assert state["files"][small] == first["files"][small]   # not re-read, same ids
+    ci = ChunkIndex.open(build_env.index_dir)
+    assert ci.ids.tolist() == sorted(all_ids(state))
+    assert np.array_equal(_vectors(ci, small_ids), before)   # and the same vectors
+
+    monkeypatch.setenv("PDF_PATHS", OTHER_PDF)
+    assert "Incremental build" in _built(build_env)
+    state = read_build_manifest(build_env.build_manifest)
+    assert list(state["files"]) == [os.path.basename(OTHER_PDF)]
+    ci = ChunkIndex.open(build_env.index_dir)
+    assert ci.ids.tolist() == sorted(all_ids(state))
+    assert not (ci.find(small_ids) >= 0).any()
+
+
+def test_settings_change_forces_a_full_build(build_env, monkeypatch):
+    _built(build_env)
+    monkeypatch.setenv("EMBED_DIMS", "32")
+    assert "Full build" in _built(build_env)
+    assert ChunkIndex.open(build_env.index_dir).vectors.shape[1] == 32
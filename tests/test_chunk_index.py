@@ -0,0 +1,103 @@
+"""
+Chunk ids are FAISS ids in every published index: they must not change
+between releases. ChunkIndex.apply / delete / compaction on a small
+in-memory index, and the round trip through save().
+"""
+import numpy as np
+import pytest
+
+from chunk_index import ChunkIndex, chunk_id
+from index_store import build_ann_index, default_params
+
+
+def test_chunk_id_is_stable():
+    # values published indexes were built with; a different hash orphans every stored id
+    assert chunk_id("imirire.pdf", 3, 0) == 6742253486370092888
+    assert chunk_id("data/documents/guide.pdf", 12, 4) == 3326551493301037741
+
+
+def test_chunk_id_range_and_spread():
+    ids = {chunk_id(source, page, position)
+           for source in ("a.pdf", "b.pdf") for page in range(20) for position in range(10)}
+    assert len(ids) == 2 * 20 * 10
+    assert all(0 <= i < 1 << 63 for i in ids)   # FAISS ids are signed, -1 means no result
+    assert chunk_id("a.pdf", 1, 0) == chunk_id("a.pdf", 1, 0)
+
+
+DIM = 16
+
+
+def _rows(n, start=0, text="chunk"):
+    return [{"id": chunk_id("a.pdf", i, 0), "source": "a.pdf", "page": i, "section": "General", "text": f"{text} {i}"}
+            for i in range(start, start + n)]
+
+
+def _vectors(n, seed):
+    X = np.random.default_rng(seed).standard_normal((n, DIM)).astype("float32")
+    return X / np.linalg.norm(X, axis=1, keepdims=True)
+
+
+def _index(kind, n=200, index_dir=""):
+    rows, X = _rows(n), _vectors(n, 0)
+    order = np.argsort([r["id"] for r in rows])
+    rows, X = [rows[i] for i in order], X[order]
+    ids = np.array([r["id"] for r in rows], dtype="int64")
+    index, params = build_ann_index(X, kind, default_params(kind, n, DIM, "none"), ids=ids)
+    manifest = {"index_kind": kind, "trained_count": n, "churn": 0, "embed_model": "test", "embed_dims": DIM}
+    return ChunkIndex(index, kind, params, rows, X, manifest, None, index_dir)
+
+
+def _top(ci, x):
+    _, ids = ci.index.search(x.reshape(1, -1), 1)
+    return int(ids[0, 0])
+
+
+@pytest.mark.parametrize("kind", ["flat", "hnsw"])   # removed in place / graph rebuilt
+def test_apply_upserts_and_deletes(kind):
+    ci = _index(kind)
+    updated, added = _rows(2, text="edited"), _rows(3, start=500)
+    X = _vectors(5, 1)
+    gone = [chunk_id("a.pdf", 10, 0), chunk_id("a.pdf", 11, 0), 12345]   # the last was never indexed
+
+    result = ci.apply(updated + added, X, gone)
+
+    assert result == {"added": 3, "updated": 2, "deleted": 2, "compacted": False}
+    assert len(ci.rows) == len(ci.vectors) == ci.index.ntotal == 200 + 3 - 2
+    assert ci.ids.tolist() == sorted(ci.ids.tolist())
+    for row, x in zip(updated + added, X):
+        j = ci.find([row["id"]])[0]
+        assert ci.rows[j]["text"] == row["text"] and np.allclose(ci.vectors[j], x)
+        assert _top(ci, x) == row["id"]
+    assert (ci.find(gone) == -1).all()
+
+
+def test_delete_and_duplicate_ids():
+    ci = _index("flat")
+    assert ci.delete([ci.rows[0]["id"]])["deleted"] == 1
+    assert ci.index.ntotal == 199
+    with pytest.raises(ValueError):
+        ci.apply(_rows(1) * 2, _vectors(2, 2))
+
+
+def test_churn_past_the_ratio_compacts():
+    ci = _index("ivf")
+    ci.apply(_rows(20, text="edited"), _vectors(20, 3))   # 20 + 20 churn: under 0.3 x 200
+    assert not ci.needs_compaction(0.3)
+    assert ci.manifest["churn"] == 40
+
+    result = ci.apply(_rows(20, start=300), _vectors(20, 4), [r["id"] for r in _rows(20, start=50)])
+    assert result["compacted"]   # 40 + 40 > 0.3 x 200
+    assert (ci.manifest["churn"], ci.manifest["trained_count"]) == (0, 200)
+    assert not ci.needs_compaction(0) and not _index("flat").needs_compaction(0.01)   # 0 = off; flat never
+
+
+def test_save_publishes_and_reopens(tmp_path):
+    ci = _index("flat", index_dir=str(tmp_path))
+    ci.apply(_rows(2, start=500), _vectors(2, 5))
+    published = ci.save()
+
+    reopened = ChunkIndex.open(str(tmp_path))
+    assert reopened.files.version == published.version
+    assert reopened.ids.tolist() == ci.ids.tolist()
+    assert np.allclose(reopened.vectors, ci.vectors)
+    assert reopened.manifest["churn"] == 2
@@ -0,0 +1,66 @@
+"""
+chunks.bin round trips: a change to the format must keep reading what
+write_chunks wrote, or bump MAGIC.
+"""
+import hashlib
+
+import numpy as np
+
+from chunk_store import MAGIC, ChunkStore, encode_chunks, load_rows, open_chunks, term_counts, write_chunks
+
+ROWS = [
+    {"id": 7, "source": "imirire.pdf", "page": 1, "section": "General", "text": "Umwana yonka amashereka.",
+     "tokens": 6},
+    {"id": 42, "source": "imirire.pdf", "page": 2, "section": "Imirire", "text": "", "tokens": 0},
+    {"id": 1 << 62, "source": "guide.pdf", "page": 10, "section": "General",
+     "text": "Ébé UMWANA — ubufasha bw'ibanze\nku mwana.", "tokens": 11},
+]
+
+# sha256 of encode_chunks(ROWS, {"build": "test"}); changes only with the on-disk format
+FORMAT_SHA256 = "29f29378abea19711045207dc4324871a14eb271efcdaedbb5a7d685d3bb6618"
+
+
+def test_round_trip_through_file(tmp_path):
+    path = str(tmp_path / "chunks.bin")
+    assert write_chunks(path, iter(ROWS), info={"build": "test"}) == len(ROWS)
+    for use_mmap in (True, False):
+        store = open_chunks(path, use_mmap)
+        assert len(store) == len(ROWS)
+        assert list(store) == ROWS
+        assert store[-1] == ROWS[-1]
+        assert store[1:] == ROWS[1:]
+        assert list(store.texts()) == [r["text"] for r in ROWS]
+        assert store.info == {"build": "test"}
+        assert store.source(2) == "guide.pdf"
+    assert list(load_rows(path)) == ROWS
+
+
+def test_file_and_memory_encodings_match(tmp_path):
+    path = tmp_path / "chunks.bin"
+    write_chunks(str(path), ROWS, info={"build": "test"})
+    data = path.read_bytes()
+    assert data == encode_chunks(ROWS, {"build": "test"})
+    assert data.startswith(MAGIC)
+    assert hashlib.sha256(data).hexdigest() == FORMAT_SHA256
+
+
+def test_find_by_chunk_id():
+    store = ChunkStore.from_rows(ROWS)
+    assert store.find([42, 7, 1 << 62, 8]).tolist() == [1, 0, 2, -1]
+    assert ChunkStore.from_rows([]).find([1]).tolist() == [-1]
+
+
+def test_term_counts_match_lowercased_rows():
+    terms = ["umwana", "mwana", "é", "ubufasha"]
+    expected = [sum(r["text"].lower().count(t) for t in terms) for r in ROWS]
+    ascii_rows = [dict(r, text=r["text"].replace("É", "E")) for r in ROWS * 3]
+    assert ChunkStore.from_rows(ROWS).term_counts(terms).tolist() == expected
+    assert term_counts(ROWS, terms).tolist() == expected
+    assert ChunkStore.from_rows(ascii_rows).term_counts(terms).tolist() == term_counts(ascii_rows, terms).tolist()
+    assert not ChunkStore.from_rows(ROWS).term_counts([]).any()
+
+
+def test_legacy_meta_jsonl(tmp_path):
+    path = tmp_path / "meta.jsonl"
+    path.write_text('{"source": "a.pdf", "page": 1, "text": "x"}\n\n', encoding="utf-8")
+    assert load_rows(str(path)) == [{"source": "a.pdf", "page": 1, "text": "x"}]
@@ -0,0 +1,51 @@
+"""Sentence-aware chunking (chunk_texts / _pack) and the plain token windows of chunk_by_tokens."""
+from utils import _pack, chunk_by_tokens, chunk_texts
+
+
+def _sentence(i, size):
+    """An ASCII sentence of `size` characters (one byte-level token each) without spaces."""
+    head = f"Interuro{i}"
+    return head + "x" * (size - len(head) - 1) + "."
+
+
+def test_pack_fills_windows_and_carries_the_overlap():
+    pieces = [(f"s{i}", 10) for i in range(10)]
+    chunks = _pack(pieces, chunk_size=30, overlap=10)
+    assert chunks[0] == ("s0 s1 s2", 30)
+    assert chunks[1] == ("s2 s3 s4", 30)   # s2 repeated: it fits in the 10-token overlap
+    assert chunks[-1][0].endswith("s9")
+    assert all(size <= 30 for _, size in chunks)
+
+
+def test_pack_carries_no_more_than_the_next_sentence_allows():
+    chunks = _pack([("a", 10), ("b", 10), ("c", 25)], chunk_size=30, overlap=20)
+    assert chunks == [("a b", 20), ("c", 25)]   # carrying b would push c over 30
+    assert _pack([("big", 50), ("a", 5)], chunk_size=30, overlap=10) == [("big", 50), ("a", 5)]
+    assert _pack([], 30, 10) == []
+
+
+def test_chunks_keep_sentences_whole(byte_encoder):
+    sentences = [_sentence(i, 40) for i in range(12)]
+    [chunks] = chunk_texts([" ".join(sentences)], chunk_size=100, overlap=45)
+    assert len(chunks) > 1
+    for text, tokens in chunks:
+        assert tokens <= 100
+        assert tokens == len(text) + 1   # each sentence counted with its joining space
+        assert all(s in sentences for s in text.split(" "))
+    for (prev, _), (nxt, _) in zip(chunks, chunks[1:]):
+        assert prev.split(" ")[-1] == nxt.split(" ")[0]   # one 41-token sentence of overlap
+    assert " ".join(dict.fromkeys(s for text, _ in chunks for s in text.split(" "))) == " ".join(sentences)
+
+
+def test_an_over_long_sentence_is_cut_into_token_windows(byte_encoder):
+    long = "a" * 250 + "."
+    [chunks] = chunk_texts([f"Mbere. {long} Nyuma."], chunk_size=100, overlap=0)
+    assert [tokens for _, tokens in chunks] == [7, 100, 100, 59]   # the 52-token tail packs with " Nyuma."
+    assert chunks[3][0] == "a" * 51 + ". Nyuma."
+    assert "".join(text for text, _ in chunks[1:3]) + chunks[3][0][:52] == long
+    assert chunk_texts(["", "Imwe."], 100, 0) == [[], [("Imwe.", 6)]]
+
+
+def test_chunk_by_tokens_keeps_its_900_200_windows(byte_encoder):
+    chunks = chunk_by_tokens("k" * 2000)
+    assert [len(c) for c in chunks] == [900, 900, 600]   # windows start every 700 tokens
@@ -0,0 +1,62 @@
+"""What a request answers once its deadline or token cap is reached: cache, then snippet, then fallback."""
+import pytest
+
+import deadline
+import metrics
+from deadline import AnswerCache, DeadlineExceeded, best_effort, snippet
+
+CHUNK = {"text": "Umwana yonswa amezi 6 gusa. Nyuma yaho ahabwa n'ibindi biryo. " * 20,
+         "source": "imirire.pdf", "page": 12}
+
+
+@pytest.fixture
+def answers(monkeypatch):
+    cache = AnswerCache(size=2)
+    monkeypatch.setattr(deadline, "ANSWERS", cache)
+    return cache
+
+
+def test_cached_answer_first_for_the_same_index_version(answers):
+    answers.put("Umwana yonswa kugeza ryari?", "Amezi 6.", "v1")
+    with metrics.tracing() as trace, deadline.request(5) as dl:
+        # case and spacing do not matter
+        assert best_effort("  umwana yonswa   KUGEZA ryari? ", [CHUNK], "fallback", "v1") == "Amezi 6."
+    assert (dl.degraded, trace.route) == ("cached", "deadline")
+
+    # another index version never gets it: the best chunk retrieved so far instead
+    with deadline.request(5) as dl:
+        answer = best_effort("Umwana yonswa kugeza ryari?", [CHUNK], "fallback", "v2")
+    assert answer == snippet(CHUNK) and dl.degraded == "snippet"
+
+
+def test_fallback_without_cache_or_chunks(answers):
+    with metrics.tracing() as trace, deadline.request(5) as dl:
+        assert best_effort("Ikibazo gishya", [], "fallback", "v1", reason="budget") == "fallback"
+    assert (dl.degraded, trace.route) == ("fallback", "budget")
+
+
+def test_answer_cache_drops_the_least_recently_used(answers):
+    answers.put("a", "A")
+    answers.put("b", "B")
+    assert answers.get("a") == "A"   # a is now the most recent
+    answers.put("c", "C")
+    assert (answers.get("a"), answers.get("b"), answers.get("c")) == ("A", None, "C")
+    off = AnswerCache(size=0)
+    off.put("a", "A")
+    assert off.get("a") is None
+
+
+def test_snippet_ends_on_a_sentence_with_its_source():
+    text, source = snippet(CHUNK, limit=100).split("\n\n")
+    assert len(text) <= 100 and text.endswith(".")
+    assert source == "(imirire.pdf, p.12)"
+
+
+def test_too_little_time_left_for_a_call():
+    with deadline.request(0) as dl:
+        assert dl is None and deadline.timeout() is None
+    with deadline.request(deadline.MIN_CALL_SECONDS / 2):
+        with pytest.raises(DeadlineExceeded):
+            deadline.timeout()
+    with deadline.request(30):
+        assert 29 < deadline.timeout() <= 30
@@ -0,0 +1,101 @@
+"""Build-time embedding requests: the RPM/TPM budget, retries and concurrent batches."""
+import base64
+import threading
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+import embeddings
+from embeddings import RateLimiter, create_embeddings, embed_batches
+from openai_replay import InjectedRateLimitError
+
+
+def _vector(text, dim=4):
+    return np.full(dim, len(text), dtype="<f4")
+
+
+class Client:
+    """embeddings.create that fails the first `fail` calls with `error`."""
+
+    def __init__(self, fail=0, error=None):
+        self.fail, self.error = fail, error
+        self.calls = 0
+        self._lock = threading.Lock()
+        self.embeddings = SimpleNamespace(create=self.create)
+
+    def create(self, input, **kwargs):
+        with self._lock:
+            self.calls += 1
+            if self.calls <= self.fail:
+                raise self.error
+        data = [SimpleNamespace(index=i, embedding=base64.b64encode(_vector(t).tobytes()).decode())
+                for i, t in enumerate(input)]
+        return SimpleNamespace(data=data, usage=SimpleNamespace(prompt_tokens=len(input)))
+
+
+@pytest.fixture
+def paused(clock, monkeypatch):
+    monkeypatch.setattr(embeddings, "time", clock)
+    return clock
+
+
+def test_rpm_waits_for_the_window(paused):
+    limiter = RateLimiter(rpm=2)
+    limiter.acquire(1)
+    limiter.acquire(1)
+    assert paused.slept == []
+    limiter.acquire(1)   # the third request of the minute waits for the first to leave the window
+    assert paused.now - 1000.0 >= RateLimiter.WINDOW
+
+
+def test_tpm_budget_and_oversized_requests(paused):
+    limiter = RateLimiter(tpm=100)
+    limiter.acquire(500)   # bigger than the budget: goes out alone
+    assert paused.slept == []
+    limiter.acquire(10)
+    assert paused.now - 1000.0 >= RateLimiter.WINDOW
+    start = paused.now
+    limiter.acquire(80)
+    assert paused.now == start   # 10 + 80 fits
+
+
+def test_no_limits_never_wait(paused):
+    limiter = RateLimiter()
+    for _ in range(1000):
+        limiter.acquire(10 ** 6)
+    assert paused.slept == []
+
+
+def test_429_is_retried_after_the_servers_wait(paused):
+    client = Client(fail=2, error=InjectedRateLimitError("Rate limit reached. Please try again in 0.2s."))
+    response = create_embeddings(client, ["a", "bb"], model="m", dims=4)
+    assert client.calls == 3 and len(response.data) == 2
+    assert paused.slept == [0.2, 0.2]
+
+
+def test_retries_give_up_and_quota_errors_are_not_retried(paused):
+    client = Client(fail=10, error=InjectedRateLimitError("Rate limit reached."))
+    with pytest.raises(InjectedRateLimitError):
+        create_embeddings(client, ["a"], model="m", dims=4, max_retries=2)
+    assert client.calls == 3
+    assert paused.slept[1] > paused.slept[0]   # exponential backoff
+
+    quota = InjectedRateLimitError("You exceeded your current quota.")
+    quota.code = "insufficient_quota"
+    client = Client(fail=1, error=quota)
+    with pytest.raises(InjectedRateLimitError):
+        create_embeddings(client, ["a"], model="m", dims=4)
+    assert client.calls == 1
+
+
+def test_concurrent_batches_land_in_their_rows():
+    batches = [[f"text {'x' * i}" for i in range(start, start + 5)] for start in range(0, 40, 5)]
+    out = np.zeros((40, 4), dtype="float32")
+
+    def on_batch(i, vectors):
+        out[i * 5:(i + 1) * 5] = vectors
+
+    embed_batches(Client(), batches, 4, on_batch, model="m", dims=4, concurrency=4)
+    expected = np.stack([_vector(t) for batch in batches for t in batch])
+    assert np.array_equal(out, expected)
@@ -0,0 +1,66 @@
+"""Publishing, resolving and pruning index versions in a scratch INDEX_DIR."""
+import json
+import os
+
+import pytest
+
+from index_version import (
+    FILES, check_files, current_version, list_versions, prune, publish, resolve_index, stage_version,
+)
+
+
+def _build(index_dir, payload: bytes):
+    staged = stage_version(index_dir)
+    for key in ("faiss", "chunks", "vectors"):
+        with open(getattr(staged, f"{key}_path"), "wb") as f:
+            f.write(payload + key.encode())
+    with open(staged.manifest_path, "w", encoding="utf-8") as f:
+        json.dump({"index_kind": "flat"}, f)
+    return staged
+
+
+def test_publish_resolves_to_sealed_version(tmp_path):
+    index_dir = str(tmp_path)
+    staged = _build(index_dir, b"v1")
+    assert current_version(index_dir) is None
+    assert list_versions(index_dir) == []   # staging dirs are invisible
+
+    published = publish(staged, index_dir, keep=3)
+    assert current_version(index_dir) == staged.version
+    assert not os.path.exists(staged.directory)
+    found = resolve_index(index_dir, verify=True)
+    assert found.version == staged.version
+    assert found.directory == published.directory
+    with open(found.manifest_path, encoding="utf-8") as f:
+        manifest = json.load(f)
+    assert manifest["version"] == staged.version
+    assert sorted(manifest["files"]) == sorted(FILES[k] for k in ("faiss", "chunks", "vectors"))
+    assert check_files(found, checksums=True) == []
+
+
+def test_damaged_version_is_refused(tmp_path):
+    index_dir = str(tmp_path)
+    found = publish(_build(index_dir, b"v1"), index_dir)
+    with open(found.chunks_path, "r+b") as f:   # same size, other bytes
+        f.write(b"X")
+    assert resolve_index(index_dir, verify=False).version == found.version   # sizes only
+    with pytest.raises(ValueError, match="checksum mismatch"):
+        resolve_index(index_dir, verify=True)
+    with open(found.vectors_path, "ab") as f:
+        f.write(b"more")
+    with pytest.raises(ValueError, match="vectors.npy has"):
+        resolve_index(index_dir, verify=False)
+
+
+def test_prune_keeps_newest_and_current(tmp_path):
+    index_dir = str(tmp_path)
+    published = [publish(_build(index_dir, b"v%d" % i), index_dir, keep=2) for i in range(4)]
+    assert list_versions(index_dir) == [p.version for p in published[-2:]]
+    assert current_version(index_dir) == published[-1].version
+
+    # a rolled-back current version survives pruning even when it is not among the newest
+    link = os.path.join(index_dir, "current")
+    os.remove(link)
+    os.symlink(os.path.join("versions", published[2].version), link)
+    prune(index_dir, keep=1)
+    assert list_versions(index_dir) == [published[2].version, published[3].version]
@@ -0,0 +1,57 @@
+"""An upload goes through IngestQueue and a build in its own process to a published index version."""
+import os
+import shutil
+import threading
+import time
+
+import ingest
+from conftest import OTHER_PDF
+from index_version import current_version
+from ingest import IngestQueue
+
+
+def _wait(queue, job_id, timeout=300):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = queue.get(job_id)
+        if job.state in ("done", "failed"):
+            return job
+        time.sleep(0.2)
+    raise AssertionError(f"job {job_id} still {job.state} after {timeout}s")
+
+
+def _upload(queue, tmp_path, name="guide.pdf"):
+    upload = str(tmp_path / "upload.pdf")
+    shutil.copyfile(OTHER_PDF, upload)
+    return queue.submit(upload, name)
+
+
+def test_submit_publishes_a_new_version(build_env, tmp_path, monkeypatch):
+    built = build_env.run()
+    assert built.returncode == 0, built.stderr
+    first = current_version(build_env.index_dir)
+    assert first is not None
+
+    monkeypatch.setattr(ingest, "DOCS_DIR", build_env.docs_dir)
+    published = threading.Event()
+    queue = IngestQueue(on_published=published.set, jobs_dir=os.path.join(build_env.index_dir, "jobs"))
+    job = _wait(queue, _upload(queue, tmp_path).id)
+    assert published.wait(30)   # the server swaps the new version in
+
+    assert job.state == "done", job.error
+    assert job.pid != os.getpid()   # the build ran in a child process
+    assert job.result["version"] not in (None, first)
+    assert current_version(build_env.index_dir) == job.result["version"]
+    assert (job.result["files_read"], job.result["files_reused"]) == (1, 1)   # only the upload was read
+    assert job.result["added"] > 0 and job.result["deleted"] == 0
+    assert os.path.exists(os.path.join(build_env.docs_dir, "guide.pdf"))
+
+
+def test_submit_without_a_build_fails_instead_of_rebuilding(build_env, tmp_path, monkeypatch):
+    monkeypatch.setattr(ingest, "DOCS_DIR", build_env.docs_dir)
+    queue = IngestQueue(jobs_dir=os.path.join(build_env.index_dir, "jobs"))
+    job = _wait(queue, _upload(queue, tmp_path).id)
+
+    assert job.state == "failed"
+    assert "build_index.py" in job.error
+    assert current_version(build_env.index_dir) is None
@@ -0,0 +1,120 @@
+"""Recording and replaying OpenAI calls: misses, synthesized answers and injected 429s / timeouts."""
+import base64
+from types import SimpleNamespace
+
+import numpy as np
+import openai
+import pytest
+from openai.types.chat import ChatCompletion
+
+from openai_replay import (
+    SYNTHETIC_REPLY, USAGE, InjectedRateLimitError, InjectedTimeoutError, Recordings, RecordingClient,
+    ReplayClient, ReplayMiss, parse_latency,
+)
+
+MESSAGES = [{"role": "user", "content": "Umwana w'amezi 6 arya iki?"}]
+
+
+class LiveClient:
+    """What RecordingClient wraps: canned chat replies and one vector per text."""
+
+    def __init__(self):
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._chat))
+        self.embeddings = SimpleNamespace(create=self._embed)
+
+    def _chat(self, **kwargs):
+        return ChatCompletion.model_validate({
+            "id": "live", "object": "chat.completion", "created": 0, "model": kwargs["model"],
+            "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": "Igikoma."}}],
+        })
+
+    def _embed(self, input, model, **kwargs):
+        data = [SimpleNamespace(index=i, embedding=base64.b64encode(np.full(4, len(t), "<f4").tobytes()).decode())
+                for i, t in enumerate(input)]
+        return SimpleNamespace(data=data)
+
+
+@pytest.fixture
+def recordings(tmp_path):
+    return Recordings(str(tmp_path / "recordings.sqlite"))
+
+
+def _content(response):
+    return response.choices[0].message.content
+
+
+def _vectors(response):
+    return [np.frombuffer(base64.b64decode(e.embedding), "<f4") for e in response.data]
+
+
+def test_replay_answers_what_was_recorded(recordings):
+    recorder = RecordingClient(LiveClient(), recordings)
+    recorder.chat.completions.create(model="m", messages=MESSAGES, temperature=0)
+    recorder.embeddings.create(input=["a", "bbb"], model="e", dimensions=4, encoding_format="base64")
+
+    replay = ReplayClient(recordings)
+    # keyword order and timeout do not change the request's key
+    assert _content(replay.chat.completions.create(temperature=0, messages=MESSAGES, model="m", timeout=3)) == "Igikoma."
+    # embeddings are stored per text, so a different batching still replays
+    vectors = _vectors(replay.embeddings.create(input=["bbb"], model="e", dimensions=4, encoding_format="base64"))
+    assert np.array_equal(vectors[0], np.full(4, 3, "<f4"))
+    assert recordings.count() == {"completions": 1, "embeddings": 2}
+
+
+def test_unrecorded_requests_raise_replay_miss(recordings):
+    replay = ReplayClient(recordings)
+    with pytest.raises(ReplayMiss):
+        replay.chat.completions.create(model="m", messages=MESSAGES)
+    with pytest.raises(ReplayMiss):
+        replay.embeddings.create(input=["a"], model="e", dimensions=4)
+
+
+def test_synthesized_answers_are_deterministic_and_counted(recordings):
+    replay = ReplayClient(recordings, miss="synthesize")
+    before = USAGE.snapshot()["replay_misses"]
+
+    reply = replay.chat.completions.create(model="m", messages=MESSAGES)
+    assert _content(reply) == SYNTHETIC_REPLY and reply.usage.total_tokens > 0
+    classifier = [{"role": "system", "content": "You are a classifier. Answer YES or NO."}] + MESSAGES
+    assert _content(replay.chat.completions.create(model="m", messages=classifier)) == "YES"
+    smalltalk = [{"role": "system", "content": "... otherwise answer NOT_SMALLTALK."}] + MESSAGES
+    assert _content(replay.chat.completions.create(model="m", messages=smalltalk)) == "NOT_SMALLTALK"
+
+    first = _vectors(replay.embeddings.create(input=["a", "b"], model="e", dimensions=8, encoding_format="base64"))
+    again = _vectors(ReplayClient(recordings, miss="synthesize").embeddings.create(
+        input=["b"], model="e", dimensions=8, encoding_format="base64"))
+    assert np.array_equal(first[1], again[0]) and not np.array_equal(first[0], first[1])
+    assert np.isclose(np.linalg.norm(first[0]), 1.0)
+
+    after = USAGE.snapshot()["replay_misses"]
+    assert (after["chat"] - before["chat"], after["embeddings"] - before["embeddings"]) == (3, 3)
+
+
+def test_injected_429s_follow_the_rate_and_seed(recordings):
+    always = ReplayClient(recordings, miss="synthesize", rate_429=1.0)
+    with pytest.raises(openai.RateLimitError) as err:
+        always.embeddings.create(input=["a"], model="e", dimensions=4)
+    assert isinstance(err.value, InjectedRateLimitError) and err.value.status_code == 429
+
+    def pattern(seed):
+        client = ReplayClient(recordings, miss="synthesize", rate_429=0.3, seed=seed)
+        out = []
+        for _ in range(50):
+            try:
+                client.embeddings.create(input=["a"], model="e", dimensions=4)
+                out.append(False)
+            except InjectedRateLimitError:
+                out.append(True)
+        return out
+
+    assert pattern(7) == pattern(7)
+    assert 0 < sum(pattern(7)) < 50
+
+
+def test_simulated_latency_longer_than_the_timeout_times_out(recordings):
+    replay = ReplayClient(recordings, miss="synthesize", chat_latency=parse_latency("fixed:50"))
+    with pytest.raises(openai.APITimeoutError) as err:
+        replay.chat.completions.create(model="m", messages=MESSAGES, timeout=0.01)
+    assert isinstance(err.value, InjectedTimeoutError)
+    with pytest.raises(ValueError):
+        parse_latency("gamma:1,2")
@@ -1,15 +1,28 @@
+import os
 import re
-from typing import List, Tuple
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
 from pypdf import PdfReader
 import tiktoken
 
+from config import PDF_WORKERS, PDF_PAGES_PER_TASK, CHUNK_SIZE, OVERLAP
+
+ENCODING = "cl100k_base"
+
 def read_pdf_text(path: str) -> List[Tuple[int, str]]:
     """
     Returns a list of (page_number, page_text) tuples.
     """
+    return read_pdf_pages(path, 0, None)
+
+
+def read_pdf_pages(path: str, start: int, stop: Optional[int]) -> List[Tuple[int, str]]:
+    """(page_number, page_text) for pages [start, stop) of one PDF (0-based range)."""
     reader = PdfReader(path)
     pages = []
-    for i, page in enumerate(reader.pages):
+    for i, page in enumerate(reader.pages[start:stop], start=start):
         try:
             txt = page.extract_text() or ""
         except Exception:
@@ -19,16 +32,140 @@ def read_pdf_text(path: str) -> List[Tuple[int, str]]:
         pages.append((i + 1, txt))
     return pages
 
+
+def pdf_page_count(path: str) -> int:
+    return len(PdfReader(path).pages)
+
+
+def iter_pdf_pages(paths: Sequence[str], workers: int = PDF_WORKERS,
+                   pages_per_task: int = PDF_PAGES_PER_TASK) -> Iterator[Tuple[str, int, str]]:
+    """
+    (path, page_number, page_text) for every page of `paths`, in file and
+    page order, extracted on a process pool. Each file is split into page
+    ranges of `pages_per_task`, so one big guide does not keep a single
+    worker busy while the others sit idle. At most 2 x `workers` ranges are
+    in flight, so memory stays bounded however many pages there are.
+    `workers` <= 1 reads in this process; 0 means one worker per CPU.
+    """
+    paths = list(dict.fromkeys(paths))
+    workers = workers or os.cpu_count() or 1
+    if workers <= 1:
+        for p in paths:
+            for page_no, txt in read_pdf_text(p):
+                yield p, page_no, txt
+        return
+
+    def tasks():
+        for p in paths:
+            n = pdf_page_count(p)
+            for start in range(0, n, pages_per_task):
+                yield p, start, min(start + pages_per_task, n)
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for task in tasks():
+            pending.append((task[0], pool.submit(read_pdf_pages, *task)))
+            while len(pending) >= 2 * workers:
+                p, future = pending.popleft()
+                for page_no, txt in future.result():
+                    yield p, page_no, txt
+        while pending:
+            p, future = pending.popleft()
+            for page_no, txt in future.result():
+                yield p, page_no, txt
+
+
+def read_pdfs(paths: Sequence[str], workers: int = PDF_WORKERS,
+              pages_per_task: int = PDF_PAGES_PER_TASK) -> Dict[str, List[Tuple[int, str]]]:
+    """
+    read_pdf_text for several PDFs on a process pool (see iter_pdf_pages).
+    Results are the same as reading the files one by one:
+    {path: [(page_number, text), ...]} in page order.
+    """
+    out: Dict[str, List[Tuple[int, str]]] = {p: [] for p in paths}
+    for p, page_no, txt in iter_pdf_pages(paths, workers, pages_per_task):
+        out[p].append((page_no, txt))
+    return out
+
 def split_into_sentences(text: str) -> List[str]:
     # Simple sentence splitter for Kinyarwanda text (periods, question marks, exclamation marks, ellipses)
     parts = re.split(r"(?<=[\.\?\!…])\s+|\n+", text)
     return [p.strip() for p in parts if p.strip()]
 
+@lru_cache(maxsize=None)
+def get_encoder(encoding_name: str = ENCODING) -> "tiktoken.Encoding":
+    """tiktoken encoder, loaded once per process (get_encoding rebuilds it from the BPE file)."""
+    return tiktoken.get_encoding(encoding_name)
+
+
+def count_tokens(texts: Sequence[str], encoding_name: str = ENCODING) -> List[int]:
+    """Token count of each text, encoded in one batch."""
+    return [len(t) for t in get_encoder(encoding_name).encode_ordinary_batch(list(texts))]
+
+
+def _pack(pieces: List[Tuple[str, int]], chunk_size: int, overlap: int) -> List[Tuple[str, int]]:
+    """Greedy windows of whole (sentence, tokens) pieces; each window repeats the last <= `overlap` tokens of the previous one."""
+    chunks = []
+    start = 0
+    while start < len(pieces):
+        end, size = start, 0
+        while end < len(pieces) and (end == start or size + pieces[end][1] <= chunk_size):
+            size += pieces[end][1]
+            end += 1
+        chunks.append((" ".join(p for p, _ in pieces[start:end]), size))
+        if end == len(pieces):
+            break
+        # carry trailing sentences over, as long as the next sentence still fits after them
+        back, carried = end, 0
+        while (back - 1 > start and carried + pieces[back - 1][1] <= overlap
+               and carried + pieces[back - 1][1] + pieces[end][1] <= chunk_size):
+            back -= 1
+            carried += pieces[back][1]
+        start = back
+    return chunks
+
+
+def chunk_texts(texts: Sequence[str], chunk_size: int = CHUNK_SIZE, overlap: int = OVERLAP,
+                encoding_name: str = ENCODING) -> List[List[Tuple[str, int]]]:
+    """
+    [(chunk_text, token_count), ...] for each of `texts`.
+
+    Windows hold up to `chunk_size` tokens and start and end on
+    split_into_sentences boundaries, so no word or sentence is cut; the
+    next window repeats up to `overlap` tokens of whole sentences. Only a
+    single sentence longer than `chunk_size` is cut, into token windows.
+    All sentences of all texts are tokenized in one batch with the cached
+    encoder. A chunk's token count is the sum over its sentences, each
+    encoded with the space that joins it, so it matches encoding the
+    chunk text to within a token.
+    """
+    enc = get_encoder(encoding_name)
+    sentences = [split_into_sentences(t) for t in texts]
+    tokens = enc.encode_ordinary_batch([" " + s for ss in sentences for s in ss])
+    out = []
+    pos = 0
+    for ss in sentences:
+        pieces = []
+        for s, toks in zip(ss, tokens[pos : pos + len(ss)]):
+            if len(toks) <= chunk_size:
+                pieces.append((s, len(toks)))
+            else:
+                for i in range(0, len(toks), chunk_size):
+                    window = toks[i : i + chunk_size]
+                    piece = enc.decode(window).strip()
+                    if piece:
+                        pieces.append((piece, len(window)))
+        pos += len(ss)
+        out.append(_pack(pieces, chunk_size, overlap))
+    return out
+
+
 def chunk_by_tokens(text: str, chunk_size: int = 900, overlap: int = 200, encoding_name: str = "cl100k_base") -> List[str]:
     """
     Token-based chunking with overlaps to keep context continuity.
+    Plain token windows; chunk_texts(..., CHUNK_SIZE, OVERLAP) keeps sentences whole.
     """
-    enc = tiktoken.get_encoding(encoding_name)
+    enc = get_encoder(encoding_name)
     toks = enc.encode(text)
     chunks = []
     i = 0